@@ -1,30 +1,256 @@
+import atexit
+import hmac
 import logging
+import os
+import threading
+import time
+from typing import Iterator, Optional
 
-from dotenv import load_dotenv
 from flask import Flask, request
 
-import set_webhook
-from telegram_utils.message_handling import handle_message
+from config import DEBUG_TOKEN, METRICS_PORT, METRICS_TOKEN, SHUTDOWN_DRAIN_TIMEOUT
+from helpers.metrics import CONTENT_TYPE, REGISTRY, Counter, format_metric
+from helpers.tracing import span, tracer
+from helpers.transit_refresh import TransitRefresher
+from helpers.transit_store import get_transit_store, pin_transit_store
+from telegram_utils.dispatcher import UpdateDispatcher
+from telegram_utils.message_handling import (
+    get_update_chat_id,
+    handle_message,
+    try_mark_update_received,
+    unmark_update_received,
+)
 
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+WEBHOOK_REQUESTS = Counter(
+    "webhook_requests_total", "Webhook requests by response status", ["status"]
+)
 
-set_webhook.main()
 
+def process_uptime() -> Optional[float]:
+    """Returns the number of seconds since this process started, or None if the platform
+    does not expose it. Measured from the process start rather than from an import, so
+    that interpreter and gunicorn startup are counted too."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces, so fields are counted after it
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - started_ticks / os.sysconf("SC_CLK_TCK")
 
-@app.route("/ping", methods=["GET"])
-def ping():
-    return "pong", 200
 
+def handle_update(update: dict):
+    # A refresh may swap the transit store mid-update; keep using the one it started with
+    with tracer.resume(update["update_id"]), pin_transit_store():
+        handle_message(update)
 
-@app.route("/webhook", methods=["POST"])
-def webhook():
-    data = request.get_json()
-    handle_message(data)
-    return "OK", 200
+
+def has_bearer_token(token: Optional[str]) -> bool:
+    if not token:
+        return False
+    return hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    )
+
+
+def is_debug_authorized() -> bool:
+    return has_bearer_token(DEBUG_TOKEN)
+
+
+def is_metrics_port() -> bool:
+    # The port the request arrived on, as gunicorn takes it from the listening socket
+    return (
+        METRICS_PORT is not None and request.environ.get("SERVER_PORT") == METRICS_PORT
+    )
+
+
+def create_dispatcher() -> UpdateDispatcher:
+    dispatcher = UpdateDispatcher(
+        handle_update,
+        workers=int(os.getenv("UPDATE_WORKERS", "8")),
+        max_pending=int(os.getenv("MAX_PENDING_UPDATES", "500")),
+    )
+    atexit.register(dispatcher.shutdown, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    return dispatcher
+
+
+class Startup:
+    """Startup tasks of a worker, and how long each took.
+
+    Creating the app does no I/O and starts no threads. The transit data is loaded and
+    indexed on a background thread, and the update dispatcher is started when the first
+    update arrives, so the worker answers /ping as soon as it is imported and /ready once
+    it can answer updates without loading anything.
+    """
+
+    def __init__(self, dispatcher: Optional[UpdateDispatcher] = None):
+        self.timings: dict[str, Optional[float]] = {"imported": process_uptime()}
+        self.ready = threading.Event()
+        self._dispatcher = dispatcher
+        self._dispatcher_lock = threading.Lock()
+
+    def get_dispatcher(self) -> UpdateDispatcher:
+        if self._dispatcher is None:
+            with self._dispatcher_lock:
+                if self._dispatcher is None:
+                    self._dispatcher = create_dispatcher()
+        return self._dispatcher
+
+    def warm_up(self):
+        """Loads and indexes the transit data, then starts keeping it up to date."""
+        started = time.perf_counter()
+        store = get_transit_store()
+        self.timings["data_load_seconds"] = time.perf_counter() - started
+        store.spatial_index
+        store.search_index
+        self.timings["index_seconds"] = (
+            time.perf_counter() - started - self.timings["data_load_seconds"]
+        )
+        TransitRefresher().start()
+        self.timings["ready"] = process_uptime()
+        self.ready.set()
+        logger.info("Startup timings: %s", self.format_timings())
+
+    def first_request(self):
+        if "first_request" not in self.timings:
+            self.timings["first_request"] = process_uptime()
+            logger.info("Startup timings: %s", self.format_timings())
+
+    def collect_metrics(self) -> Iterator[str]:
+        yield from format_metric(
+            "worker_ready",
+            "gauge",
+            "1 once the worker can answer updates without loading anything",
+            [((), int(self.ready.is_set()))],
+        )
+        # Reported once the dispatcher exists, rather than starting it to report zeros
+        dispatcher = self._dispatcher
+        if dispatcher is None:
+            return
+        yield from format_metric(
+            "dispatcher_pending_updates",
+            "gauge",
+            "Updates queued or being handled",
+            [((), dispatcher.pending)],
+        )
+        yield from format_metric(
+            "dispatcher_shed_updates_total",
+            "counter",
+            "Updates rejected with 503 because the queue was full",
+            [((), dispatcher.shed)],
+        )
+
+    def format_timings(self) -> str:
+        return ", ".join(
+            f"{name} {value:.3f}s" if value is not None else f"{name} unknown"
+            for name, value in self.timings.items()
+        )
+
+
+def create_app(
+    dispatcher: Optional[UpdateDispatcher] = None, warm_up: bool = True
+) -> Flask:
+    """Creates the app.
+
+    Args:
+        dispatcher (Optional[UpdateDispatcher]): Dispatcher to queue updates on, created
+                                                 when the first update arrives if not
+                                                 given.
+        warm_up (bool): Whether to load the transit data in the background now rather
+                        than when the first update needs it.
+
+    Returns:
+        Flask: The app.
+    """
+    app = Flask(__name__)
+    startup = Startup(dispatcher)
+    app.extensions["startup"] = startup
+    REGISTRY.register_collector("startup", startup.collect_metrics)
+
+    @app.route("/ping", methods=["GET"])
+    def ping():
+        return "pong", 200
+
+    @app.route("/ready", methods=["GET"])
+    def ready():
+        # Unlike /ping, only succeeds once an update can be answered without a cold load
+        body = {"ready": startup.ready.is_set(), "timings": startup.timings}
+        return body, 200 if startup.ready.is_set() else 503
+
+    @app.before_request
+    def only_metrics_on_metrics_port():
+        if is_metrics_port() and request.path != "/metrics":
+            return "Not Found", 404
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        # Hidden like /debug unless scraped over the private network
+        if not (is_metrics_port() or has_bearer_token(METRICS_TOKEN)):
+            return "Not Found", 404
+        return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+    @app.route("/debug/tracing", methods=["GET", "POST"])
+    def debug_tracing():
+        # Hidden rather than refused, so that the endpoint is not advertised
+        if not is_debug_authorized():
+            return "Not Found", 404
+        if request.method == "POST":
+            settings = request.get_json(silent=True)
+            if not isinstance(settings, dict):
+                return "Bad Request", 400
+            try:
+                tracer.configure(
+                    sample_rate=settings.get("sample_rate"),
+                    profile=settings.get("profile"),
+                    slow_seconds=settings.get("slow_seconds"),
+                )
+            except (TypeError, ValueError) as e:
+                return str(e), 400
+        return tracer.settings(), 200
+
+    @app.route("/debug/profile", methods=["GET"])
+    def debug_profile():
+        if not is_debug_authorized():
+            return "Not Found", 404
+        return tracer.profile_report(), 200, {"Content-Type": "text/plain"}
+
+    @app.route("/webhook", methods=["POST"])
+    def webhook():
+        startup.first_request()
+        trace = tracer.sample()
+        with tracer.activate(trace):
+            with span("parse"):
+                data = request.get_json(silent=True)
+            body, status = receive_update(data, trace)
+        WEBHOOK_REQUESTS.inc(str(status))
+        return body, status
+
+    def receive_update(data, trace) -> tuple[str, int]:
+        if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+            return "Bad Request", 400
+        chat_id = get_update_chat_id(data)
+        if chat_id is None or not try_mark_update_received(data["update_id"]):
+            return "OK", 200
+        tracer.hand_off(trace, data["update_id"])
+        if not startup.get_dispatcher().submit(chat_id, data):
+            # Telegram redelivers updates that are not acknowledged with a 2xx, so
+            # shedding with 503 postpones the update instead of losing it
+            tracer.discard(data["update_id"])
+            unmark_update_received(data["update_id"])
+            return "Busy", 503
+        return "OK", 200
+
+    if warm_up:
+        threading.Thread(
+            target=startup.warm_up, name="startup-warm-up", daemon=True
+        ).start()
+    return app
 
 
 if __name__ == "__main__":
     logging.basicConfig(filename="bot.log", filemode="w", level=logging.DEBUG)
-    app.run(debug=True, port=5000)
+    create_app().run(debug=True, port=5000)
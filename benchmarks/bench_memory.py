@@ -0,0 +1,76 @@
+"""Reports the memory used by the TransitStore in each of several worker processes.
+
+Each worker loads the store the way gunicorn workers do, and reports its resident
+memory once every worker has loaded, so that Pss (resident memory with shared pages
+split between the processes sharing them) reflects the sharing of the memory-mapped
+snapshot. Run from the repository root after python -m storage.create_maps:
+
+    python -m benchmarks.bench_memory [workers]
+"""
+
+import subprocess
+import sys
+
+FIELDS = ("Rss", "Pss", "Anonymous")
+
+WORKER = """
+import sys
+from helpers.transit_store import TransitStore
+
+def memory():
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in %r:
+                fields[name] = int(value.split()[0]) / 1024
+    return fields
+
+store = getattr(TransitStore, sys.argv[1])()
+if sys.argv[2] == "indexed":
+    store.spatial_index
+    store.search_index
+print("ready", flush=True)
+sys.stdin.readline()
+print(" ".join(f"{value:.1f}" for value in memory().values()), flush=True)
+""" % (
+    FIELDS,
+)
+
+
+def measure(loader: str, stage: str, workers: int) -> list[list[float]]:
+    """Starts the workers, waits for all of them to load, then collects their memory."""
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, loader, stage],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        assert process.stdout.readline().strip() == "ready"
+    results = []
+    for process in processes:
+        output, _ = process.communicate("\n")
+        results.append([float(value) for value in output.split()])
+    return results
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    print(f"MiB per worker, mean of {workers} workers")
+    print(f"{'':<30}" + "".join(f"{field:>11}" for field in FIELDS))
+    for loader in ("from_json", "from_snapshot"):
+        for stage in ("loaded", "indexed"):
+            results = measure(loader, stage, workers)
+            means = [sum(column) / len(column) for column in zip(*results)]
+            print(
+                f"{f'{loader} ({stage})':<30}"
+                + "".join(f"{mean:>11.1f}" for mean in means)
+            )
+
+
+if __name__ == "__main__":
+    main()
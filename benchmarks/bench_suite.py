@@ -0,0 +1,325 @@
+"""Microbenchmarks of the hot paths of handling an update, against the real storage/
+datasets with DataMall and the Bot API stubbed out.
+
+Each case runs a representative mix of inputs: the busiest interchanges, the longest
+routes, free-text searches including typos, and random locations across Singapore.
+Results are written as JSON and compared against a stored baseline; the run fails if
+the mean time per call of any case regressed by more than the threshold. Timings depend
+on the machine, so regenerate the baseline before comparing on a different one, and
+rerun before trusting a regression on a shared or throttled CPU.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_suite                    # compare with the baseline
+    python -m benchmarks.bench_suite --update-baseline  # after an intended change
+"""
+
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from helpers.helpers import get_bus_route, search_bus_stop_descriptions
+from helpers.transit_store import TransitStore, get_transit_store
+from lta_utils import lta_api
+from telegram_utils import messaging
+from telegram_utils.commands import (
+    get_closest_k_stops,
+    get_route_dir,
+    keyboards,
+    route_keyboard,
+    send_bus_services,
+)
+
+BASELINE_PATH = "benchmarks/baseline.json"
+THRESHOLD = 0.25
+# Each measurement repeats a call for at least this long, and the best of ROUNDS is kept
+MIN_MEASURE_SECONDS = 0.005
+ROUNDS = 7
+
+SEARCH_QUERIES = [
+    "ang mo kio int",
+    "tampines",
+    "bedok stn",
+    "opp blk 10",
+    "raffles",
+    "jurong east",
+    "woodlands int",
+    "changi airport",
+    "orchard",
+    "bt batok",
+    "serangoon",
+    "clementi stn",
+    "sengkang",
+    "ang",
+    # Typos, which fall through to the fuzzy tier
+    "tampnes",
+    "wodlands",
+    "bedokk int",
+    "pungol",
+]
+
+# Random locations are up to this far from a random bus stop, in degrees (about 1 km),
+# since users are on land rather than anywhere in the bounding box of Singapore
+LOCATION_JITTER = 0.01
+
+
+class StubScheduler:
+    """Stands in for the send scheduler, so that no Bot API requests are made."""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, method, payload, chat_id=None, priority=None) -> Future:
+        self.submitted += 1
+        future = Future()
+        future.set_result({"ok": True})
+        return future
+
+
+class StubResponse:
+    status_code = 200
+
+    def __init__(self, body: dict):
+        self.body = body
+
+    def json(self) -> dict:
+        return self.body
+
+
+class StubDataMallSession:
+    """Answers BusArrival requests with every service of the stop arriving soon. The
+    responses are prepared up front so that the stub costs nothing per request."""
+
+    def __init__(self, store: TransitStore, codes: list[str]):
+        now = datetime.now(timezone(timedelta(hours=8)))
+        self.responses = {}
+        for code in codes:
+            services = []
+            for i, key in enumerate(store.routes):
+                if not store.get_route_directions(key, code):
+                    continue
+                service = store.get_service(key)
+                services.append(
+                    {
+                        "ServiceNo": service["ServiceNo"] if service else key.upper(),
+                        **{
+                            name: {
+                                "EstimatedArrival": (
+                                    now + timedelta(minutes=(i + 7 * n) % 30 + 1)
+                                ).isoformat(timespec="seconds"),
+                                "Load": "SEA",
+                                "Type": "DD",
+                            }
+                            for n, name in enumerate(
+                                ("NextBus", "NextBus2", "NextBus3")
+                            )
+                        },
+                    }
+                )
+            self.responses[code] = StubResponse({"Services": services})
+
+    def get(self, url, params):
+        return self.responses[params["BusStopCode"]]
+
+
+def busiest_stops(store: TransitStore, n: int) -> list[str]:
+    """Returns the n bus stops served by the most routes, such as interchanges."""
+    offsets = store.sections["stop_route_offs"]
+    counts = sorted(range(len(store.stops)), key=lambda i: offsets[i] - offsets[i + 1])
+    return [store.stops.code(i) for i in counts[:n]]
+
+
+def longest_routes(store: TransitStore, n: int) -> list[tuple[str, str]]:
+    routes = [
+        (len(stops), service_no, direction)
+        for service_no, directions in store.routes.items()
+        for direction, stops in directions.items()
+    ]
+    return [(service_no, direction) for _, service_no, direction in sorted(routes)[-n:]]
+
+
+def random_locations(
+    store: TransitStore, rng: random.Random, n: int
+) -> list[tuple[float, float]]:
+    locations = []
+    for _ in range(n):
+        i = rng.randrange(len(store.stops))
+        locations.append(
+            (
+                store.stops.latitudes[i] + rng.uniform(-1, 1) * LOCATION_JITTER,
+                store.stops.longitudes[i] + rng.uniform(-1, 1) * LOCATION_JITTER,
+            )
+        )
+    return locations
+
+
+def build_cases(
+    store: TransitStore, stops: list[str]
+) -> dict[str, list[tuple[Callable, tuple]]]:
+    """Returns the calls of each case, as (function, args)."""
+    rng = random.Random(2024)
+    route_dirs = [
+        (service_no, code)
+        for code in stops
+        for service_no in store.routes
+        if store.get_route_directions(service_no, code)
+    ]
+
+    def send_bus_services_uncached(code: str):
+        # Every call goes through the (stubbed) BusArrival request and parsing
+        lta_api.arrival_cache.clear()
+        send_bus_services(1, code)
+
+    def route_keyboard_uncached(service_no: str, direction: str):
+        keyboards.clear()
+        route_keyboard(service_no, direction)
+
+    cases = {
+        "search_bus_stop_descriptions": [
+            (search_bus_stop_descriptions, (query,)) for query in SEARCH_QUERIES
+        ],
+        "get_closest_k_stops": [
+            (get_closest_k_stops, (location, 5))
+            for location in random_locations(store, rng, 50)
+        ],
+        "get_closest_k_stops_radius": [
+            (get_closest_k_stops, (location, 5, 500))
+            for location in random_locations(store, rng, 50)
+        ],
+        "get_route_dir": [(get_route_dir, args) for args in route_dirs],
+        "get_bus_route": [(get_bus_route, args) for args in longest_routes(store, 20)],
+        "route_keyboard_uncached": [
+            (route_keyboard_uncached, args) for args in longest_routes(store, 20)
+        ],
+        "route_keyboard": [
+            (route_keyboard, args) for args in longest_routes(store, 20)
+        ],
+        "send_bus_services": [(send_bus_services_uncached, (code,)) for code in stops],
+    }
+    # An update stream is mostly bus stop lookups, then searches and locations
+    mixed = (
+        cases["send_bus_services"] * 4
+        + cases["search_bus_stop_descriptions"]
+        + cases["get_closest_k_stops"][:20]
+        + cases["get_bus_route"]
+    )
+    rng.shuffle(mixed)
+    cases["mixed"] = mixed
+    return cases
+
+
+def time_call(fn: Callable, args: tuple) -> float:
+    """Returns the best time per call in seconds over ROUNDS measurements. As in timeit,
+    the garbage collector is paused so that collections do not land on random calls."""
+    start = time.perf_counter()
+    fn(*args)
+    once = time.perf_counter() - start
+    number = max(1, int(MIN_MEASURE_SECONDS / max(once, 1e-9)))
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn(*args)
+            best = min(best, (time.perf_counter() - start) / number)
+    finally:
+        gc.enable()
+    return best
+
+
+def run(cases: dict[str, list[tuple[Callable, tuple]]]) -> dict[str, dict]:
+    results = {}
+    for name, calls in cases.items():
+        times = sorted(time_call(fn, args) for fn, args in calls)
+        results[name] = {
+            "calls": len(times),
+            "mean_us": statistics.fmean(times) * 1e6,
+            "median_us": statistics.median(times) * 1e6,
+            "p95_us": times[min(len(times) - 1, int(len(times) * 0.95))] * 1e6,
+        }
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Prints the results next to the baseline and returns the regressed cases."""
+    regressions = []
+    print(
+        f"{'case':<32}{'mean':>12}{'median':>12}{'p95':>12}{'baseline':>12}{'change':>10}"
+    )
+    for name, result in results.items():
+        line = (
+            f"{name:<32}{result['mean_us']:>9.1f} us{result['median_us']:>9.1f} us"
+            f"{result['p95_us']:>9.1f} us"
+        )
+        before = baseline.get(name)
+        if before:
+            change = result["mean_us"] / before["mean_us"] - 1
+            line += f"{before['mean_us']:>9.1f} us{change:>+9.0%}"
+            if change > threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="Largest allowed increase of the mean time per call, e.g. 0.25 for 25%%",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing",
+    )
+    args = parser.parse_args()
+
+    store = get_transit_store()
+    store.spatial_index
+    store.search_index
+    stops = busiest_stops(store, 20)
+    messaging._scheduler = StubScheduler()
+    lta_api.session = StubDataMallSession(store, stops)
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": run(build_cases(store, stops)),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        compare(results["results"], {}, args.threshold)
+        return
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    except FileNotFoundError:
+        baseline = {}
+        print(f"No baseline at {args.baseline}")
+    regressions = compare(results["results"], baseline, args.threshold)
+    if regressions:
+        print(f"Regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Compares per-lookup latency of the helpers before and after the TransitStore.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_transit_store
+"""
+
+import json
+import time
+
+from helpers.helpers import (
+    get_bus_directions,
+    get_bus_route,
+    get_bus_stop_description,
+    get_bus_stop_location,
+    search_bus_stop_descriptions,
+)
+from helpers.transit_store import TransitStore, get_transit_store
+from telegram_utils.commands import get_route_dir
+
+
+def legacy_get_bus_stop_description(code: str) -> str:
+    with open("storage/bus_stop_map_code.json", "r") as f:
+        return json.load(f)[code]["Description"]
+
+
+def legacy_get_bus_stop_location(code: str) -> tuple[str, str]:
+    with open("storage/bus_stop_map_code.json", "r") as f:
+        bus_stops = json.load(f)
+        return bus_stops[code]["Latitude"], bus_stops[code]["Longitude"]
+
+
+def legacy_get_bus_directions(service_no: str) -> list[dict]:
+    with open("storage/bus_services.json", "r") as f:
+        return json.load(f)[service_no.lower()]["Directions"]
+
+
+def legacy_get_bus_route(service_no: str, direction: str) -> list[str]:
+    with open("storage/bus_routes.json", "r") as f:
+        bus_routes = json.load(f)
+        return [
+            stop["BusStopCode"]
+            for stop in sorted(
+                bus_routes[service_no.lower()][direction],
+                key=lambda x: x["StopSequence"],
+            )
+        ]
+
+
+def legacy_search_bus_stop_descriptions(query: str) -> list:
+    with open("storage/bus_stop_map_description.json", "r") as f:
+        stops = json.load(f)
+        return [stops[stop] for stop in stops if query in stop]
+
+
+def legacy_get_route_dir(service_no: str, bus_stop_code: str) -> str:
+    with open("storage/bus_routes.json", "r") as f:
+        bus_routes = json.load(f)
+        for dir_number, stops in bus_routes[service_no.lower()].items():
+            if dir_number == "ServiceNo":
+                continue
+            for bus_stop in stops:
+                if bus_stop["BusStopCode"] == bus_stop_code:
+                    return dir_number
+
+
+def time_per_call(fn, *args, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - start) / repeat
+
+
+CASES = [
+    (
+        "get_bus_stop_description",
+        legacy_get_bus_stop_description,
+        get_bus_stop_description,
+        ("54009",),
+    ),
+    (
+        "get_bus_stop_location",
+        legacy_get_bus_stop_location,
+        get_bus_stop_location,
+        ("54009",),
+    ),
+    ("get_bus_directions", legacy_get_bus_directions, get_bus_directions, ("10",)),
+    ("get_bus_route", legacy_get_bus_route, get_bus_route, ("10", "1")),
+    (
+        "search_bus_stop_descriptions",
+        legacy_search_bus_stop_descriptions,
+        search_bus_stop_descriptions,
+        ("ang mo kio",),
+    ),
+]
+
+
+def main():
+    for name, load in [
+        ("JSON", TransitStore.from_json),
+        ("snapshot", TransitStore.from_snapshot),
+    ]:
+        print(
+            f"TransitStore load ({name}): {time_per_call(load, repeat=5) * 1e3:.1f} ms"
+        )
+    get_transit_store()
+    print()
+
+    print(f"{'lookup':<30}{'before':>14}{'after':>14}{'speedup':>12}")
+    for name, legacy, current, args in CASES:
+        before = time_per_call(legacy, *args, repeat=5)
+        after = time_per_call(current, *args, repeat=2000)
+        print(
+            f"{name:<30}{before * 1e3:>11.2f} ms{after * 1e6:>11.2f} us"
+            f"{before / after:>11.0f}x"
+        )
+
+    # The route view looks up one description per stop on the route
+    route = get_bus_route("10", "1")
+    before = time_per_call(
+        lambda: [legacy_get_bus_stop_description(code) for code in route], repeat=1
+    )
+    after = time_per_call(
+        lambda: [get_bus_stop_description(code) for code in route], repeat=200
+    )
+    print(
+        f"{f'route view ({len(route)} stops)':<30}{before * 1e3:>11.2f} ms"
+        f"{after * 1e6:>11.2f} us{before / after:>11.0f}x"
+    )
+
+    # send_bus_services looks up the direction of every service at the stop to build
+    # the "View route" buttons; the target is well below a millisecond
+    store = get_transit_store()
+    services = [
+        service_no
+        for service_no in store.routes
+        if store.get_route_directions(service_no, "54009")
+    ]
+    before = time_per_call(
+        lambda: [legacy_get_route_dir(service, "54009") for service in services],
+        repeat=1,
+    )
+    after = time_per_call(
+        lambda: [get_route_dir(service, "54009") for service in services], repeat=2000
+    )
+    print(
+        f"{f'service keyboard ({len(services)} services)':<30}{before * 1e3:>11.2f} ms"
+        f"{after * 1e6:>11.2f} us{before / after:>11.0f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
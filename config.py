@@ -0,0 +1,38 @@
+"""Settings shared by the app and the scripts.
+
+.env is loaded here, once. Modules that read their own settings from the environment
+import this module before reading them, so that .env applies whatever the import order.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+API_KEY = os.getenv("API_KEY")
+
+# Overridable to point the bot at a local stand-in of the Bot API
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+TELEGRAM_API_URL = f"{TELEGRAM_API_BASE}/bot{BOT_TOKEN}"
+
+# Overridable to point the bot and the storage loaders at a local stand-in of DataMall
+DATAMALL_URL = os.getenv(
+    "DATAMALL_URL", "https://datamall2.mytransport.sg/ltaodataservice"
+)
+
+MODE = os.getenv("MODE")
+# Public URL of the app, where Telegram delivers updates
+URL = os.getenv("URL") if MODE == "prod" else os.getenv("URL_DEV")
+
+# Bearer token of the /debug endpoints, which are disabled if it is not set
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+
+# /metrics is served without a token only on this port, which is not exposed publicly but
+# is scraped by Prometheus over the private network. Nothing else is served on it.
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Bearer token of /metrics on other ports, where it is disabled if this is not set
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "20"))
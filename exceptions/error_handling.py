@@ -1,11 +1,19 @@
 import logging
 
+from helpers.metrics import Counter
 from telegram_utils.messaging import send_message
 
 logger = logging.getLogger(__name__)
 
+ERRORS = Counter(
+    "bot_errors_total",
+    "Errors reported to a chat or logged, such as APIError or NoSearchResultsError",
+    ["error"],
+)
+
 
 def handle_error(error, chat_id=None):
+    ERRORS.inc(type(error).__name__)
     if chat_id:
         send_message(chat_id, str(error))
     logging.error(str(error), exc_info=True)
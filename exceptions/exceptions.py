@@ -16,6 +16,7 @@ class InvalidCommandError(Exception):
 class APIError(Exception):
     def __init__(self, response_status_code=None, message="Error occurred."):
         super().__init__(message)
+        self.message = message
         self.response_status_code = response_status_code
 
     def __str__(self):
@@ -28,3 +29,18 @@ class APIError(Exception):
 class InvalidCallbackDataError(Exception):
     def __init__(self, message="Invalid callback data"):
         super().__init__(message)
+
+
+class ServiceNotAtStopError(Exception):
+    def __init__(self, message="This service does not go to this bus stop"):
+        super().__init__(message)
+
+
+class SnapshotError(Exception):
+    def __init__(self, message="Transit snapshot is invalid"):
+        super().__init__(message)
+
+
+class TooManyFavouritesError(Exception):
+    def __init__(self, message="You have saved too many favourite stops"):
+        super().__init__(message)
@@ -1,8 +1,9 @@
-import json
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from exceptions.exceptions import NoSearchResultsError
+from helpers.tracing import traced
+from helpers.transit_store import get_transit_store
 
 
 def format_timing(iso_string: str) -> Optional[str]:
@@ -93,11 +94,10 @@ def get_bus_stop_description(code: str) -> str:
     Returns:
         str: The description of the bus stop.
     """
-    with open("storage/bus_stop_map_code.json", "r") as f:
-        bus_stops = json.load(f)
-        if not code in bus_stops:
-            raise NoSearchResultsError("No bus stops with this code")
-        return bus_stops[code]["Description"]
+    bus_stop = get_transit_store().get_stop(code)
+    if bus_stop is None:
+        raise NoSearchResultsError("No bus stops with this code")
+    return bus_stop["Description"]
 
 
 def is_bus_stop_code(str: str) -> bool:
@@ -116,13 +116,13 @@ def get_bus_stop_location(code: str) -> tuple[str, str]:
     Returns:
         tuple[str, str]: A tuple of latitude and longitude of the bus stop location.
     """
-    with open("storage/bus_stop_map_code.json", "r") as f:
-        bus_stops = json.load(f)
-        if not code in bus_stops:
-            raise NoSearchResultsError("No bus stops with this code")
-        return bus_stops[code]["Latitude"], bus_stops[code]["Longitude"]
+    bus_stop = get_transit_store().get_stop(code)
+    if bus_stop is None:
+        raise NoSearchResultsError("No bus stops with this code")
+    return bus_stop["Latitude"], bus_stop["Longitude"]
 
 
+@traced("lookup.bus_directions")
 def get_bus_directions(service_no: str) -> list[dict]:
     """Returns a list of directions for the specified bus service. Each direction is represented as a
        dictionary containing the following keys:
@@ -147,20 +147,13 @@ def get_bus_directions(service_no: str) -> list[dict]:
     Returns:
         list[dict]: A list of direction dictionaries.
     """
-    with open("storage/bus_services.json", "r") as f:
-        bus_services = json.load(f)
-
-        service_no = service_no.lower()
-
-        if not service_no in bus_services:
-            service_no = service_no.upper()
-
-        if not service_no in bus_services:
-            raise NoSearchResultsError("No buses with this service number")
-
-        return bus_services[service_no]["Directions"]
+    bus_service = get_transit_store().get_service(service_no)
+    if bus_service is None:
+        raise NoSearchResultsError("No buses with this service number")
+    return bus_service["Directions"]
 
 
+@traced("lookup.bus_route")
 def get_bus_route(service_no: str, direction: str) -> list[str]:
     """Returns a list of bus stop codes ordered by stop sequence for the specified bus service and direction.
 
@@ -174,42 +167,28 @@ def get_bus_route(service_no: str, direction: str) -> list[str]:
     Returns:
         list[str]: List of bus stop codes ordered by stop sequence.
     """
-    with open("storage/bus_routes.json", "r") as f:
-        bus_routes = json.load(f)
-        service_no = service_no.lower()
-        if not service_no in bus_routes:
-            service_no = service_no.upper()
-        if not service_no in bus_routes:
-            raise NoSearchResultsError("No buses with this service number")
-        if not direction in bus_routes[service_no]:
-            raise NoSearchResultsError(f"No such direction for bus {service_no}")
-        stops = [
-            stop["BusStopCode"]
-            for stop in sorted(
-                bus_routes[service_no][direction], key=lambda x: x["StopSequence"]
-            )
-        ]
-        return stops
-
-
-def search_bus_stop_descriptions(query: str) -> list:
-    """Returns a list of bus stops that match the search query.
+    bus_route = get_transit_store().get_route(service_no)
+    if bus_route is None:
+        raise NoSearchResultsError("No buses with this service number")
+    if not direction in bus_route:
+        raise NoSearchResultsError(f"No such direction for bus {service_no}")
+    return bus_route[direction]
+
+
+@traced("lookup.search")
+def search_bus_stop_descriptions(query: str) -> list[dict]:
+    """Returns a list of bus stops that match the search query, best matches first.
 
     Args:
-        query (str): Search query to match descriptions.
+        query (str): Search query to match descriptions and road names.
 
     Raises:
-        NoSearchResultsError: If the search query does not match any bus stop descriptions.
+        NoSearchResultsError: If the search query does not match any bus stops.
 
     Returns:
-        list: List of bus stops that have descriptions matching the search query
+        list[dict]: List of bus stops that match the search query
     """
-    search_results = []
-    with open("storage/bus_stop_map_description.json", "r") as f:
-        stops = json.load(f)
-        for stop in stops:
-            if query in stop:
-                search_results.append(stops[stop])
+    search_results = get_transit_store().search_index.search(query)
     if not search_results:
         raise NoSearchResultsError("No bus stops found. Try another search query.")
     return search_results
@@ -0,0 +1,72 @@
+import os
+from typing import Iterable
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config  # noqa: F401 - loads .env before the settings below are read
+
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.3"))
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default (connect, read) timeout to every request."""
+
+    def __init__(self, timeout: tuple[float, float], **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(
+    retry_methods: Iterable[str],
+    retry_statuses: Iterable[int] = (500, 502, 503, 504),
+    retry_reads: bool = True,
+    respect_retry_after: bool = True,
+    pool_size: int = POOL_SIZE,
+) -> requests.Session:
+    """Creates a session that keeps connections to each host alive in a pool, with default
+       timeouts and bounded retries with exponential backoff.
+
+    Args:
+        retry_methods (Iterable[str]): HTTP methods that may be retried.
+        retry_statuses (Iterable[int]): Response status codes that are retried.
+        retry_reads (bool): Whether to retry after the request was sent but the response
+                            was lost (e.g. connection reset). Only safe for idempotent calls.
+        respect_retry_after (bool): Whether to wait and retry 413, 429 and 503 responses
+                                    that have a Retry-After header.
+        pool_size (int): Maximum number of connections kept alive per host.
+
+    Returns:
+        requests.Session: The configured session.
+    """
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES if retry_reads else 0,
+        status=MAX_RETRIES,
+        status_forcelist=tuple(retry_statuses),
+        allowed_methods=frozenset(retry_methods),
+        backoff_factor=BACKOFF_FACTOR,
+        respect_retry_after_header=respect_retry_after,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        max_retries=retry,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,244 @@
+"""Counters, gauges and histograms exposed on /metrics in the Prometheus text format.
+
+Recording a value takes no lock: each thread writes to its own shard of a metric, and
+the shards are only summed when the metrics are rendered. Values are per process, so
+with several gunicorn workers each worker reports its own.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional, Sequence
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the latency histograms in seconds, from cache hits to slow upstreams
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# A sample is a metric's label values and its value
+Sample = tuple[tuple[str, ...], float]
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        """
+        Args:
+            name (str): Name of the metric.
+            help (str): Description of the metric.
+            labels (Sequence[str]): Names of the labels, whose values are passed in the
+                                    same order when recording.
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._shards: list[dict] = []
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+        REGISTRY.register(self)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshots(self) -> list[dict]:
+        # Copying a dict does not release the GIL, so it is consistent even while its
+        # thread is writing to it
+        with self._shards_lock:
+            shards = list(self._shards)
+        return [shard.copy() for shard in shards]
+
+    def render(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> dict[tuple[str, ...], float]:
+        totals: dict[tuple[str, ...], float] = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> Iterator[str]:
+        for labels, value in sorted(self.values().items()):
+            yield format_sample(self.name, self.labels, labels, value)
+
+
+class Gauge(Counter):
+    """A value that goes up and down, such as the number of requests in progress."""
+
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    @contextmanager
+    def track_in_progress(self, *labels: str) -> Iterator[None]:
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels)
+
+    def observe(self, value: float, *labels: str):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # Observations in each bucket, then beyond the last bucket, then their sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def values(self) -> dict[tuple[str, ...], list[float]]:
+        totals: dict[tuple[str, ...], list[float]] = {}
+        for shard in self._snapshots():
+            for labels, counts in shard.items():
+                total = totals.setdefault(labels, [0] * len(counts))
+                for i, count in enumerate(counts[:]):
+                    total[i] += count
+        return totals
+
+    def render(self) -> Iterator[str]:
+        bucket_labels = self.labels + ("le",)
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield format_sample(
+                    f"{self.name}_bucket",
+                    bucket_labels,
+                    labels + (format_value(bound),),
+                    cumulative,
+                )
+            yield format_sample(f"{self.name}_sum", self.labels, labels, counts[-1])
+            yield format_sample(f"{self.name}_count", self.labels, labels, cumulative)
+
+
+class Registry:
+    """The metrics to render, and collectors that read values kept elsewhere, such as
+    the counters of the arrival cache, when rendering."""
+
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: dict[str, Callable[[], Iterable[str]]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def register_collector(self, name: str, collector: Callable[[], Iterable[str]]):
+        """Registers a function returning lines of the text format, replacing any
+        collector registered under the same name."""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        for collector in collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def format_value(value: float) -> str:
+    value = float(value)
+    if value == float("inf"):
+        return "+Inf"
+    if value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_sample(
+    name: str, label_names: Sequence[str], label_values: Sequence[str], value: float
+) -> str:
+    if not label_names:
+        return f"{name} {format_value(value)}"
+    labels = ",".join(
+        f'{label}="{escape(str(label_value))}"'
+        for label, label_value in zip(label_names, label_values)
+    )
+    return f"{name}{{{labels}}} {format_value(value)}"
+
+
+def format_metric(
+    name: str,
+    type: str,
+    help: str,
+    samples: Iterable[Sample],
+    label_names: Sequence[str] = (),
+) -> Iterator[str]:
+    """Formats a metric read by a collector."""
+    yield f"# HELP {name} {help}"
+    yield f"# TYPE {name} {type}"
+    for label_values, value in samples:
+        yield format_sample(name, label_names, label_values, value)
+
+
+@contextmanager
+def timed(
+    histogram: Histogram, counter: Optional[Counter] = None, *labels: str
+) -> Iterator[None]:
+    """Observes how long the block or decorated function took, and counts its outcome:
+    "ok", or the name of the exception it raised.
+
+    Args:
+        histogram (Histogram): Histogram of durations, labelled with labels.
+        counter (Optional[Counter]): Counter of outcomes, labelled with labels and then
+                                     the outcome.
+        labels (str): Label values.
+    """
+    outcome = "ok"
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - started, *labels)
+        if counter is not None:
+            counter.inc(*labels, outcome)
@@ -0,0 +1,232 @@
+import heapq
+import re
+from bisect import bisect_left
+from collections.abc import Sequence
+from typing import Optional
+
+MAX_RESULTS = 50
+
+# Minimum trigram similarity for a query token to fuzzily match an indexed token
+FUZZY_THRESHOLD = 0.5
+FUZZY_MIN_LENGTH = 4
+
+# Abbreviations used in LTA bus stop descriptions and road names, and common ways of
+# typing them, mapped to one canonical token so that either form matches the other
+ABBREVIATIONS = {
+    "aft": "after",
+    "ave": "avenue",
+    "bef": "before",
+    "bet": "between",
+    "bldg": "building",
+    "blk": "block",
+    "blks": "block",
+    "blocks": "block",
+    "bt": "bukit",
+    "center": "centre",
+    "ch": "church",
+    "condo": "condominium",
+    "cp": "carpark",
+    "cplx": "complex",
+    "cres": "crescent",
+    "ctr": "centre",
+    "ctrl": "central",
+    "cwealth": "commonwealth",
+    "dr": "drive",
+    "gdn": "garden",
+    "gdns": "gardens",
+    "hosp": "hospital",
+    "hts": "heights",
+    "ind": "industrial",
+    "int": "interchange",
+    "jln": "jalan",
+    "lib": "library",
+    "lor": "lorong",
+    "mkt": "market",
+    "natl": "national",
+    "nth": "north",
+    "opp": "opposite",
+    "pk": "park",
+    "pl": "place",
+    "pr": "primary",
+    "pri": "primary",
+    "rd": "road",
+    "sch": "school",
+    "sec": "secondary",
+    "sgoon": "serangoon",
+    "spore": "singapore",
+    "st": "street",
+    "stn": "station",
+    "sth": "south",
+    "ter": "terminal",
+    "tg": "tanjong",
+    "upp": "upper",
+    "wlands": "woodlands",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into lowercase canonical tokens, expanding known abbreviations."""
+    text = text.lower().replace("'", "")
+    return [ABBREVIATIONS.get(token, token) for token in re.findall(r"[a-z0-9]+", text)]
+
+
+def trigrams(token: str) -> set[str]:
+    padded = f"  {token} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Prebuilt index for ranked, typo-tolerant search over bus stop descriptions and road names.
+
+    Results are ranked in tiers: the stop whose code is the query, then exact description
+    matches, then descriptions starting with the query, then stops whose description or road name contain every query token (or a
+    token starting with it), and finally stops that only match once typos are allowed.
+    """
+
+    def __init__(self, bus_stops: Sequence[dict]):
+        self.stops = bus_stops
+        self.codes = {stop["BusStopCode"]: i for i, stop in enumerate(bus_stops)}
+        self.descriptions: list[tuple[str, ...]] = []
+        self.postings: dict[str, set[int]] = {}
+        self.description_postings: dict[str, set[int]] = {}
+        for i, stop in enumerate(bus_stops):
+            description = tuple(tokenize(stop["Description"]))
+            self.descriptions.append(description)
+            for token in description:
+                self.description_postings.setdefault(token, set()).add(i)
+            for token in description + tuple(tokenize(stop["RoadName"])):
+                self.postings.setdefault(token, set()).add(i)
+        # Tie-breaker within a tier: shorter descriptions first, then alphabetically
+        order = sorted(
+            range(len(bus_stops)),
+            key=lambda i: (
+                len(self.descriptions[i]),
+                bus_stops[i]["Description"].lower(),
+                bus_stops[i]["BusStopCode"],
+            ),
+        )
+        self.position = [0] * len(bus_stops)
+        for position, i in enumerate(order):
+            self.position[i] = position
+
+        self.vocabulary = sorted(self.postings)
+        self.trigram_postings: dict[str, set[str]] = {}
+        for token in self.vocabulary:
+            for trigram in trigrams(token):
+                self.trigram_postings.setdefault(trigram, set()).add(token)
+
+    def _prefix_matches(self, prefix: str) -> list[str]:
+        start = bisect_left(self.vocabulary, prefix)
+        matches = []
+        for token in self.vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+
+    def _fuzzy_matches(self, token: str) -> list[str]:
+        if len(token) < FUZZY_MIN_LENGTH:
+            return []
+        query_trigrams = trigrams(token)
+        shared: dict[str, int] = {}
+        for trigram in query_trigrams:
+            for candidate in self.trigram_postings.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        return [
+            candidate
+            for candidate, count in shared.items()
+            if 2 * count / (len(query_trigrams) + len(candidate) + 1) >= FUZZY_THRESHOLD
+        ]
+
+    def _match(self, tokens: list[str], fuzzy: bool) -> tuple[set[int], list[set[int]]]:
+        """Returns the stops matching every token, and for each token the stops whose
+        description (rather than only the road name) matches it."""
+        matched: Optional[set[int]] = None
+        in_description = []
+        for token in tokens:
+            vocabulary = self._prefix_matches(token)
+            if fuzzy:
+                vocabulary += self._fuzzy_matches(token)
+            stops = set()
+            description_stops = set()
+            for match in vocabulary:
+                stops |= self.postings[match]
+                description_stops |= self.description_postings.get(match, set())
+            matched = stops if matched is None else matched & stops
+            if not matched:
+                return set(), []
+            in_description.append(description_stops)
+        return matched, in_description
+
+    def _tier(self, i: int, tokens: tuple[str, ...]) -> int:
+        description = self.descriptions[i]
+        if description == tokens:
+            return 0
+        if (
+            len(description) >= len(tokens)
+            and description[: len(tokens) - 1] == tokens[:-1]
+            and description[len(tokens) - 1].startswith(tokens[-1])
+        ):
+            return 1
+        return 2
+
+    def _top(self, tokens, candidates, in_description, limit, fuzzy) -> list[int]:
+        """Returns the best limit candidates. Each candidate is ranked by its tier, then by
+        how many query tokens its description (rather than its road name) matches, then by
+        its precomputed position, packed into one integer so that ranking stays cheap for
+        broad queries."""
+        n = len(self.stops)
+        weight = len(tokens) + 1
+        first = tokens[0]
+        descriptions = self.descriptions
+        position = self.position
+        # Candidates whose description does not start like the query are tier 2 (or 3)
+        leading = (
+            set()
+            if fuzzy
+            else {
+                i
+                for i in candidates
+                if descriptions[i][:1] and descriptions[i][0].startswith(first)
+            }
+        )
+        base = (3 if fuzzy else 2) * weight
+        keys = []
+        for i in candidates:
+            tier_weight = self._tier(i, tokens) * weight if i in leading else base
+            missing = weight - 1
+            for stops in in_description:
+                if i in stops:
+                    missing -= 1
+            keys.append(((tier_weight + missing) * n + position[i], i))
+        return [i for _, i in heapq.nsmallest(limit, keys)]
+
+    def search(self, query: str, limit: int = MAX_RESULTS) -> list[dict]:
+        """Returns bus stops matching the query, best matches first.
+
+        Args:
+            query (str): Free-text search query.
+            limit (int): Maximum number of results to return.
+
+        Returns:
+            list[dict]: Matching bus stops, at most limit of them.
+        """
+        tokens = tuple(tokenize(query))
+        if not tokens or limit <= 0:
+            return []
+
+        code = self.codes.get(query.strip())
+        results = [] if code is None else [code]
+        matched, in_description = self._match(tokens, fuzzy=False)
+        matched.discard(code)
+        results += self._top(
+            tokens, matched, in_description, limit - len(results), fuzzy=False
+        )
+        if len(results) < limit:
+            fuzzy, in_description = self._match(tokens, fuzzy=True)
+            fuzzy -= matched
+            fuzzy.discard(code)
+            results += self._top(
+                tokens, fuzzy, in_description, limit - len(results), True
+            )
+        return [self.stops[i] for i in results]
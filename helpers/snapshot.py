@@ -0,0 +1,260 @@
+import hashlib
+import logging
+import os
+import struct
+import zlib
+from array import array
+from typing import Optional
+
+from exceptions.exceptions import SnapshotError
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "transit.snapshot"
+SOURCE_FILES = ("bus_stops.json", "bus_services.json", "bus_routes.json")
+
+MAGIC = b"SGBT"
+VERSION = 2
+
+# magic, format version, number of sections, CRC-32 of everything after the header,
+# fingerprint of the JSON files the snapshot was built from
+_HEADER = struct.Struct("<4sHHI32s")
+# section name, array typecode, byte offset from the start of the file, byte length
+_SECTION = struct.Struct("<15scQQ")
+_ALIGNMENT = 8
+
+# Fields of a bus service direction stored as strings, and their columns
+DIRECTION_COLUMNS = {
+    "Category": "dir_category",
+    "OriginCode": "dir_origin",
+    "DestinationCode": "dir_dest",
+    "AM_Peak_Freq": "dir_am_peak",
+    "AM_Offpeak_Freq": "dir_am_offpeak",
+    "PM_Peak_Freq": "dir_pm_peak",
+    "PM_Offpeak_Freq": "dir_pm_offpeak",
+}
+
+# Columns of the snapshot and their array typecodes. Strings are stored as IDs into the
+# string table, and *_offs columns hold the start of each record's slice of another column.
+COLUMNS = {
+    # Bus stops, sorted by code. Codes are five digits and stored as numbers.
+    "stop_code": "I",
+    "stop_road": "I",
+    "stop_desc": "I",
+    "stop_lat": "d",
+    "stop_lon": "d",
+    # Routes through each stop as slices of stop_routes, ordered by service, with
+    # directions that continue on from the stop before directions that terminate at it
+    "stop_route_offs": "I",
+    "stop_routes": "I",
+    # Bus services, sorted by lowercase service number, with their directions as slices
+    # of the dir_* columns and their routes as slices of the route_* columns. Services
+    # that only have routes have svc_record 0 and empty fields.
+    "svc_key": "I",
+    "svc_record": "B",
+    "svc_no": "I",
+    "svc_operator": "I",
+    "svc_dir_offs": "I",
+    "svc_route_offs": "I",
+    "dir_number": "I",
+    **{column: "I" for column in DIRECTION_COLUMNS.values()},
+    # One route per service and direction, with its stops as slices of route_stops,
+    # stored as indexes into the stop columns
+    "route_svc": "I",
+    "route_dir": "I",
+    "route_offs": "I",
+    "route_stops": "I",
+}
+
+
+def source_fingerprint(storage_dir: str) -> bytes:
+    """Returns a fingerprint of the size and modification time of the JSON datasets, so
+    that a snapshot built before the JSON was last written is detected as stale.
+
+    Raises:
+        FileNotFoundError: If one of the JSON datasets is missing.
+    """
+    digest = hashlib.sha256()
+    for name in SOURCE_FILES:
+        stat = os.stat(os.path.join(storage_dir, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.digest()
+
+
+class _StringTableWriter:
+    """Interns strings, so that each distinct string is stored once."""
+
+    def __init__(self):
+        self.ids: dict[str, int] = {}
+        self.offsets = array("I", [0])
+        self.data = bytearray()
+
+    def add(self, string: str) -> int:
+        id = self.ids.get(string)
+        if id is None:
+            id = self.ids[string] = len(self.ids)
+            self.data += string.encode()
+            self.offsets.append(len(self.data))
+        return id
+
+
+class StringTable:
+    """Read-only view of the interned strings of a snapshot."""
+
+    def __init__(self, data: memoryview, offsets: memoryview):
+        self.data = data
+        self.offsets = offsets
+
+    def __getitem__(self, id: int) -> str:
+        return str(self.data[self.offsets[id] : self.offsets[id + 1]], "utf-8")
+
+
+def encode_snapshot(
+    stops: dict[str, dict],
+    services: dict[str, dict],
+    routes: dict[str, dict[str, list[str]]],
+) -> bytes:
+    """Encodes the transit data in the snapshot format, with an empty source fingerprint.
+
+    Every string is interned into one string table, and records are stored as packed
+    columns of string IDs, indexes and numbers, so that the snapshot can be used in place
+    without parsing. Route stops that are not in stops are left out.
+
+    Args:
+        stops (dict[str, dict]): Bus stops by code.
+        services (dict[str, dict]): Bus services by lowercase service number.
+        routes (dict[str, dict[str, list[str]]]): Bus stop codes in stop sequence by
+                                                  lowercase service number and direction.
+
+    Raises:
+        ValueError: If a bus stop code is not five digits.
+
+    Returns:
+        bytes: The encoded snapshot.
+    """
+    strings = _StringTableWriter()
+    columns = {name: array(typecode) for name, typecode in COLUMNS.items()}
+
+    stop_codes = sorted(stops)
+    for code in stop_codes:
+        if not (code.isdigit() and len(code) == 5):
+            raise ValueError(f"Invalid bus stop code {code!r}")
+        stop = stops[code]
+        columns["stop_code"].append(int(code))
+        columns["stop_road"].append(strings.add(stop["RoadName"]))
+        columns["stop_desc"].append(strings.add(stop["Description"]))
+        columns["stop_lat"].append(stop["Latitude"])
+        columns["stop_lon"].append(stop["Longitude"])
+    stop_ids = {code: i for i, code in enumerate(stop_codes)}
+
+    # (service, whether the route terminates at the stop, route) of each stop's routes
+    stop_routes: list[list[tuple[int, bool, int]]] = [[] for _ in stop_codes]
+    columns["svc_dir_offs"].append(0)
+    columns["svc_route_offs"].append(0)
+    columns["route_offs"].append(0)
+    for service_id, key in enumerate(sorted(services.keys() | routes.keys())):
+        service = services.get(key)
+        columns["svc_key"].append(strings.add(key))
+        columns["svc_record"].append(service is not None)
+        service = service or {"ServiceNo": "", "Operator": "", "Directions": []}
+        columns["svc_no"].append(strings.add(service["ServiceNo"]))
+        columns["svc_operator"].append(strings.add(service["Operator"]))
+        for direction in service["Directions"]:
+            columns["dir_number"].append(direction["Direction"])
+            for field, column in DIRECTION_COLUMNS.items():
+                columns[column].append(strings.add(direction[field]))
+        columns["svc_dir_offs"].append(len(columns["dir_number"]))
+
+        for direction, codes in routes.get(key, {}).items():
+            route_id = len(columns["route_svc"])
+            ids = [stop_ids[code] for code in codes if code in stop_ids]
+            if len(ids) < len(codes):
+                logger.warning("Route %s/%s has unknown bus stops", key, direction)
+            columns["route_svc"].append(service_id)
+            columns["route_dir"].append(strings.add(direction))
+            columns["route_stops"].extend(ids)
+            columns["route_offs"].append(len(columns["route_stops"]))
+            for stop_id in dict.fromkeys(ids):
+                stop_routes[stop_id].append((service_id, ids[-1] == stop_id, route_id))
+        columns["svc_route_offs"].append(len(columns["route_svc"]))
+
+    columns["stop_route_offs"].append(0)
+    for entries in stop_routes:
+        columns["stop_routes"].extend(route_id for _, _, route_id in sorted(entries))
+        columns["stop_route_offs"].append(len(columns["stop_routes"]))
+
+    sections = [
+        ("str_data", "B", bytes(strings.data)),
+        ("str_offs", "I", strings.offsets.tobytes()),
+    ] + [(name, values.typecode, values.tobytes()) for name, values in columns.items()]
+
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    directory = bytearray()
+    body = bytearray()
+    for name, typecode, data in sections:
+        body += bytes(-(offset + len(body)) % _ALIGNMENT)
+        directory += _SECTION.pack(
+            name.encode(), typecode.encode(), offset + len(body), len(data)
+        )
+        body += data
+    payload = bytes(directory + body)
+    header = _HEADER.pack(MAGIC, VERSION, len(sections), zlib.crc32(payload), bytes(32))
+    return header + payload
+
+
+def write_snapshot(path: str, data: bytes, fingerprint: bytes):
+    """Writes an encoded snapshot to a file with the given source fingerprint, replacing
+    the file atomically so that readers never see a partially written snapshot.
+
+    Args:
+        path (str): Path of the snapshot file.
+        data (bytes): Snapshot from encode_snapshot().
+        fingerprint (bytes): Fingerprint of the JSON datasets, from source_fingerprint().
+    """
+    magic, version, count, checksum, _ = _HEADER.unpack_from(data)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(magic, version, count, checksum, fingerprint))
+        f.write(memoryview(data)[_HEADER.size :])
+    os.replace(tmp_path, path)
+
+
+def read_sections(data, fingerprint: Optional[bytes] = None) -> dict[str, memoryview]:
+    """Validates a snapshot and returns its sections as typed memoryviews into data.
+
+    Args:
+        data (bytes | mmap.mmap): Contents of the snapshot.
+        fingerprint (Optional[bytes]): If given, the snapshot must have been built from
+                                       JSON datasets with this fingerprint.
+
+    Raises:
+        SnapshotError: If the snapshot is corrupt, has another format version, or is stale.
+
+    Returns:
+        dict[str, memoryview]: Sections by name.
+    """
+    if len(data) < _HEADER.size:
+        raise SnapshotError("Snapshot is truncated")
+    magic, version, count, checksum, source = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError("Not a transit snapshot")
+    if version != VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+    view = memoryview(data)
+    if zlib.crc32(view[_HEADER.size :]) != checksum:
+        raise SnapshotError("Snapshot checksum mismatch")
+    if fingerprint is not None and source != fingerprint:
+        raise SnapshotError("Snapshot is stale")
+    sections = {}
+    for i in range(count):
+        name, typecode, offset, length = _SECTION.unpack_from(
+            data, _HEADER.size + i * _SECTION.size
+        )
+        if offset + length > len(data):
+            raise SnapshotError("Snapshot is truncated")
+        section = view[offset : offset + length]
+        sections[name.rstrip(b"\0").decode()] = section.cast(typecode.decode())
+    missing = {"str_data", "str_offs", *COLUMNS} - set(sections)
+    if missing:
+        raise SnapshotError(f"Snapshot is missing {', '.join(sorted(missing))}")
+    return sections
@@ -0,0 +1,205 @@
+import math
+from array import array
+from collections.abc import Sequence
+from typing import Optional
+
+# WGS84 ellipsoid
+SEMI_MAJOR_AXIS_M = 6378137.0
+ECCENTRICITY_SQ = 6.69437999014e-3
+MEAN_EARTH_RADIUS_M = 6371008.8
+
+# Roughly 1.1 km square cells at Singapore's latitude
+CELL_SIZE_DEG = 0.01
+# Shortest length of one degree of latitude (at the equator), for conservative ring bounds
+METRES_PER_DEGREE_MIN = math.radians(1) * 6335439.0
+
+# Candidates are ranked with a local ellipsoidal approximation that is accurate to a few
+# parts per million over city distances. Only candidates whose approximate distances are
+# within this relative tolerance of each other are re-ranked with exact geodesics.
+TIE_TOLERANCE = 1e-4
+
+# Beyond this distance the approximation degrades, so candidates within FAR_TOLERANCE of
+# the k-th distance are refined exactly, up to FAR_REFINE_LIMIT extra candidates
+APPROXIMATION_LIMIT_M = 50_000
+FAR_TOLERANCE = 1e-2
+FAR_REFINE_LIMIT = 20
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Returns the great-circle distance in metres between two points."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * MEAN_EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def local_radii(latitude: float) -> tuple[float, float]:
+    """Returns the meridional and prime vertical radii of curvature in metres at a latitude."""
+    sin_lat = math.sin(math.radians(latitude))
+    w = math.sqrt(1 - ECCENTRICITY_SQ * sin_lat * sin_lat)
+    meridional = SEMI_MAJOR_AXIS_M * (1 - ECCENTRICITY_SQ) / w**3
+    prime_vertical = SEMI_MAJOR_AXIS_M / w
+    return meridional, prime_vertical
+
+
+class SpatialIndex:
+    """Grid-bucketed index over point coordinates for nearest-neighbour queries.
+
+    Coordinates are read in place from flat sequences (arrays, or memoryviews into a
+    shared snapshot) and bucketed into fixed-size lat/lon cells. A query
+    scans rings of cells outwards from the query point, ranks candidates by a local
+    ellipsoidal approximation and only computes exact geodesics to break near-ties.
+    """
+
+    def __init__(self, latitudes: Sequence[float], longitudes: Sequence[float]):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.cells: dict[tuple[int, int], array] = {}
+        for i, (lat, lon) in enumerate(zip(self.latitudes, self.longitudes)):
+            self.cells.setdefault(self._cell(lat, lon), array("I")).append(i)
+        rows = [row for row, _ in self.cells] or [0]
+        cols = [col for _, col in self.cells] or [0]
+        self.bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> tuple[int, int]:
+        return math.floor(lat / CELL_SIZE_DEG), math.floor(lon / CELL_SIZE_DEG)
+
+    def _ring(self, row: int, col: int, r: int):
+        if r == 0:
+            yield row, col
+            return
+        for c in range(col - r, col + r + 1):
+            yield row - r, c
+            yield row + r, c
+        for rw in range(row - r + 1, row + r):
+            yield rw, col - r
+            yield rw, col + r
+
+    def nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        k: int,
+        max_radius: Optional[float] = None,
+    ) -> list[tuple[int, float]]:
+        """Returns the k points closest to the given location, ordered by geodesic distance.
+
+        Args:
+            latitude (float): Latitude of the location.
+            longitude (float): Longitude of the location.
+            k (int): Maximum number of points to return.
+            max_radius (Optional[float]): If given, only points within this many metres
+                                          are returned.
+
+        Returns:
+            list[tuple[int, float]]: (index, distance in metres) pairs, closest first.
+        """
+        if k <= 0:
+            return []
+        row, col = self._cell(latitude, longitude)
+        min_row, max_row, min_col, max_col = self.bounds
+        last_ring = max(row - min_row, max_row - row, col - min_col, max_col - col, 0)
+        cell_metres = CELL_SIZE_DEG * METRES_PER_DEGREE_MIN
+        cell_metres *= math.cos(math.radians(min(abs(latitude), 89.0)))
+        meridional, prime_vertical = local_radii(latitude)
+        radius_limit = None if max_radius is None else max_radius * (1 + FAR_TOLERANCE)
+        lat_rad = math.radians(latitude)
+        lon_rad = math.radians(longitude)
+        latitudes = self.latitudes
+        longitudes = self.longitudes
+
+        # Outside the indexed area the rings are mostly empty, so scan every point instead
+        outside = not (min_row <= row <= max_row and min_col <= col <= max_col)
+
+        candidates: list[tuple[float, int]] = []
+        for r in range(1 if outside else last_ring + 1):
+            if outside:
+                cells = [range(len(latitudes))]
+            else:
+                cells = [self.cells.get(cell, ()) for cell in self._ring(row, col, r)]
+            for points in cells:
+                for i in points:
+                    lat = math.radians(latitudes[i])
+                    dy = (lat - lat_rad) * meridional
+                    dx = (
+                        (math.radians(longitudes[i]) - lon_rad)
+                        * prime_vertical
+                        * math.cos((lat + lat_rad) / 2)
+                    )
+                    dist = math.hypot(dx, dy)
+                    if radius_limit is None or dist <= radius_limit:
+                        candidates.append((dist, i))
+            # Every point outside the rings scanned so far is at least this far away
+            covered = math.inf if outside else r * cell_metres
+            if radius_limit is not None and covered > radius_limit:
+                break
+            if len(candidates) >= k:
+                candidates.sort()
+                if covered > candidates[k - 1][0] * (1 + FAR_TOLERANCE):
+                    break
+        candidates.sort()
+        return self._resolve(latitude, longitude, candidates, k, max_radius)
+
+    def _resolve(self, latitude, longitude, candidates, k, max_radius):
+        """Picks the closest k candidates, computing exact geodesic distances only where
+        the approximate distances are too close to call."""
+        if not candidates:
+            return []
+        kth = candidates[min(k, len(candidates)) - 1][0]
+        if kth > APPROXIMATION_LIMIT_M:
+            # Far from every point, re-rank by great-circle distance and refine a bounded
+            # number of candidates near the k-th distance instead of breaking every tie.
+            candidates = sorted(
+                (
+                    haversine(
+                        latitude, longitude, self.latitudes[i], self.longitudes[i]
+                    ),
+                    i,
+                )
+                for _, i in candidates
+            )
+            cutoff = candidates[min(k, len(candidates)) - 1][0] * (1 + FAR_TOLERANCE)
+            nearby = [c for c in candidates if c[0] <= cutoff][: k + FAR_REFINE_LIMIT]
+            resolved = self._geodesic(latitude, longitude, nearby)
+        else:
+            resolved = self._break_ties(latitude, longitude, candidates, k, max_radius)
+
+        if max_radius is not None:
+            resolved = [c for c in resolved if c[0] <= max_radius]
+        return [(i, dist) for dist, i in resolved[:k]]
+
+    def _break_ties(self, latitude, longitude, candidates, k, max_radius):
+        # Group candidates whose distances are within tolerance of their neighbour; only
+        # groups of near-ties, or those at the radius limit, need exact distances.
+        resolved: list[tuple[float, int]] = []
+        group = [candidates[0]]
+        for candidate in candidates[1:] + [(math.inf, -1)]:
+            if candidate[0] <= group[-1][0] * (1 + TIE_TOLERANCE):
+                group.append(candidate)
+                continue
+            near_radius = max_radius is not None and group[-1][0] >= max_radius * (
+                1 - TIE_TOLERANCE
+            )
+            if len(group) > 1 or near_radius:
+                group = self._geodesic(latitude, longitude, group)
+            resolved.extend(group)
+            if len(resolved) >= k:
+                break
+            group = [candidate]
+        return resolved
+
+    def _geodesic(self, latitude, longitude, group):
+        import geopy.distance
+
+        return sorted(
+            (
+                geopy.distance.distance(
+                    (latitude, longitude), (self.latitudes[i], self.longitudes[i])
+                ).meters,
+                i,
+            )
+            for _, i in group
+        )
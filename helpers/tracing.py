@@ -0,0 +1,365 @@
+"""Timing spans of sampled updates, and cProfile stats aggregated over them.
+
+A sampled update is traced from parsing the webhook request, through waiting in the
+dispatcher and handling it, to each Bot API request it queued being answered. Traces of
+updates slower than TRACE_SLOW_SECONDS are written to TRACE_DIR as JSON. With profiling
+on, the handling of sampled updates also runs under cProfile, and the stats are summed
+into TRACE_DIR/profile.pstats.
+
+Sampling is off unless TRACE_SAMPLE_RATE is set, or turned on through /debug/tracing.
+While off, a span costs one ContextVar lookup. Settings changed through the endpoint
+only apply to the worker that answered the request.
+"""
+
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from concurrent.futures import Future
+from functools import wraps
+from typing import Callable, Hashable, Optional
+
+import config  # noqa: F401 - loads .env before the settings below are read
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_PROFILE = os.getenv("TRACE_PROFILE", "0") == "1"
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "1"))
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+# Traces written per process, so that a slow period cannot fill the disk
+TRACE_MAX_FILES = int(os.getenv("TRACE_MAX_FILES", "1000"))
+# The aggregated profile is written once every this many profiled updates
+PROFILE_DUMP_EVERY = 20
+
+# The trace of the current update, and how deeply the current span is nested
+_current: contextvars.ContextVar[Optional[tuple["Trace", int]]] = (
+    contextvars.ContextVar("trace", default=None)
+)
+
+
+class Trace:
+    """Spans of one update. It is finished, and written if slow, once the webhook
+    request, the handler and every Bot API request it is waiting on have ended."""
+
+    def __init__(self, tracer: "Tracer", profile: bool):
+        self.tracer = tracer
+        self.profile = profile
+        self.key: Optional[Hashable] = None
+        self.wall_time = time.time()
+        self.started = time.perf_counter()
+        self.spans: list[dict] = []
+        self._open = 0
+        self._lock = threading.Lock()
+
+    def add(self, name: str, start: float, end: float, depth: int):
+        with self._lock:
+            self.spans.append(
+                {
+                    "name": name,
+                    "start": start - self.started,
+                    "duration": end - start,
+                    "depth": depth,
+                    "thread": threading.current_thread().name,
+                }
+            )
+
+    def hold(self):
+        with self._lock:
+            self._open += 1
+
+    def release(self):
+        with self._lock:
+            self._open -= 1
+            finished = self._open == 0
+        if finished:
+            self.tracer.finish(self)
+
+    def duration(self) -> float:
+        return max((span["start"] + span["duration"] for span in self.spans), default=0)
+
+    def to_dict(self) -> dict:
+        return {
+            "update_id": self.key,
+            "time": self.wall_time,
+            "duration": self.duration(),
+            "spans": sorted(self.spans, key=lambda span: span["start"]),
+        }
+
+
+class Span:
+    __slots__ = ("trace", "name", "depth", "start", "_token")
+
+    def __init__(self, trace: Trace, name: str, depth: int):
+        self.trace = trace
+        self.name = name
+        self.depth = depth
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _current.set((self.trace, self.depth + 1))
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+        self.trace.add(self.name, self.start, time.perf_counter(), self.depth)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """Returns a context manager timing the block as a span of the current trace, or
+    doing nothing if the update is not traced."""
+    current = _current.get()
+    if current is None:
+        return NULL_SPAN
+    return Span(current[0], name, current[1])
+
+
+def traced(name: str) -> Callable:
+    """Decorates a function so that each call is a span of the current trace."""
+
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            current = _current.get()
+            if current is None:
+                return fn(*args, **kwargs)
+            with Span(current[0], name, current[1]):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_future(name: str, future: Future):
+    """Records a span from now until the future is done, such as a queued Bot API
+    request being answered, and keeps the trace open until then."""
+    current = _current.get()
+    if current is None:
+        return
+    trace, depth = current
+    start = time.perf_counter()
+    trace.hold()
+
+    def done(_):
+        trace.add(name, start, time.perf_counter(), depth)
+        trace.release()
+
+    future.add_done_callback(done)
+
+
+class Tracer:
+    def __init__(
+        self,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        profile: bool = TRACE_PROFILE,
+        slow_seconds: float = TRACE_SLOW_SECONDS,
+        directory: str = TRACE_DIR,
+    ):
+        """
+        Args:
+            sample_rate (float): Fraction of updates to trace.
+            profile (bool): Whether to also profile the handling of traced updates.
+            slow_seconds (float): Traces taking at least this long are written.
+            directory (str): Directory the traces and profile are written to.
+        """
+        self.sample_rate = sample_rate
+        self.profile = profile
+        self.slow_seconds = slow_seconds
+        self.directory = directory
+        self.sampled = 0
+        self.written = 0
+        self.profiled = 0
+        # Traces handed from the webhook to the dispatcher, by update ID
+        self._handed_off: dict[Hashable, tuple[Trace, float]] = {}
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+        # Held while an update is profiled, since a thread can only be profiled by one
+        # profiler at a time and newer Pythons allow one per process
+        self.profiling = threading.Lock()
+
+    def settings(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "profile": self.profile,
+            "slow_seconds": self.slow_seconds,
+            "sampled": self.sampled,
+            "written": self.written,
+            "profiled": self.profiled,
+        }
+
+    def configure(
+        self,
+        sample_rate: Optional[float] = None,
+        profile: Optional[bool] = None,
+        slow_seconds: Optional[float] = None,
+    ):
+        """Changes the given settings.
+
+        Raises:
+            ValueError: If sample_rate is not between 0 and 1 or slow_seconds is negative.
+        """
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        if slow_seconds is not None and slow_seconds < 0:
+            raise ValueError("slow_seconds must not be negative")
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if profile is not None:
+                self.profile = profile
+            if slow_seconds is not None:
+                self.slow_seconds = slow_seconds
+
+    def sample(self) -> Optional[Trace]:
+        """Returns a new trace if this update is sampled, otherwise None."""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+        with self._lock:
+            self.sampled += 1
+        return Trace(self, self.profile)
+
+    def activate(self, trace: Optional[Trace], name: str = "webhook"):
+        """Returns a context manager making the trace current for the block, as a span
+        that keeps the trace open. Does nothing if trace is None."""
+        if trace is None:
+            return NULL_SPAN
+        return _Activation(trace, name)
+
+    def hand_off(self, trace: Optional[Trace], key: Hashable):
+        """Passes the trace to the thread that will handle the update with this key."""
+        if trace is None:
+            return
+        trace.key = key
+        trace.hold()
+        with self._lock:
+            self._handed_off[key] = (trace, time.perf_counter())
+
+    def discard(self, key: Hashable):
+        """Takes back a trace that was handed off, if the update was not queued."""
+        if not self._handed_off:
+            return
+        with self._lock:
+            handed_off = self._handed_off.pop(key, None)
+        if handed_off is not None:
+            handed_off[0].release()
+
+    def resume(self, key: Hashable):
+        """Returns a context manager that continues the trace handed off under the key
+        for the block, or does nothing if there is none."""
+        # Checked without the lock first, so that updates cost nothing while sampling is off
+        if not self._handed_off:
+            return NULL_SPAN
+        with self._lock:
+            handed_off = self._handed_off.pop(key, None)
+        if handed_off is None:
+            return NULL_SPAN
+        trace, handed_off_at = handed_off
+        trace.add("dispatch", handed_off_at, time.perf_counter(), 0)
+        return _Resumption(trace)
+
+    def add_profile(self, profiler: cProfile.Profile):
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+            self.profiled += 1
+            if self.profiled % PROFILE_DUMP_EVERY == 0:
+                self._dump_profile()
+
+    def _dump_profile(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._stats.dump_stats(os.path.join(self.directory, "profile.pstats"))
+        except OSError:
+            logger.exception("Failed to write the profile")
+
+    def profile_report(self, limit: int = 50) -> str:
+        """Returns the functions of the aggregated profile taking the most cumulative
+        time, and writes the profile to disk."""
+        with self._lock:
+            if self._stats is None:
+                return "No updates profiled yet\n"
+            self._dump_profile()
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+
+    def finish(self, trace: Trace):
+        if trace.duration() < self.slow_seconds:
+            return
+        with self._lock:
+            if self.written >= TRACE_MAX_FILES:
+                return
+            self.written += 1
+        path = os.path.join(
+            self.directory, f"trace-{int(trace.wall_time * 1000)}-{trace.key}.json"
+        )
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(trace.to_dict(), f, indent=2)
+        except OSError:
+            logger.exception("Failed to write trace %s", path)
+
+
+class _Activation(Span):
+    __slots__ = ()
+
+    def __init__(self, trace: Trace, name: str):
+        super().__init__(trace, name, 0)
+
+    def __enter__(self):
+        self.trace.hold()
+        return super().__enter__()
+
+    def __exit__(self, *exc_info):
+        super().__exit__(*exc_info)
+        self.trace.release()
+
+
+class _Resumption(Span):
+    __slots__ = ("profiler",)
+
+    def __init__(self, trace: Trace):
+        super().__init__(trace, "handle", 0)
+        self.profiler: Optional[cProfile.Profile] = None
+
+    def __enter__(self):
+        super().__enter__()
+        # Updates handled while another one is profiled are traced without profiling
+        if self.trace.profile and self.trace.tracer.profiling.acquire(blocking=False):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.trace.tracer.profiling.release()
+            self.trace.tracer.add_profile(self.profiler)
+        super().__exit__(*exc_info)
+        # Released here rather than when handed off, so the trace stays open meanwhile
+        self.trace.release()
+
+
+tracer = Tracer()
@@ -0,0 +1,251 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import config  # noqa: F401 - loads .env before the settings below are read
+from exceptions.exceptions import SnapshotError
+from helpers.snapshot import SNAPSHOT_FILE
+from helpers.transit_store import (
+    STORAGE_DIR,
+    TransitStore,
+    get_transit_store,
+    normalize_datasets,
+    set_transit_store,
+    snapshot_id,
+)
+from storage import create_maps, load_bus_routes, load_bus_services, load_stops
+from storage.datamall_ingest import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# How often the static datasets are fetched from DataMall; 0 disables fetching
+REFRESH_INTERVAL = float(os.getenv("TRANSIT_REFRESH_INTERVAL", str(24 * 60 * 60)))
+# How often each worker checks for a snapshot written by another worker's refresh
+RELOAD_INTERVAL = float(os.getenv("TRANSIT_RELOAD_INTERVAL", "60"))
+# How long to wait before trying again after a refresh fails
+RETRY_INTERVAL = 60 * 60
+
+# Held while refreshing so only one worker refreshes at a time
+LOCK_FILE = ".refresh.lock"
+# Touched whenever the datasets are fetched, to record when they were last checked
+CHECKED_FILE = ".refresh.checked"
+
+# Functions fetching each dataset from DataMall, by the JSON file it is stored in
+FETCHERS: dict[str, Callable[[], Any]] = {
+    "bus_stops.json": load_stops.fetch,
+    "bus_services.json": load_bus_services.fetch,
+    "bus_routes.json": load_bus_routes.fetch,
+}
+
+
+def dataset_fingerprint(data: Any) -> str:
+    """Returns a fingerprint of a dataset that does not depend on its formatting."""
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def diff_datasets(old: dict[str, Any], new: dict[str, Any]) -> dict[str, dict]:
+    """Compares two versions of the datasets.
+
+    Args:
+        old (dict[str, Any]): Datasets by JSON file name, None for a missing dataset.
+        new (dict[str, Any]): Datasets by JSON file name.
+
+    Returns:
+        dict[str, dict]: For "stops", "services" and "routes", the sorted "added",
+                         "removed" and "changed" bus stop codes or service numbers.
+    """
+    before = normalize_datasets(
+        old["bus_stops.json"] or [],
+        old["bus_services.json"] or {},
+        old["bus_routes.json"] or {},
+    )
+    after = normalize_datasets(
+        new["bus_stops.json"], new["bus_services.json"], new["bus_routes.json"]
+    )
+    diff = {}
+    for kind, old_records, new_records in zip(
+        ("stops", "services", "routes"), before, after
+    ):
+        diff[kind] = {
+            "added": sorted(new_records.keys() - old_records.keys()),
+            "removed": sorted(old_records.keys() - new_records.keys()),
+            "changed": sorted(
+                key
+                for key in new_records.keys() & old_records.keys()
+                if new_records[key] != old_records[key]
+            ),
+        }
+    return diff
+
+
+def _load_dataset(storage_dir: str, name: str) -> Any:
+    try:
+        with open(os.path.join(storage_dir, name), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def refresh_transit_data(
+    storage_dir: str = STORAGE_DIR,
+    fetchers: Optional[dict[str, Callable[[], Any]]] = None,
+) -> bool:
+    """Fetches the static datasets and, if any of them changed, rewrites the changed JSON
+    files and the snapshot and swaps a store of the new data in.
+
+    Datasets whose fingerprint matches the stored JSON are left alone, and nothing is
+    rebuilt if none changed. The new store is built and indexed before it is swapped in,
+    so requests never wait for it. Callers must hold the refresh lock.
+
+    Args:
+        storage_dir (str): Directory containing the JSON datasets and the snapshot.
+        fetchers (Optional[dict[str, Callable[[], Any]]]): Functions fetching each of
+                                                           the three datasets, by JSON
+                                                           file name.
+
+    Raises:
+        requests.RequestException: If a dataset could not be fetched.
+
+    Returns:
+        bool: Whether any dataset changed.
+    """
+    fetchers = fetchers or FETCHERS
+    old = {name: _load_dataset(storage_dir, name) for name in fetchers}
+    new = {name: fetch() for name, fetch in fetchers.items()}
+    changed = [
+        name
+        for name in fetchers
+        if old[name] is None
+        or dataset_fingerprint(old[name]) != dataset_fingerprint(new[name])
+    ]
+    if not changed:
+        logger.info("Transit data is unchanged")
+        return False
+
+    for kind, diff in diff_datasets(old, new).items():
+        logger.info(
+            "Transit %s: %d added, %d removed, %d changed",
+            kind,
+            len(diff["added"]),
+            len(diff["removed"]),
+            len(diff["changed"]),
+        )
+    for name in changed:
+        write_json_atomic(
+            os.path.join(storage_dir, name),
+            lambda f, data=new[name]: json.dump(data, f, indent=4),
+        )
+    create_maps.main(storage_dir)
+    reload_transit_store(storage_dir)
+    return True
+
+
+def reload_transit_store(storage_dir: str = STORAGE_DIR) -> bool:
+    """Swaps in a store of the snapshot in storage_dir if it is not the one in use, e.g.
+    after another worker refreshed the data. The store is indexed before it is swapped in.
+
+    Raises:
+        FileNotFoundError: If the snapshot or one of the JSON files does not exist.
+        SnapshotError: If the snapshot is invalid or older than the JSON files.
+
+    Returns:
+        bool: Whether a new store was swapped in.
+    """
+    stat = os.stat(os.path.join(storage_dir, SNAPSHOT_FILE))
+    if get_transit_store().snapshot_id == snapshot_id(stat):
+        return False
+    store = TransitStore.from_snapshot(storage_dir)
+    store.spatial_index
+    store.search_index
+    set_transit_store(store)
+    logger.info("Loaded new transit snapshot")
+    return True
+
+
+class TransitRefresher:
+    """Keeps the transit store up to date in the background.
+
+    Every reload_interval seconds, the worker reloads the snapshot if another worker has
+    replaced it. Once the datasets were last checked refresh_interval seconds ago, the
+    first worker to take the refresh lock fetches them from DataMall. The data baked into
+    the image counts as checked when its snapshot was built, so a fresh deploy does not
+    refetch it.
+    """
+
+    def __init__(
+        self,
+        storage_dir: str = STORAGE_DIR,
+        refresh_interval: float = REFRESH_INTERVAL,
+        reload_interval: float = RELOAD_INTERVAL,
+    ):
+        self.storage_dir = storage_dir
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="transit-refresh", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.reload_interval):
+            self.check()
+
+    def last_checked(self) -> float:
+        """Returns when the datasets were last checked, as a Unix timestamp."""
+        for name in (CHECKED_FILE, SNAPSHOT_FILE):
+            try:
+                return os.stat(os.path.join(self.storage_dir, name)).st_mtime
+            except FileNotFoundError:
+                pass
+        return 0
+
+    def check(self):
+        try:
+            reload_transit_store(self.storage_dir)
+        except (FileNotFoundError, SnapshotError) as e:
+            # A refresh may be rewriting the files; try again next time
+            logger.debug("Not reloading transit snapshot: %s", e)
+        if self.refresh_interval and self._refresh_due():
+            self.refresh()
+
+    def _refresh_due(self) -> bool:
+        return time.time() - self.last_checked() >= self.refresh_interval
+
+    def refresh(self):
+        """Refreshes the datasets unless another worker is already refreshing them."""
+        with open(os.path.join(self.storage_dir, LOCK_FILE), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            try:
+                # Another worker may have refreshed while this one waited for the lock
+                if not self._refresh_due():
+                    return
+                self._mark_checked(time.time())
+                refresh_transit_data(self.storage_dir)
+            except Exception:
+                logger.exception("Failed to refresh transit data")
+                self._mark_checked(time.time() - self.refresh_interval + RETRY_INTERVAL)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _mark_checked(self, timestamp: float):
+        path = os.path.join(self.storage_dir, CHECKED_FILE)
+        with open(path, "a"):
+            pass
+        os.utime(path, (timestamp, timestamp))
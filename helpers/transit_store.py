@@ -0,0 +1,429 @@
+import json
+import logging
+import mmap
+import os
+import threading
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import cached_property
+from typing import Callable, Hashable, Iterator, Optional, TypeVar
+from weakref import WeakKeyDictionary
+
+from exceptions.exceptions import SnapshotError
+from helpers.search_index import SearchIndex
+from helpers.snapshot import (
+    DIRECTION_COLUMNS,
+    SNAPSHOT_FILE,
+    StringTable,
+    encode_snapshot,
+    read_sections,
+    source_fingerprint,
+    write_snapshot,
+)
+from helpers.spatial_index import SpatialIndex
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+STORAGE_DIR = "storage"
+
+
+class StopTable(Mapping):
+    """Bus stops by code, read from the stop columns of a snapshot.
+
+    Stops are kept in code order, and a stop's dict is only built when it is looked up.
+    """
+
+    def __init__(self, sections: dict[str, memoryview], strings: StringTable):
+        self.codes = sections["stop_code"]
+        self.roads = sections["stop_road"]
+        self.descriptions = sections["stop_desc"]
+        self.latitudes = sections["stop_lat"]
+        self.longitudes = sections["stop_lon"]
+        self.strings = strings
+
+    def index(self, code: str) -> Optional[int]:
+        """Returns the index of the bus stop with the code, or None if there is none."""
+        if not (code.isdigit() and len(code) == 5):
+            return None
+        number = int(code)
+        i = bisect_left(self.codes, number)
+        if i == len(self.codes) or self.codes[i] != number:
+            return None
+        return i
+
+    def code(self, i: int) -> str:
+        return f"{self.codes[i]:05d}"
+
+    def record(self, i: int) -> dict:
+        return {
+            "BusStopCode": self.code(i),
+            "RoadName": self.strings[self.roads[i]],
+            "Description": self.strings[self.descriptions[i]],
+            "Latitude": self.latitudes[i],
+            "Longitude": self.longitudes[i],
+        }
+
+    @cached_property
+    def records(self) -> "StopRecords":
+        """The bus stops as a sequence, in the order of their indexes."""
+        return StopRecords(self)
+
+    def __getitem__(self, code: str) -> dict:
+        i = self.index(code)
+        if i is None:
+            raise KeyError(code)
+        return self.record(i)
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.code(i) for i in range(len(self.codes)))
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+class StopRecords(Sequence):
+    def __init__(self, table: StopTable):
+        self.table = table
+
+    def __getitem__(self, i: int) -> dict:
+        if not 0 <= i < len(self.table):
+            raise IndexError(i)
+        return self.table.record(i)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+
+class ServiceTable(Mapping):
+    """Bus services by lowercase service number, read from the service columns of a
+    snapshot. A service's dict is only built when it is looked up."""
+
+    def __init__(self, sections: dict[str, memoryview], strings: StringTable):
+        self.sections = sections
+        self.strings = strings
+        # Index of every service in the service columns, including those that only
+        # have routes
+        self.ids = {strings[id]: i for i, id in enumerate(sections["svc_key"])}
+
+    def direction(self, j: int) -> dict:
+        direction = {"Direction": self.sections["dir_number"][j]}
+        for field, column in DIRECTION_COLUMNS.items():
+            direction[field] = self.strings[self.sections[column][j]]
+        return direction
+
+    def __getitem__(self, key: str) -> dict:
+        i = self.ids[key]
+        if not self.sections["svc_record"][i]:
+            raise KeyError(key)
+        offsets = self.sections["svc_dir_offs"]
+        return {
+            "ServiceNo": self.strings[self.sections["svc_no"][i]],
+            "Operator": self.strings[self.sections["svc_operator"][i]],
+            "Directions": [
+                self.direction(j) for j in range(offsets[i], offsets[i + 1])
+            ],
+        }
+
+    def __iter__(self) -> Iterator[str]:
+        records = self.sections["svc_record"]
+        return (key for key, i in self.ids.items() if records[i])
+
+    def __len__(self) -> int:
+        return sum(self.sections["svc_record"])
+
+
+class RouteTable(Mapping):
+    """Bus stop codes ordered by stop sequence, by lowercase service number and
+    direction, read from the route columns of a snapshot. Routes are stored as slices of
+    stop indexes and only converted to codes when they are looked up."""
+
+    def __init__(
+        self,
+        sections: dict[str, memoryview],
+        strings: StringTable,
+        stops: StopTable,
+        services: ServiceTable,
+    ):
+        self.sections = sections
+        self.strings = strings
+        self.stops = stops
+        self.services = services
+
+    def route_ids(self, service_id: int) -> range:
+        offsets = self.sections["svc_route_offs"]
+        return range(offsets[service_id], offsets[service_id + 1])
+
+    def direction(self, route_id: int) -> str:
+        return self.strings[self.sections["route_dir"][route_id]]
+
+    def stop_ids(self, route_id: int) -> memoryview:
+        offsets = self.sections["route_offs"]
+        return self.sections["route_stops"][offsets[route_id] : offsets[route_id + 1]]
+
+    def __getitem__(self, key: str) -> dict[str, list[str]]:
+        route_ids = self.route_ids(self.services.ids[key])
+        if not route_ids:
+            raise KeyError(key)
+        return {
+            self.direction(route_id): [
+                self.stops.code(i) for i in self.stop_ids(route_id)
+            ]
+            for route_id in route_ids
+        }
+
+    def __iter__(self) -> Iterator[str]:
+        return (key for key, i in self.services.ids.items() if self.route_ids(i))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+class TransitStore:
+    """Read-only view of the static transit datasets in storage/.
+
+    The datasets are held in the packed columns of a snapshot (see helpers/snapshot.py),
+    which is memory-mapped when loaded from storage/, so that every worker process shares
+    the same physical pages instead of holding its own dicts. Lookups bisect or index
+    into the columns and build the returned dicts and lists on demand; callers must not
+    rely on getting the same object twice.
+    """
+
+    def __init__(self, data, fingerprint: Optional[bytes] = None):
+        """
+        Args:
+            data (bytes | mmap.mmap): Snapshot from encode_snapshot() or a snapshot file.
+            fingerprint (Optional[bytes]): If given, the snapshot must have been built
+                                           from JSON datasets with this fingerprint.
+
+        Raises:
+            SnapshotError: If the snapshot is invalid or stale.
+        """
+        self.data = data
+        # (device, inode, mtime) of the snapshot file the store was mapped from
+        self.snapshot_id: Optional[tuple[int, int, int]] = None
+        sections = read_sections(data, fingerprint)
+        strings = StringTable(sections["str_data"], sections["str_offs"])
+        self.sections = sections
+        self.strings = strings
+        self.stops = StopTable(sections, strings)
+        self.services = ServiceTable(sections, strings)
+        self.routes = RouteTable(sections, strings, self.stops, self.services)
+
+    @cached_property
+    def spatial_index(self) -> SpatialIndex:
+        """Spatial index over the bus stops, by stop index."""
+        return SpatialIndex(self.stops.latitudes, self.stops.longitudes)
+
+    @cached_property
+    def search_index(self) -> SearchIndex:
+        return SearchIndex(self.stops.records)
+
+    @classmethod
+    def from_datasets(
+        cls, bus_stops: list[dict], bus_services: dict, bus_routes: dict
+    ) -> "TransitStore":
+        """Builds a store from the datasets in the format of the JSON files in storage/."""
+        return cls(
+            encode_snapshot(*normalize_datasets(bus_stops, bus_services, bus_routes))
+        )
+
+    @classmethod
+    def from_json(cls, storage_dir: str = STORAGE_DIR) -> "TransitStore":
+        """Builds a store from the JSON files written by the storage/ loaders.
+
+        Args:
+            storage_dir (str): Directory containing bus_stops.json, bus_services.json
+                               and bus_routes.json.
+
+        Returns:
+            TransitStore: The loaded store.
+        """
+        with open(os.path.join(storage_dir, "bus_stops.json"), "r") as f:
+            bus_stops = json.load(f)
+        with open(os.path.join(storage_dir, "bus_services.json"), "r") as f:
+            bus_services = json.load(f)
+        with open(os.path.join(storage_dir, "bus_routes.json"), "r") as f:
+            bus_routes = json.load(f)
+        return cls.from_datasets(bus_stops, bus_services, bus_routes)
+
+    @classmethod
+    def from_snapshot(cls, storage_dir: str = STORAGE_DIR) -> "TransitStore":
+        """Memory-maps the binary snapshot of the JSON files in storage_dir.
+
+        Args:
+            storage_dir (str): Directory containing the snapshot and JSON files.
+
+        Raises:
+            FileNotFoundError: If the snapshot or one of the JSON files does not exist.
+            SnapshotError: If the snapshot is invalid or older than the JSON files.
+
+        Returns:
+            TransitStore: The loaded store.
+        """
+        fingerprint = source_fingerprint(storage_dir)
+        with open(os.path.join(storage_dir, SNAPSHOT_FILE), "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size == 0:
+                raise SnapshotError("Snapshot is truncated")
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        store = cls(data, fingerprint)
+        store.snapshot_id = snapshot_id(stat)
+        return store
+
+    @classmethod
+    def load(cls, storage_dir: str = STORAGE_DIR) -> "TransitStore":
+        """Builds a store from the snapshot in storage_dir, or from the JSON files if
+        the snapshot is missing, invalid or stale."""
+        try:
+            return cls.from_snapshot(storage_dir)
+        except FileNotFoundError:
+            logger.info("No transit snapshot, loading JSON")
+        except SnapshotError as e:
+            logger.warning("Ignoring transit snapshot: %s", e)
+        return cls.from_json(storage_dir)
+
+    def save_snapshot(self, storage_dir: str = STORAGE_DIR):
+        """Writes the store to a snapshot in storage_dir. The store must have been loaded
+        from the JSON files in storage_dir, which the snapshot is fingerprinted against.
+        """
+        write_snapshot(
+            os.path.join(storage_dir, SNAPSHOT_FILE),
+            self.data,
+            source_fingerprint(storage_dir),
+        )
+
+    def get_stop(self, code: str) -> Optional[dict]:
+        return self.stops.get(code)
+
+    def get_service(self, service_no: str) -> Optional[dict]:
+        return self.services.get(service_no.lower())
+
+    def get_route(self, service_no: str) -> Optional[dict[str, list[str]]]:
+        return self.routes.get(service_no.lower())
+
+    def get_route_directions(self, service_no: str, code: str) -> tuple[str, ...]:
+        """Returns the directions of the service that serve the bus stop. Loop services
+        can pass a stop in both directions; directions that merely terminate at the stop
+        are listed last, since an arriving bus continues on the other one."""
+        service_id = self.services.ids.get(service_no.lower())
+        stop_id = self.stops.index(code)
+        if service_id is None or stop_id is None:
+            return ()
+        offsets = self.sections["stop_route_offs"]
+        route_services = self.sections["route_svc"]
+        return tuple(
+            self.routes.direction(route_id)
+            for route_id in self.sections["stop_routes"][
+                offsets[stop_id] : offsets[stop_id + 1]
+            ]
+            if route_services[route_id] == service_id
+        )
+
+
+def normalize_datasets(
+    bus_stops: list[dict], bus_services: dict, bus_routes: dict
+) -> tuple[dict[str, dict], dict[str, dict], dict[str, dict[str, list[str]]]]:
+    """Converts the datasets from the format of the JSON files in storage/ to bus stops by
+    code, bus services by lowercase service number, and bus stop codes ordered by stop
+    sequence by lowercase service number and direction."""
+    stops = {stop["BusStopCode"]: stop for stop in bus_stops}
+    services = {
+        service_no.lower(): service for service_no, service in bus_services.items()
+    }
+    routes = {}
+    for service_no, route in bus_routes.items():
+        directions = {}
+        for direction, route_stops in route.items():
+            if direction == "ServiceNo":
+                continue
+            directions[direction] = [
+                stop["BusStopCode"]
+                for stop in sorted(route_stops, key=lambda x: x["StopSequence"])
+            ]
+        routes[service_no.lower()] = directions
+    return stops, services, routes
+
+
+def snapshot_id(stat: os.stat_result) -> tuple[int, int, int]:
+    """Identifies a version of the snapshot file. Snapshots are replaced rather than
+    rewritten in place, so a new snapshot has a new inode."""
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns
+
+
+_store: Optional[TransitStore] = None
+_store_lock = threading.Lock()
+_pinned_store: ContextVar[Optional[TransitStore]] = ContextVar(
+    "pinned_transit_store", default=None
+)
+
+
+def get_transit_store() -> TransitStore:
+    """Returns the store pinned by pin_transit_store(), or the process-wide transit store,
+    loading it on first use."""
+    global _store
+    pinned = _pinned_store.get()
+    if pinned is not None:
+        return pinned
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TransitStore.load()
+    return _store
+
+
+def set_transit_store(store: TransitStore):
+    """Replaces the process-wide transit store. Code that has pinned the previous store
+    keeps using it until it unpins it."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+@contextmanager
+def pin_transit_store():
+    """Makes get_transit_store() return the current store for the rest of the block in
+    this thread, so that handling an update sees one consistent version of the data even
+    if a refresh swaps in a new store meanwhile."""
+    token = _pinned_store.set(get_transit_store())
+    try:
+        yield
+    finally:
+        _pinned_store.reset(token)
+
+
+class TransitCache:
+    """Values derived from the transit store, such as rendered keyboards, built on first
+    use and cached for as long as the store is current.
+
+    Values are cached per store, so a refresh that swaps in a new store starts a new
+    cache, and updates that pinned the old store keep getting values built from it.
+    Cached values are shared and must not be mutated.
+    """
+
+    def __init__(self):
+        self._values: WeakKeyDictionary[TransitStore, dict[Hashable, object]] = (
+            WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, build: Callable[[], T]) -> T:
+        """Returns the value cached under the key for the current store, building it
+        with build if absent. Exceptions raised by build are not cached."""
+        store = get_transit_store()
+        with self._lock:
+            values = self._values.setdefault(store, {})
+            if key in values:
+                return values[key]
+        # Built outside the lock; a value built twice at once is the same either way
+        value = build()
+        with self._lock:
+            values[key] = value
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
@@ -0,0 +1,346 @@
+"""End-to-end load test of the webhook, against local stand-ins of the Bot API and
+DataMall.
+
+Starts the app under gunicorn as it runs on Fly, pointed at the stand-ins, and posts
+update streams to /webhook: sessions of commands, free-text replies, button presses and
+locations arrive at --rate per second, and within a session each update is sent once the
+bot has replied to the previous one, as a user would. An update's end-to-end latency runs
+from posting it to the bot's reply reaching the Bot API stand-in, so it includes queueing
+in the dispatcher and the send scheduler's rate limits.
+
+Run from the repository root, after python -m storage.create_maps:
+
+    python -m loadtest.run --workers 1 --rate 5 --duration 60
+    python -m loadtest.run --telegram-latency 0.2 --datamall-error-rate 0.05
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+
+from helpers.transit_store import TransitStore, get_transit_store
+
+from .stand_ins import DataMallStandIn, Faults, Reply, TelegramStandIn
+from .updates import SessionGenerator, callback_update, choose_button
+
+BOT_TOKEN = "123456:loadtest"
+READY_TIMEOUT = 60
+
+
+class Results:
+    """Outcomes of the updates of a run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: list[float] = []
+        self.statuses: Counter[str] = Counter()
+        self.kinds: Counter[str] = Counter()
+        self.sessions = 0
+        self.updates = 0
+        self.timeouts = 0
+        self.redeliveries = 0
+
+    def add(self, status: str, latency: Optional[float] = None):
+        with self.lock:
+            self.statuses[status] += 1
+            if status == "200":
+                self.updates += 1
+            if latency is None and status == "200":
+                self.timeouts += 1
+            elif latency is not None:
+                self.latencies.append(latency)
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class LoadTest:
+    def __init__(
+        self,
+        base_url: str,
+        telegram: TelegramStandIn,
+        generator: SessionGenerator,
+        reply_timeout: float,
+        redeliveries: int,
+    ):
+        self.base_url = base_url
+        self.telegram = telegram
+        self.generator = generator
+        self.reply_timeout = reply_timeout
+        self.redeliveries = redeliveries
+        self.results = Results()
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def post(self, update: dict) -> tuple[str, float]:
+        """Posts the update as Telegram would, redelivering it after a delay while the
+        bot sheds load with 503. Returns the last status and when the update was first
+        posted."""
+        started = time.monotonic()
+        for attempt in range(self.redeliveries + 1):
+            if attempt:
+                with self.results.lock:
+                    self.results.redeliveries += 1
+                time.sleep(min(2**attempt, 10))
+            try:
+                status = str(
+                    self._session()
+                    .post(f"{self.base_url}/webhook", json=update, timeout=10)
+                    .status_code
+                )
+            except requests.RequestException as e:
+                status = type(e).__name__
+            if status != "503":
+                break
+        return status, started
+
+    def run_session(self, chat_id: int, kind: str, steps: list):
+        rng = random.Random(chat_id)
+        reply = Reply()
+        with self.results.lock:
+            self.results.sessions += 1
+            self.results.kinds[kind] += 1
+        for replies, step in enumerate(steps, 1):
+            if callable(step):
+                data = choose_button(reply.keyboard, step, rng)
+                if data is None:
+                    return
+                step = callback_update(chat_id, data, reply.message_id)
+                self.telegram.expect_callback(step["callback_query"]["id"], chat_id)
+            status, started = self.post(step)
+            if status != "200":
+                self.results.add(status)
+                return
+            reply = self.telegram.wait_for_reply(chat_id, replies, self.reply_timeout)
+            if reply is None:
+                self.results.add(status)
+                return
+            self.results.add(status, reply.time - started)
+
+    def run(self, rate: float, duration: float, max_sessions: int) -> float:
+        """Starts sessions at the rate, at random like independent users, for the
+        duration, then waits for them to finish. Returns how long the run took."""
+        rng = random.Random(0)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_sessions) as executor:
+            next_arrival = started
+            while next_arrival < started + duration:
+                time.sleep(max(0.0, next_arrival - time.monotonic()))
+                executor.submit(self.run_session, *self.generator.session())
+                next_arrival += rng.expovariate(rate)
+        return time.monotonic() - started
+
+
+def start_app(
+    workers: int, port: int, env: dict[str, str], log_file
+) -> subprocess.Popen:
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-w",
+            str(workers),
+            "-b",
+            f"127.0.0.1:{port}",
+            "app:create_app()",
+        ],
+        env={**os.environ, **env},
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def wait_until_ready(base_url: str, app: subprocess.Popen):
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if app.poll() is not None:
+            raise RuntimeError(f"The app exited with {app.returncode}")
+        try:
+            # Each request may reach another worker, so a few in a row must succeed
+            if all(requests.get(f"{base_url}/ready", timeout=1).ok for _ in range(10)):
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"The app was not ready within {READY_TIMEOUT}s")
+
+
+def report(
+    results: Results,
+    elapsed: float,
+    telegram: TelegramStandIn,
+    datamall: DataMallStandIn,
+) -> dict:
+    updates = max(results.updates, 1)
+    latencies = results.latencies
+    summary = {
+        "seconds": elapsed,
+        "sessions": results.sessions,
+        "sessions_by_kind": dict(results.kinds),
+        "updates": results.updates,
+        "throughput_per_second": results.updates / elapsed,
+        "webhook_statuses": dict(results.statuses),
+        "redeliveries": results.redeliveries,
+        "reply_timeouts": results.timeouts,
+        "latency_seconds": {
+            "mean": statistics.fmean(latencies) if latencies else None,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies, default=None),
+        },
+        "telegram_calls_per_update": {
+            method: count / updates for method, count in telegram.calls.items()
+        },
+        "telegram_error_rate": sum(telegram.errors.values())
+        / max(sum(telegram.calls.values()), 1),
+        "datamall_calls_per_update": sum(datamall.calls.values()) / updates,
+        "datamall_error_rate": sum(datamall.errors.values())
+        / max(sum(datamall.calls.values()), 1),
+    }
+
+    def seconds(value: Optional[float]) -> str:
+        return f"{value * 1000:.0f} ms" if value is not None else "-"
+
+    print(
+        f"{results.sessions} sessions, {results.updates} updates in {elapsed:.1f}s: "
+        f"{summary['throughput_per_second']:.1f} updates/s"
+    )
+    print(
+        "latency: "
+        + ", ".join(
+            f"{name} {seconds(value)}"
+            for name, value in summary["latency_seconds"].items()
+        )
+    )
+    print(
+        f"webhook statuses: {dict(results.statuses)}, "
+        f"redeliveries: {results.redeliveries}, reply timeouts: {results.timeouts}"
+    )
+    print(
+        "Bot API calls per update: "
+        + ", ".join(
+            f"{method} {count:.2f}"
+            for method, count in sorted(summary["telegram_calls_per_update"].items())
+        )
+        + f" (errors {summary['telegram_error_rate']:.1%})"
+    )
+    print(
+        f"DataMall calls per update: {summary['datamall_calls_per_update']:.2f} "
+        f"(errors {summary['datamall_error_rate']:.1%})"
+    )
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn workers")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate", type=float, default=5, help="New sessions per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--reply-timeout", type=float, default=30)
+    parser.add_argument(
+        "--redeliveries",
+        type=int,
+        default=3,
+        help="Times an update shed with 503 is posted again",
+    )
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-error-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-429-rate", type=float, default=0.0)
+    parser.add_argument("--datamall-latency", type=float, default=0.1)
+    parser.add_argument("--datamall-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument(
+        "--app-log", default="loadtest.log", help="File for the app's output"
+    )
+    args = parser.parse_args()
+
+    store: TransitStore = get_transit_store()
+    telegram = TelegramStandIn(
+        Faults(
+            args.telegram_latency,
+            args.telegram_latency / 2,
+            args.telegram_error_rate,
+            args.seed,
+        ),
+        args.telegram_429_rate,
+    )
+    datamall = DataMallStandIn(
+        store,
+        Faults(
+            args.datamall_latency,
+            args.datamall_latency / 2,
+            args.datamall_error_rate,
+            args.seed,
+        ),
+    )
+    telegram.start()
+    datamall.start()
+
+    with tempfile.TemporaryDirectory() as state_dir, open(args.app_log, "w") as log:
+        env = {
+            "BOT_TOKEN": BOT_TOKEN,
+            "API_KEY": "loadtest",
+            "TELEGRAM_API_BASE": telegram.url,
+            "DATAMALL_URL": datamall.url,
+            # Replies to bare commands may reach another worker than the command did
+            "STATE_BACKEND": "sqlite",
+            "STATE_SQLITE_PATH": os.path.join(state_dir, "state.db"),
+            "FAVOURITES_PATH": os.path.join(state_dir, "favourites.db"),
+            # The storage datasets are not refreshed from the stand-in
+            "TRANSIT_REFRESH_INTERVAL": "0",
+        }
+        app = start_app(args.workers, args.port, env, log)
+        base_url = f"http://127.0.0.1:{args.port}"
+        try:
+            wait_until_ready(base_url, app)
+            test = LoadTest(
+                base_url,
+                telegram,
+                SessionGenerator(store, args.seed),
+                args.reply_timeout,
+                args.redeliveries,
+            )
+            elapsed = test.run(args.rate, args.duration, args.max_sessions)
+        finally:
+            app.terminate()
+            app.wait()
+            telegram.stop()
+            datamall.stop()
+
+    summary = report(test.results, elapsed, telegram, datamall)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from helpers.transit_store import TransitStore
+
+SGT = timezone(timedelta(hours=8))
+
+# Bot API methods that answer an update, as opposed to chat actions, locations and
+# callback query answers sent along the way
+REPLY_METHODS = {"sendMessage", "editMessageText"}
+
+
+class Faults:
+    """Latency and failures injected into a stand-in's responses."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        """
+        Args:
+            latency (float): Mean seconds before each response.
+            jitter (float): Responses are delayed by up to this many seconds more or less.
+            error_rate (float): Fraction of requests answered with an error.
+            seed (Optional[int]): Seed of the random faults, for repeatable runs.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self) -> float:
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-1, 1) * self.jitter)
+
+    def chance(self, rate: float) -> bool:
+        with self.lock:
+            return self.random.random() < rate
+
+    def fails(self) -> bool:
+        return self.chance(self.error_rate)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, faults: Faults):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.faults = faults
+        self.calls: Counter[str] = Counter()
+        self.errors: Counter[str] = Counter()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, name: str, failed: bool):
+        with self.lock:
+            self.calls[name] += 1
+            if failed:
+                self.errors[name] += 1
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Reply:
+    """The latest reply to a chat."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.keyboard: list[list[dict]] = []
+        self.message_id: Optional[int] = None
+
+
+class TelegramStandIn(StandInServer):
+    """Answers Bot API calls like api.telegram.org, and records when each chat was last
+    replied to so that the load generator can measure end-to-end latency.
+
+    A reply is a message sent or edited, or a callback query answered with a notice
+    instead of one. Failed calls are answered with a 502, which the bot does not retry,
+    or with a 429 at rate_limit_rate, which its send scheduler retries after retry_after.
+    """
+
+    def __init__(self, faults: Faults = None, rate_limit_rate: float = 0.0):
+        super().__init__(TelegramHandler, faults or Faults())
+        self.rate_limit_rate = rate_limit_rate
+        self.message_ids = iter(range(1, 1 << 62))
+        self.replies: dict[int, Reply] = {}
+        # Callback query ID -> chat ID, since answers do not name the chat
+        self.callback_chats: dict[str, int] = {}
+        self.replied = threading.Condition(self.lock)
+
+    def expect_callback(self, callback_query_id: str, chat_id: int):
+        with self.lock:
+            self.callback_chats[callback_query_id] = chat_id
+
+    def wait_for_reply(
+        self, chat_id: int, count: int, timeout: float
+    ) -> Optional[Reply]:
+        """Waits until the chat has had count replies. Returns the latest one, whose time
+        is from time.monotonic(), or None on timeout."""
+        with self.replied:
+            if not self.replied.wait_for(
+                lambda: chat_id in self.replies
+                and self.replies[chat_id].count >= count,
+                timeout,
+            ):
+                return None
+            reply = self.replies[chat_id]
+            latest = Reply()
+            latest.__dict__.update(reply.__dict__)
+            return latest
+
+    def record_reply(self, method: str, payload: dict, message_id: Optional[int]):
+        """Records the request if it is a reply that sent or edited the message."""
+        if method == "answerCallbackQuery":
+            # Only a notice stands in for a reply; the keyboard stays as it was
+            with self.lock:
+                chat_id = self.callback_chats.pop(
+                    payload.get("callback_query_id"), None
+                )
+            if chat_id is None or not payload.get("text"):
+                return
+        elif method in REPLY_METHODS and "chat_id" in payload:
+            chat_id = int(payload["chat_id"])
+        else:
+            return
+        with self.replied:
+            reply = self.replies.setdefault(chat_id, Reply())
+            reply.count += 1
+            reply.time = time.monotonic()
+            if message_id is not None:
+                reply.message_id = message_id
+                reply.keyboard = payload.get("reply_markup", {}).get(
+                    "inline_keyboard", []
+                )
+            self.replied.notify_all()
+
+
+class TelegramHandler(StandInHandler):
+    def do_POST(self):
+        server: TelegramStandIn = self.server
+        method = self.path.rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(server.faults.delay())
+
+        rate_limited = server.faults.chance(server.rate_limit_rate)
+        failed = not rate_limited and server.faults.fails()
+        server.count(method, failed or rate_limited)
+        if rate_limited:
+            self.send_json(
+                429,
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                },
+            )
+            return
+        if method in REPLY_METHODS:
+            message_id = payload.get("message_id") or next(server.message_ids)
+        else:
+            message_id = None
+        if failed:
+            self.send_json(
+                502, {"ok": False, "error_code": 502, "description": "Bad Gateway"}
+            )
+        else:
+            self.send_json(
+                200,
+                {
+                    "ok": True,
+                    "result": {
+                        "message_id": message_id,
+                        "chat": {"id": payload.get("chat_id")},
+                    },
+                },
+            )
+        # Recorded once answered, as users only see a message after Telegram has sent
+        # it. A failed reply still ends the update's handling, since it is not retried.
+        server.record_reply(method, payload, message_id)
+
+
+class DataMallStandIn(StandInServer):
+    """Answers BusArrival requests like DataMall, with every service of the stop due in
+    the next half hour. Failed requests are answered with a 503."""
+
+    def __init__(self, store: TransitStore, faults: Faults = None):
+        super().__init__(DataMallHandler, faults or Faults())
+        self.store = store
+
+    def bus_arrival(self, code: str) -> dict:
+        now = datetime.now(SGT)
+        rng = random.Random(code)
+        services = []
+        for key in self.store.routes:
+            if not self.store.get_route_directions(key, code):
+                continue
+            service = self.store.get_service(key)
+            first = rng.uniform(0, 15)
+            headway = rng.uniform(5, 15)
+            services.append(
+                {
+                    "ServiceNo": service["ServiceNo"] if service else key.upper(),
+                    "Operator": service["Operator"] if service else "SBST",
+                    **{
+                        name: {
+                            "OriginCode": "",
+                            "DestinationCode": "",
+                            "EstimatedArrival": (
+                                now + timedelta(minutes=first + n * headway)
+                            ).isoformat(timespec="seconds"),
+                            "Monitored": 1,
+                            "Latitude": "0.0",
+                            "Longitude": "0.0",
+                            "VisitNumber": "1",
+                            "Load": rng.choice(("SEA", "SDA", "LSD")),
+                            "Feature": "WAB",
+                            "Type": rng.choice(("SD", "DD", "BD")),
+                        }
+                        for n, name in enumerate(("NextBus", "NextBus2", "NextBus3"))
+                    },
+                }
+            )
+        return {"BusStopCode": code, "Services": services}
+
+
+class DataMallHandler(StandInHandler):
+    def do_GET(self):
+        server: DataMallStandIn = self.server
+        url = urlparse(self.path)
+        dataset = url.path.rsplit("/", 1)[-1]
+        time.sleep(server.faults.delay())
+        failed = server.faults.fails()
+        server.count(dataset, failed)
+        if failed:
+            self.send_json(503, {"fault": "Service Unavailable"})
+            return
+        if dataset != "BusArrival":
+            self.send_json(404, {"fault": f"Unknown dataset {dataset}"})
+            return
+        code = parse_qs(url.query).get("BusStopCode", [""])[0]
+        self.send_json(200, server.bus_arrival(code))
@@ -0,0 +1,213 @@
+import itertools
+import random
+import time
+from typing import Callable, Optional, Union
+
+from helpers.transit_store import TransitStore
+
+# Update and callback query IDs are unique across every session of a run
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+# A step of a session is an update to send, or a button to press on the latest reply.
+# Buttons are chosen by their callback data, and the session ends if none match.
+Click = Callable[[str], bool]
+Step = Union[dict, Click]
+
+SEARCH_QUERIES = [
+    "ang mo kio int",
+    "tampines",
+    "bedok stn",
+    "opp blk 10",
+    "jurong east",
+    "woodlands int",
+    "orchard",
+    "bt batok",
+    "clementi stn",
+    "tampnes",
+    "wodlands",
+]
+LOCATION_JITTER = 0.01
+
+
+# Callback data of buttons other than routes that also contain "|": pages of routes or
+# search results, arrivals near a location, and adding a favourite
+PREFIXED = ("pr|", "ps|", "nb|", "fa|")
+
+
+def is_page(data: str) -> bool:
+    # pr|start|serviceno|direction or ps|start|query
+    return data.startswith(("pr|", "ps|"))
+
+
+def is_nearby(data: str) -> bool:
+    # nb|latitude|longitude
+    return data.startswith("nb|")
+
+
+def is_stop(data: str) -> bool:
+    # busstopcode
+    return ":" not in data and "|" not in data
+
+
+def is_timing(data: str) -> bool:
+    # busstopcode:serviceno:mode, other than Track live and Stop tracking, whose edits
+    # keep arriving after the session has ended
+    return (
+        ":" in data
+        and not data.endswith((":t", ":s"))
+        and not data.startswith(PREFIXED)
+    )
+
+
+def is_route(data: str) -> bool:
+    # serviceno|direction|busstopcode
+    return "|" in data and not data.startswith(PREFIXED)
+
+
+def text_update(chat_id: int, text: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "chat": {"id": chat_id, "type": "private"},
+            "date": int(time.time()),
+            "text": text,
+        },
+    }
+
+
+def location_update(chat_id: int, latitude: float, longitude: float) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "chat": {"id": chat_id, "type": "private"},
+            "date": int(time.time()),
+            "location": {"latitude": latitude, "longitude": longitude},
+        },
+    }
+
+
+def callback_update(chat_id: int, data: str, message_id: int) -> dict:
+    """Returns a press of a button on the message with the ID."""
+    update_id = next(_update_ids)
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "message": {
+                "message_id": message_id,
+                "chat": {"id": chat_id, "type": "private"},
+                "date": int(time.time()),
+            },
+            "chat_instance": str(chat_id),
+            "data": data,
+        },
+    }
+
+
+def choose_button(
+    keyboard: list[list[dict]], click: Click, rng: random.Random
+) -> Optional[str]:
+    """Returns the callback data of a random button of the keyboard that the click
+    accepts, or None if there is none."""
+    data = [
+        button["callback_data"]
+        for row in keyboard
+        for button in row
+        if "callback_data" in button and click(button["callback_data"])
+    ]
+    return rng.choice(data) if data else None
+
+
+class SessionGenerator:
+    """Generates what a user does in one visit to the bot: a command or location,
+    sometimes a free-text reply to a bare command, then a few button presses.
+
+    Sessions are drawn from MIX, weighted by how often each is expected in production:
+    mostly bus stop lookups, then locations and services.
+    """
+
+    MIX = {
+        "busstop_code": 30,
+        "busstop_search": 20,
+        "busstop_reply": 10,
+        "bus": 10,
+        "bus_reply": 5,
+        "location": 15,
+        "location_arrivals": 5,
+        "favourites": 5,
+        "start": 3,
+        "help": 2,
+    }
+
+    def __init__(self, store: TransitStore, seed: Optional[int] = None):
+        self.store = store
+        self.rng = random.Random(seed)
+        self.codes = [store.stops.code(i) for i in range(len(store.stops))]
+        self.services = list(store.routes)
+        self._chat_ids = itertools.count(10_000_000)
+
+    def random_location(self) -> tuple[float, float]:
+        # Near a bus stop, since users are on land rather than anywhere in Singapore
+        i = self.rng.randrange(len(self.store.stops))
+        return (
+            self.store.stops.latitudes[i] + self.rng.uniform(-1, 1) * LOCATION_JITTER,
+            self.store.stops.longitudes[i] + self.rng.uniform(-1, 1) * LOCATION_JITTER,
+        )
+
+    def session(self) -> tuple[int, str, list[Step]]:
+        """Returns a new session as its chat ID, kind and steps."""
+        chat_id = next(self._chat_ids)
+        kind = self.rng.choices(list(self.MIX), weights=list(self.MIX.values()))[0]
+        rng = self.rng
+        match kind:
+            case "busstop_code":
+                steps = [
+                    text_update(chat_id, f"/busstop {rng.choice(self.codes)}"),
+                    is_timing,
+                    is_timing,  # Refresh
+                ]
+            case "busstop_search":
+                steps = [
+                    text_update(chat_id, f"/busstop {rng.choice(SEARCH_QUERIES)}"),
+                    is_stop,
+                    is_timing,
+                ]
+            case "busstop_reply":
+                steps = [
+                    text_update(chat_id, "/busstop"),
+                    text_update(chat_id, rng.choice(self.codes)),
+                    is_route,
+                    is_timing,
+                ]
+            case "bus":
+                steps = [
+                    text_update(chat_id, f"/bus {rng.choice(self.services)}"),
+                    is_route,
+                    is_timing,
+                ]
+            case "bus_reply":
+                steps = [
+                    text_update(chat_id, "/bus"),
+                    text_update(chat_id, rng.choice(self.services)),
+                    is_route,
+                ]
+            case "location":
+                steps = [location_update(chat_id, *self.random_location()), is_stop]
+            case "favourites":
+                steps = [
+                    text_update(chat_id, f"/fav add {code}")
+                    for code in rng.sample(self.codes, rng.randint(1, 3))
+                ] + [text_update(chat_id, "/fav")]
+            case "location_arrivals":
+                steps = [location_update(chat_id, *self.random_location()), is_nearby]
+            case _:
+                steps = [text_update(chat_id, f"/{kind}")]
+        # Button presses come last, and not every user goes on to press them all
+        presses = sum(1 for step in steps if callable(step))
+        return chat_id, kind, steps[: len(steps) - rng.randint(0, presses)]
@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class ArrivalCache:
+    """Thread-safe LRU cache of BusArrival responses keyed by bus stop code.
+
+    Entries expire ttl seconds after they were fetched. LTA refreshes arrival estimates
+    roughly every 20 seconds, so serving a response younger than that is as good as
+    fetching it again.
+    """
+
+    def __init__(
+        self, ttl: float, maxsize: int, clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Args:
+            ttl (float): Seconds a response is served for after it was fetched.
+            maxsize (int): Most bus stops kept; the least recently used are evicted.
+            clock (Callable[[], float]): Returns the current time in seconds.
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, code: str, record: bool = True) -> Optional[list[dict]]:
+        """Returns the cached services for the bus stop, or None if absent or expired.
+
+        Args:
+            code (str): Code of the bus stop.
+            record (bool): Whether to count the lookup as a hit or miss. Lookups checking
+                           again after a counted miss are not.
+        """
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None or self.clock() - entry[0] > self.ttl:
+                if record:
+                    self.misses += 1
+                return None
+            self._entries.move_to_end(code)
+            if record:
+                self.hits += 1
+            return entry[1]
+
+    def set(self, code: str, services: list[dict]):
+        with self._lock:
+            self._entries[code] = (self.clock(), services)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,15 +1,223 @@
+import contextvars
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, Optional
 
 import requests
-from dotenv import load_dotenv
 
+from config import API_KEY, DATAMALL_URL
 from exceptions.exceptions import APIError, NoMoreBusError
+from helpers.http_client import create_session
+from helpers.metrics import REGISTRY, Counter, Gauge, Histogram, format_metric
+from helpers.tracing import traced
+from lta_utils.arrival_cache import ArrivalCache
+from lta_utils.single_flight import SingleFlight
 
-load_dotenv()
-
-API_KEY = os.getenv("API_KEY")
 HEADERS = {"AccountKey": API_KEY, "Accept": "application/json"}
 
+# DataMall calls are idempotent reads, so they can be retried on any failure
+session = create_session(retry_methods=["GET"])
+session.headers.update(HEADERS)
+
+BUS_ARRIVAL_URL = f"{DATAMALL_URL}/v3/BusArrival"
+
+arrival_cache = ArrivalCache(
+    ttl=float(os.getenv("ARRIVAL_CACHE_TTL", "20")),
+    maxsize=int(os.getenv("ARRIVAL_CACHE_SIZE", "1024")),
+)
+
+# Concurrent cache misses for the same bus stop share one BusArrival request
+bus_arrival_flight = SingleFlight()
+
+# Threads fetching the bus stops of a batch lookup, such as the stops near a location
+ARRIVAL_FETCH_WORKERS = int(os.getenv("ARRIVAL_FETCH_WORKERS", "8"))
+_fetch_pool: Optional[ThreadPoolExecutor] = None
+_fetch_pool_lock = threading.Lock()
+
+DATAMALL_SECONDS = Histogram(
+    "datamall_request_seconds",
+    "Time taken by DataMall requests, including retries",
+    ["endpoint"],
+)
+DATAMALL_REQUESTS = Counter(
+    "datamall_requests_total",
+    "DataMall requests by outcome: the status code, or the error if there was none",
+    ["endpoint", "outcome"],
+)
+DATAMALL_IN_FLIGHT = Gauge(
+    "datamall_requests_in_flight", "DataMall requests in progress", ["endpoint"]
+)
+BATCH_MISSES = Counter(
+    "arrival_batch_misses_total",
+    "Bus stops left out of batch lookups: error, or deadline if not fetched in time",
+    ["reason"],
+)
+
+
+def collect_arrival_metrics() -> Iterator[str]:
+    hits, misses = arrival_cache.hits, arrival_cache.misses
+    yield from format_metric(
+        "arrival_cache_hits_total",
+        "counter",
+        "BusArrival lookups served from the arrival cache",
+        [((), hits)],
+    )
+    yield from format_metric(
+        "arrival_cache_misses_total",
+        "counter",
+        "BusArrival lookups not in the arrival cache",
+        [((), misses)],
+    )
+    yield from format_metric(
+        "arrival_cache_hit_ratio",
+        "gauge",
+        "Fraction of BusArrival lookups served from the arrival cache",
+        [((), hits / (hits + misses) if hits + misses else 0)],
+    )
+    yield from format_metric(
+        "arrival_cache_entries",
+        "gauge",
+        "Bus stops in the arrival cache",
+        [((), len(arrival_cache))],
+    )
+    yield from format_metric(
+        "bus_arrival_fetches_total",
+        "counter",
+        "BusArrival requests made for cache misses",
+        [((), bus_arrival_flight.calls)],
+    )
+    yield from format_metric(
+        "bus_arrival_coalesced_total",
+        "counter",
+        "Cache misses that waited for a request already in flight for the bus stop",
+        [((), bus_arrival_flight.coalesced)],
+    )
+
+
+REGISTRY.register_collector("arrival", collect_arrival_metrics)
+
+
+@traced("lta.bus_arrival")
+def get_bus_arrival(code: str) -> list[dict]:
+    """Returns the BusArrival services for the specified bus stop, served from the arrival
+       cache if a fresh response is available.
+
+    Args:
+        code (str): Code of the bus stop.
+
+    Raises:
+        APIError: If response status code is not 200.
+
+    Returns:
+        list[dict]: The "Services" list of the BusArrival response.
+    """
+    services = arrival_cache.get(code)
+    if services is not None:
+        return services
+    return bus_arrival_flight.do(code, lambda: fetch_missed_bus_arrival(code))
+
+
+def fetch_missed_bus_arrival(code: str) -> list[dict]:
+    """Fetches BusArrival for a bus stop that missed the arrival cache, as the leader of
+    its flight. The cache is checked again first, since a flight for the bus stop may
+    have finished and filled it since the miss.
+    """
+    services = arrival_cache.get(code, record=False)
+    if services is not None:
+        return services
+    return fetch_bus_arrival(code)
+
+
+@traced("lta.fetch")
+def fetch_bus_arrival(code: str) -> list[dict]:
+    """Requests BusArrival for the specified bus stop from DataMall and caches the response.
+
+    Args:
+        code (str): Code of the bus stop.
+
+    Raises:
+        APIError: If response status code is not 200.
+
+    Returns:
+        list[dict]: The "Services" list of the BusArrival response.
+    """
+    started = time.perf_counter()
+    try:
+        with DATAMALL_IN_FLIGHT.track_in_progress("BusArrival"):
+            res = session.get(BUS_ARRIVAL_URL, params={"BusStopCode": code})
+    except requests.RequestException as e:
+        DATAMALL_REQUESTS.inc("BusArrival", type(e).__name__)
+        raise APIError(message=f"Could not reach LTA DataMall ({type(e).__name__}).")
+    finally:
+        DATAMALL_SECONDS.observe(time.perf_counter() - started, "BusArrival")
+    DATAMALL_REQUESTS.inc("BusArrival", str(res.status_code))
+    if res.status_code != 200:
+        raise APIError(res.status_code)
+    services = res.json().get("Services", [])
+    arrival_cache.set(code, services)
+    return services
+
+
+def get_fetch_pool() -> ThreadPoolExecutor:
+    global _fetch_pool
+    if _fetch_pool is None:
+        with _fetch_pool_lock:
+            if _fetch_pool is None:
+                _fetch_pool = ThreadPoolExecutor(
+                    ARRIVAL_FETCH_WORKERS, thread_name_prefix="arrival-fetch"
+                )
+    return _fetch_pool
+
+
+@traced("lta.bus_arrivals")
+def get_bus_arrivals(codes: Iterable[str], timeout: float) -> dict[str, list[dict]]:
+    """Returns the BusArrival services of each of the bus stops. Fresh responses are
+       served from the arrival cache, and the rest are fetched concurrently, so a batch
+       takes about as long as its slowest request.
+
+    Args:
+        codes (Iterable[str]): Codes of the bus stops.
+        timeout (float): Seconds to wait for the requests. Requests still running then
+                         carry on, and cache their response for the next lookup.
+
+    Returns:
+        dict[str, list[dict]]: The "Services" list of the BusArrival response by bus stop
+                               code. Bus stops whose request failed or did not finish in
+                               time are left out.
+    """
+    arrivals = {}
+    misses = []
+    for code in dict.fromkeys(codes):
+        services = arrival_cache.get(code)
+        if services is None:
+            misses.append(code)
+        else:
+            arrivals[code] = services
+    if not misses:
+        return arrivals
+    pool = get_fetch_pool()
+    futures = {
+        # Run in a copy of this context, so that the requests are part of its trace
+        pool.submit(
+            contextvars.copy_context().run,
+            bus_arrival_flight.do,
+            code,
+            lambda code=code: fetch_missed_bus_arrival(code),
+        ): code
+        for code in misses
+    }
+    done, not_done = wait(futures, timeout)
+    for future in done:
+        if future.exception() is None:
+            arrivals[futures[future]] = future.result()
+        else:
+            BATCH_MISSES.inc("error")
+    if not_done:
+        BATCH_MISSES.inc("deadline", amount=len(not_done))
+    return arrivals
+
 
 def get_bus_services_by_code(code: str) -> list[dict]:
     """Returns a list of bus service numbers and their next estimated arrival timings for the specified bus stop.
@@ -23,13 +231,7 @@ def get_bus_services_by_code(code: str) -> list[dict]:
     Returns:
         list[dict]: List of bus service numbers and their next estimated arrival timings.
     """
-    url = "https://datamall2.mytransport.sg/ltaodataservice/v3/BusArrival"
-    res = requests.get(f"{url}?BusStopCode={code}", headers=HEADERS)
-    if res.status_code != 200:
-        raise APIError(res.status_code)
-    if not "Services" in res.json():
-        return []
-    services = res.json()["Services"]
+    services = get_bus_arrival(code)
     service_numbers = []
     for service in services:
         if "NextBus" in service:
@@ -44,7 +246,8 @@ def get_bus_services_by_code(code: str) -> list[dict]:
 
 def get_bus_timing(code: str, service: str) -> list[dict]:
     """Returns the arrival information of the next 3 buses of the specified service number
-       at the given bus stop.
+       at the given bus stop. The arrivals are taken from the full bus stop response, so a
+       recent lookup of the bus stop is reused.
 
     Args:
         code (str): The code of the bus stop to check.
@@ -57,14 +260,7 @@ def get_bus_timing(code: str, service: str) -> list[dict]:
     Returns:
         list[dict]: A list of up to 3 dictionaries, each representing an arriving bus.
     """
-    url = "https://datamall2.mytransport.sg/ltaodataservice/v3/BusArrival"
-    res = requests.get(f"{url}?BusStopCode={code}&ServiceNo={service}", headers=HEADERS)
-    if res.status_code != 200:
-        raise APIError(res.status_code)
-    if not "Services" in res.json():
-        raise NoMoreBusError()
-    if res.json()["Services"] == []:
-        raise NoMoreBusError()
-    data = res.json()["Services"][0]
-    arrivals = [data["NextBus"], data["NextBus2"], data["NextBus3"]]
-    return arrivals
+    for data in get_bus_arrival(code):
+        if data["ServiceNo"].lower() == service.lower():
+            return [data["NextBus"], data["NextBus2"], data["NextBus3"]]
+    raise NoMoreBusError()
@@ -1,17 +1,13 @@
 import json
-import os
 
 import requests
-from dotenv import load_dotenv
 
-load_dotenv()
-
-BOT_TOKEN = os.getenv("BOT_TOKEN")
+from config import TELEGRAM_API_URL
 
 with open("storage/bot_commands.json") as f:
     commands = json.load(f)
     response = requests.post(
-        f"https://api.telegram.org/bot{BOT_TOKEN}/setMyCommands",
+        f"{TELEGRAM_API_URL}/setMyCommands",
         params={"commands": json.dumps(commands)},
     )
     print(response)
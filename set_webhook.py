@@ -1,22 +1,21 @@
-import os
-
-import requests
-from dotenv import load_dotenv
+"""Registers the app's /webhook with Telegram.
 
+Runs once per deploy as the Fly release command, not on every worker boot.
+"""
 
-def main():
+import requests
 
-    load_dotenv()
+from config import TELEGRAM_API_URL, URL
 
-    BOT_TOKEN = os.getenv("BOT_TOKEN")
-    mode = os.getenv("MODE")
-    URL = os.getenv("URL") if mode == "prod" else os.getenv("URL_DEV")
 
+def main():
     response = requests.post(
-        f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook",
+        f"{TELEGRAM_API_URL}/setWebhook",
         params={"url": f"{URL}/webhook"},
+        timeout=10,
     )
-    print(response)
+    print(response.json())
+    response.raise_for_status()
 
 
 if __name__ == "__main__":
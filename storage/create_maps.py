@@ -1,10 +1,15 @@
 import json
+import os
 
+from helpers.transit_store import TransitStore
 
-def main():
-    with open("bus_stops.json", "r") as json_file:
+STORAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main(storage_dir: str = STORAGE_DIR):
+    with open(os.path.join(storage_dir, "bus_stops.json"), "r") as json_file:
         bus_stops = json.load(json_file)
-        with open("bus_stop_map_code.json", "w") as f:
+        with open(os.path.join(storage_dir, "bus_stop_map_code.json"), "w") as f:
             dict = {}
             for stop in bus_stops:
                 key = stop["BusStopCode"]
@@ -17,7 +22,7 @@ def main():
                 }
                 dict[key] = info
             json.dump(dict, f, indent=4)
-        with open("bus_stop_map_description.json", "w") as f:
+        with open(os.path.join(storage_dir, "bus_stop_map_description.json"), "w") as f:
             dict = {}
             for stop in bus_stops:
                 key = stop["Description"].lower()
@@ -33,6 +38,7 @@ def main():
                 else:
                     dict[key].append(info)
             json.dump(dict, f, indent=4)
+    TransitStore.from_json(storage_dir).save_snapshot(storage_dir)
 
 
 if __name__ == "__main__":
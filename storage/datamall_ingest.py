@@ -0,0 +1,115 @@
+import json
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+import requests
+
+from config import API_KEY, DATAMALL_URL
+from helpers.http_client import create_session
+
+PAGE_SIZE = 500
+MAX_IN_FLIGHT = int(os.getenv("DATAMALL_MAX_IN_FLIGHT", "4"))
+
+STORAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def create_datamall_session() -> requests.Session:
+    session = create_session(
+        retry_methods=["GET"], retry_statuses=(429, 500, 502, 503, 504)
+    )
+    session.headers.update({"AccountKey": API_KEY, "Accept": "application/json"})
+    return session
+
+
+def fetch_page(session: requests.Session, dataset: str, page: int) -> list[dict]:
+    res = session.get(f"{DATAMALL_URL}/{dataset}", params={"$skip": page * PAGE_SIZE})
+    res.raise_for_status()
+    return res.json()["value"]
+
+
+def fetch_dataset(
+    dataset: str,
+    on_page: Callable[[list[dict]], None],
+    max_in_flight: int = MAX_IN_FLIGHT,
+    session: Optional[requests.Session] = None,
+) -> int:
+    """Fetches every page of a DataMall dataset with up to max_in_flight requests at once.
+
+    Pages are requested ahead of time, and on_page is called with the records of each page
+    in page order as soon as all earlier pages have arrived. No more pages are requested
+    once an empty page arrives.
+
+    Args:
+        dataset (str): DataMall dataset, e.g. "BusStops".
+        on_page (Callable[[list[dict]], None]): Called with the records of each page.
+        max_in_flight (int): Maximum number of concurrent page requests.
+        session (Optional[requests.Session]): Session to use, created if not given.
+
+    Raises:
+        requests.RequestException: If a page could not be fetched after retries.
+
+    Returns:
+        int: Total number of records fetched.
+    """
+    session = session or create_datamall_session()
+    futures: dict[int, Future] = {}
+    next_page = 0
+    next_to_emit = 0
+    total = 0
+    with ThreadPoolExecutor(max_in_flight) as executor:
+        while True:
+            while len(futures) < max_in_flight:
+                futures[next_page] = executor.submit(
+                    fetch_page, session, dataset, next_page
+                )
+                next_page += 1
+            # Pages are emitted in order, so only the next page is worth waiting for
+            records = futures.pop(next_to_emit).result()
+            if not records:
+                # Every later page is empty too
+                for future in futures.values():
+                    future.cancel()
+                return total
+            on_page(records)
+            total += len(records)
+            next_to_emit += 1
+
+
+class JsonArrayWriter:
+    """Writes a JSON array one element at a time, formatted like json.dump(indent=4)."""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def __enter__(self):
+        self.f.write("[")
+        return self
+
+    def write(self, item):
+        self.f.write(",\n    " if self.count else "\n    ")
+        self.f.write(json.dumps(item, indent=4).replace("\n", "\n    "))
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        # A failed write leaves the array unclosed, so it cannot be mistaken for a whole one
+        if exc_type is None:
+            self.f.write("\n]" if self.count else "]")
+
+
+def write_json_atomic(path: str, write: Callable):
+    """Calls write with a file object for a temporary file, then moves it to path, so that
+    readers never see a partially written file. If write raises, the temporary file is
+    removed and the file at path is left as it was."""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -1,17 +1,12 @@
 import json
 import os
 
-import dotenv
-import requests
+from storage.datamall_ingest import STORAGE_DIR, fetch_dataset, write_json_atomic
 
 
-def main():
-    dotenv.load_dotenv()
-    API_KEY = os.getenv("API_KEY")
-    URL = "https://datamall2.mytransport.sg/ltaodataservice/BusRoutes"
-    headers = {"AccountKey": API_KEY, "Accept": "application/json"}
-
-    i = 0
+def fetch() -> dict:
+    """Fetches the BusRoutes dataset as the stops of each direction by lowercase service
+    number."""
     all_services = {}
 
     def process_data(data):
@@ -39,16 +34,17 @@ def main():
                         bus_stop_dict
                     ]
 
-    while True:
-        response = requests.request("GET", f"{URL}?$skip={i * 500}", headers=headers)
-        data = response.json()["value"]
-        if not data:
-            break
-        process_data(data)
-        i += 1
+    fetch_dataset("BusRoutes", process_data)
+    return all_services
+
+
+def main():
+    all_services = fetch()
 
-    with open("./bus_routes.json", "w") as f:
-        json.dump(all_services, f, indent=4)
+    write_json_atomic(
+        os.path.join(STORAGE_DIR, "bus_routes.json"),
+        lambda f: json.dump(all_services, f, indent=4),
+    )
 
 
 if __name__ == "__main__":
@@ -1,11 +1,12 @@
 import json
 import os
 
-import dotenv
-import requests
+from storage.datamall_ingest import STORAGE_DIR, fetch_dataset, write_json_atomic
 
 
-def main():
+def fetch() -> dict:
+    """Fetches the BusServices dataset as bus services by lowercase service number."""
+
     def process_data(data):
         for service in data:
             lowercase_service_no = service["ServiceNo"].lower()
@@ -28,26 +29,18 @@ def main():
                     "Directions": [direction_info],
                 }
 
-    dotenv.load_dotenv()
-    API_KEY = os.getenv("API_KEY")
-    URL = "https://datamall2.mytransport.sg/ltaodataservice/BusServices"
-    headers = {"AccountKey": API_KEY, "Accept": "application/json"}
-
-    i = 0
     all_services = {}
-    while True:
-        response = requests.request("GET", f"{URL}?$skip={i * 500}", headers=headers)
-        data = response.json()["value"]
+    fetch_dataset("BusServices", process_data)
+    return all_services
 
-        if not data:
-            break
 
-        process_data(data)
-
-        i += 1
+def main():
+    all_services = fetch()
 
-    with open("./bus_services.json", "w") as f:
-        json.dump(all_services, f, indent=4)
+    write_json_atomic(
+        os.path.join(STORAGE_DIR, "bus_services.json"),
+        lambda f: json.dump(all_services, f, indent=4),
+    )
 
 
 if __name__ == "__main__":
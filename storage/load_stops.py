@@ -1,28 +1,32 @@
-import json
 import os
 
-import dotenv
-import requests
+from storage.datamall_ingest import (
+    STORAGE_DIR,
+    JsonArrayWriter,
+    fetch_dataset,
+    write_json_atomic,
+)
+
+
+def fetch() -> list[dict]:
+    """Fetches the BusStops dataset."""
+    bus_stops = []
+    fetch_dataset("BusStops", bus_stops.extend)
+    return bus_stops
 
 
 def main():
-    dotenv.load_dotenv()
-    API_KEY = os.getenv("API_KEY")
-    URL = "https://datamall2.mytransport.sg/ltaodataservice/BusStops"
-    headers = {"AccountKey": API_KEY, "Accept": "application/json"}
-
-    i = 0
-    all_stops = []
-    while True:
-        response = requests.request("GET", f"{URL}?$skip={i * 500}", headers=headers)
-        data = response.json()["value"]
-        if not data:
-            break
-        all_stops.extend(data)
-        i += 1
-
-    with open("./bus_stops.json", "w") as f:
-        json.dump(all_stops, f, indent=4)
+    def write(f):
+        # Stops are written out page by page instead of being collected first
+        with JsonArrayWriter(f) as writer:
+
+            def process_data(data):
+                for stop in data:
+                    writer.write(stop)
+
+            fetch_dataset("BusStops", process_data)
+
+    write_json_atomic(os.path.join(STORAGE_DIR, "bus_stops.json"), write)
 
 
 if __name__ == "__main__":
@@ -1,16 +1,29 @@
-import create_maps
-import load_bus_routes
-import load_bus_services
-import load_stops
+"""Downloads the static bus datasets from DataMall into storage/.
 
-load_bus_routes.main()
-print("Loaded bus routes in bus_routes.json")
+Run from the repository root:
 
-load_bus_services.main()
-print("Loaded bus services in bus_services.json")
+    python -m storage.load_storage
+"""
 
-load_stops.main()
-print("Loaded bus stops in bus_stops.json")
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import create_maps, load_bus_routes, load_bus_services, load_stops
+
+with ThreadPoolExecutor() as executor:
+    routes = executor.submit(load_bus_routes.main)
+    services = executor.submit(load_bus_services.main)
+    stops = executor.submit(load_stops.main)
+
+    routes.result()
+    print("Loaded bus routes in bus_routes.json")
+
+    services.result()
+    print("Loaded bus services in bus_services.json")
+
+    stops.result()
+    print("Loaded bus stops in bus_stops.json")
 
 create_maps.main()
-print("Created bus_stop_map_code.json and bus_stop_map_description.json")
+print(
+    "Created bus_stop_map_code.json, bus_stop_map_description.json and transit.snapshot"
+)
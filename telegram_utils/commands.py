@@ -1,10 +1,15 @@
-import heapq
-import json
+import atexit
+import hashlib
 import logging
+import os
 import textwrap
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
 
-import geopy.distance
-
+import config  # noqa: F401 - loads .env before the settings below are read
 from exceptions.error_handling import handle_error
 from exceptions.exceptions import (
     APIError,
@@ -12,6 +17,8 @@ from exceptions.exceptions import (
     InvalidCommandError,
     NoMoreBusError,
     NoSearchResultsError,
+    ServiceNotAtStopError,
+    TooManyFavouritesError,
 )
 from helpers.helpers import (
     format_timedelta,
@@ -26,19 +33,136 @@ from helpers.helpers import (
     is_bus_stop_code,
     search_bus_stop_descriptions,
 )
-from lta_utils.lta_api import get_bus_services_by_code, get_bus_timing
+from helpers.metrics import REGISTRY, Counter, Histogram, format_metric, timed
+from helpers.tracing import span, traced
+from helpers.transit_store import TransitCache, get_transit_store
+from lta_utils.lta_api import (
+    arrival_cache,
+    get_bus_arrival,
+    get_bus_arrivals,
+    get_bus_services_by_code,
+    get_bus_timing,
+)
 
+from .favourites import get_favourites
 from .messaging import (
     answerCallbackQuery,
+    edit_message_inline_keyboard,
+    get_scheduler,
     send_location,
     send_message,
     send_message_inline_keyboard,
     typing,
 )
+from .pagination import Page, paginate
+from .send_scheduler import Priority
 from .state import State, set_state
+from .state_backends import StateBackend, create_state_backend
+from .tracking import TRACK_MAX_SUBSCRIPTIONS, ArrivalTracker, Subscription
 
 logger = logging.getLogger(__name__)
 
+HANDLER_SECONDS = Histogram(
+    "bot_handler_seconds",
+    "Time taken by each command, location and callback query handler",
+    ["handler"],
+)
+HANDLER_CALLS = Counter(
+    "bot_handler_calls_total",
+    "Handler calls by outcome: ok, or the error raised out of the handler",
+    ["handler", "outcome"],
+)
+
+SGT = timezone(timedelta(hours=8))
+
+# Route and direction keyboards, which only change when the transit data is refreshed
+keyboards = TransitCache()
+
+# Bus stops shown by Show arrivals under the nearest bus stops
+NEARBY_ARRIVALS_STOPS = int(os.getenv("NEARBY_ARRIVALS_STOPS", "5"))
+# How long messages with the arrivals of several bus stops, such as /fav, wait for them
+# before showing the stops that were not fetched in time without them
+ARRIVALS_BATCH_TIMEOUT = float(os.getenv("ARRIVALS_BATCH_TIMEOUT", "2.5"))
+
+# When each bus timings message was last refreshed and last rendered, and a digest of
+# its timings, so that Refresh edits it only when the timings changed. Kept in the state backend so that
+# taps reaching other workers are debounced too.
+REFRESH_STATE_SIZE = 10000
+REFRESH_STATE_TTL = 60 * 60
+_refreshed_messages: Optional[StateBackend] = None
+_refreshed_messages_lock = threading.Lock()
+
+
+def get_refreshed_messages() -> StateBackend:
+    global _refreshed_messages
+    if _refreshed_messages is None:
+        with _refreshed_messages_lock:
+            if _refreshed_messages is None:
+                _refreshed_messages = create_state_backend(
+                    "refreshed_messages", REFRESH_STATE_SIZE
+                )
+    return _refreshed_messages
+
+
+# When each tracked message stops being live, kept in the state backend so that Stop
+# tracking ends the tracking even if it reaches another worker than the one tracking
+_tracked_messages: Optional[StateBackend] = None
+_tracked_messages_lock = threading.Lock()
+_tracker: Optional[ArrivalTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracked_messages() -> StateBackend:
+    global _tracked_messages
+    if _tracked_messages is None:
+        with _tracked_messages_lock:
+            if _tracked_messages is None:
+                _tracked_messages = create_state_backend(
+                    "tracked_messages", TRACK_MAX_SUBSCRIPTIONS
+                )
+    return _tracked_messages
+
+
+def get_tracker() -> ArrivalTracker:
+    """Returns the tracker keeping this worker's live timings messages up to date. Its
+    threads are started on first use rather than at import."""
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = ArrivalTracker(
+                    get_bus_arrival,
+                    update_tracked_timings,
+                    interrupt=interrupt_tracking,
+                )
+                _tracker.start()
+                # Exit handlers run in reverse, so registering after the scheduler's
+                # sends the last edits of interrupt_tracking before it drains
+                get_scheduler()
+                atexit.register(_tracker.shutdown)
+    return _tracker
+
+
+def collect_tracker_metrics() -> Iterator[str]:
+    # Reported once the tracker exists, rather than starting it to report zeros
+    if _tracker is None:
+        return
+    stats = _tracker.stats()
+    for name, type, help in (
+        ("subscriptions", "gauge", "Timings messages being tracked live"),
+        ("stops", "gauge", "Bus stops polled for tracked messages"),
+        ("polls", "counter", "Polls of tracked bus stops"),
+        ("poll_errors", "counter", "Polls of tracked bus stops that failed"),
+        ("expired", "counter", "Tracked messages that reached the tracking timeout"),
+    ):
+        suffix = "_total" if type == "counter" else ""
+        yield from format_metric(
+            f"bot_tracking_{name}{suffix}", type, help, [((), stats[name])]
+        )
+
+
+REGISTRY.register_collector("tracker", collect_tracker_metrics)
+
 
 def handle_command(chat_id: str, command_word: str, args: list[str]):
     match command_word:
@@ -50,6 +174,10 @@ def handle_command(chat_id: str, command_word: str, args: list[str]):
             start(chat_id)
         case "bus":
             bus(chat_id, args)
+        case "track":
+            track(chat_id, args)
+        case "fav":
+            fav(chat_id, args)
         case _:
             raise InvalidCommandError()
 
@@ -65,6 +193,7 @@ def handle_state(chat_id: str, state: State, message: dict):
             bus(chat_id, args)
 
 
+@timed(HANDLER_SECONDS, HANDLER_CALLS, "start")
 def start(chat_id: str):
     message = textwrap.dedent(
         """
@@ -76,6 +205,7 @@ def start(chat_id: str):
     send_message(chat_id, message)
 
 
+@timed(HANDLER_SECONDS, HANDLER_CALLS, "help")
 def help(chat_id: str):
     message = textwrap.dedent(
         """
@@ -91,6 +221,15 @@ def help(chat_id: str):
         <code>/bus 123</code>
         • You can also type /bus, then send the service number after
 
+        <b>⏱ Track a bus until it arrives:</b>
+        <code>/track 12345 123</code>
+        • You can also tap Track live on any bus timings
+
+        <b>⭐ See bus timings at your favourite stops:</b>
+        <code>/fav</code>
+        • Add a stop with <code>/fav add 12345</code>, or tap Add to favourites
+        • Remove one with <code>/fav remove 12345</code>
+
         <b>📍 Find nearby bus stops:</b>
         • Just send a location, and the 10 nearest stops will be shown
     """
@@ -98,6 +237,7 @@ def help(chat_id: str):
     send_message(chat_id, message)
 
 
+@timed(HANDLER_SECONDS, HANDLER_CALLS, "busstop")
 def busstop(chat_id: str, args: list[str]):
     if len(args) == 0:
         set_state(chat_id, State.BUSSTOP)
@@ -115,20 +255,11 @@ def busstop(chat_id: str, args: list[str]):
         search_query = " ".join(args).lower().strip()
         try:
             results = search_bus_stop_descriptions(search_query)
-            if len(results) == 1 and len(results[0]) == 1:
-                bus_stop = results[0][0]
-                print(results)
-                send_bus_services(chat_id, bus_stop["BusStopCode"])
+            if len(results) == 1:
+                send_bus_services(chat_id, results[0]["BusStopCode"])
                 return
-            inline_keyboard = []
-            for result in results:
-                for bus_stop in result:
-                    button = {
-                        "text": f"{bus_stop['Description']} ({bus_stop['BusStopCode']})",
-                        "callback_data": bus_stop["BusStopCode"],
-                    }
-                    inline_keyboard.append([button])
-            send_message_inline_keyboard(chat_id, "Choose bus stop:", inline_keyboard)
+            page = search_page(search_query, 0, results)
+            send_message_inline_keyboard(chat_id, page_text(page), page.keyboard)
         except NoSearchResultsError as e:
             handle_error(e, chat_id)
 
@@ -138,22 +269,23 @@ def sort_bus_services(service: dict) -> str:
 
 
 def get_route_dir(service_no: str, bus_stop_code: str) -> str:
-    with open("storage/bus_routes.json", "r") as f:
-        bus_routes = json.load(f)
+    """Returns the direction of the service that serves the bus stop. If the service passes
+       the stop in both directions, the direction that continues on from the stop is returned.
 
-        try:
-            routes_for_service = bus_routes[service_no.upper()]
-        except KeyError:
-            routes_for_service = bus_routes[service_no.lower()]
+    Args:
+        service_no (str): Bus service number.
+        bus_stop_code (str): Code of the bus stop.
 
-        for dir_number in routes_for_service:
-            if dir_number == "ServiceNo":
-                continue
-            for bus_stop in routes_for_service[dir_number]:
-                if bus_stop["BusStopCode"] == bus_stop_code:
-                    return dir_number
+    Raises:
+        ServiceNotAtStopError: If the service does not go to the bus stop.
 
-        raise Exception("This service does not go to this bus stop")
+    Returns:
+        str: Direction number.
+    """
+    directions = get_transit_store().get_route_directions(service_no, bus_stop_code)
+    if not directions:
+        raise ServiceNotAtStopError()
+    return directions[0]
 
 
 def send_bus_services(chat_id: str, bus_stop_code: str):
@@ -174,23 +306,30 @@ def send_bus_services(chat_id: str, bus_stop_code: str):
     send_bus_stop_location(chat_id, bus_stop_code)
     if not services:
         raise NoMoreBusError()
-    inline_keyboard = []
-    for service in services:
-        bus_route_dir = get_route_dir(service["service"], bus_stop_code)
-        inline_keyboard_button_service_no = {
-            "text": f'{service["service"]} ({format_timedelta(get_time_difference(service["next_arrival"]))})',
-            "callback_data": f"{bus_stop_code}:{service['service']}:0",
-        }
-        inline_keyboard_button_view_route = {
-            "text": "View route",
-            "callback_data": f"{service['service']}|{bus_route_dir}",
-        }
+    with span("render"):
+        inline_keyboard = []
+        for service in services:
+            inline_keyboard_button_service_no = {
+                "text": f'{service["service"]} ({format_timedelta(get_time_difference(service["next_arrival"]))})',
+                "callback_data": f"{bus_stop_code}:{service['service']}:0",
+            }
+            try:
+                bus_route_dir = get_route_dir(service["service"], bus_stop_code)
+            except ServiceNotAtStopError:
+                # Route data can lag behind live arrivals, so only offer the timing button
+                inline_keyboard.append([inline_keyboard_button_service_no])
+                continue
+            inline_keyboard_button_view_route = {
+                "text": "View route",
+                "callback_data": f"{service['service']}|{bus_route_dir}|{bus_stop_code}",
+            }
+            inline_keyboard.append(
+                [inline_keyboard_button_service_no, inline_keyboard_button_view_route]
+            )
         inline_keyboard.append(
-            [inline_keyboard_button_service_no, inline_keyboard_button_view_route]
+            [{"text": "⭐ Add to favourites", "callback_data": f"fa|{bus_stop_code}"}]
         )
-    message = (
-        f"<b>{bus_stop_description} ({bus_stop_code})</b>\nPlease select bus service:"
-    )
+        message = f"<b>{bus_stop_description} ({bus_stop_code})</b>\nPlease select bus service:"
     send_message_inline_keyboard(chat_id, message, inline_keyboard)
 
 
@@ -211,55 +350,216 @@ def send_bus_stop_location(chat_id, bus_stop_code):
 def handle_callback_query(data: dict):
     # busstopcode:serviceno:shouldsendmap -> send bus timing
     # busstopcode -> send bus services
-    # serviceno|direction -> send bus route
+    # serviceno|direction|busstopcode -> send bus route, from around the bus stop if given
+    # pr|start|serviceno|direction, ps|start|query -> show another page of a bus route or
+    # of search results
+    # nb|latitude|longitude -> send arrivals at the bus stops nearest to the location
+    # fa|busstopcode -> add the bus stop to the chat's favourites
     chat_id = data["message"]["chat"]["id"]
     callback_data = data["data"]
-    if ":" in callback_data:
-        # If ":" in callback_data, means data is busstopcode:serviceno:shouldsendmap,
-        # where shouldsendmap is 1 if the user has clicked on the button from the bus route
-        # and 0 if the user has clicked on the button from bus stop (as map was already sent with
-        # bus stop)
-        bus_stop_code, service_no, should_send_map = callback_data.split(":")
-        if should_send_map == "1":
-            send_bus_stop_location(chat_id, bus_stop_code)
-        send_bus_timings(chat_id, bus_stop_code, service_no)
+    notice = None
+    if callback_data.startswith(("pr|", "ps|")):
+        # Checked first, since a search query may contain anything
+        with timed(HANDLER_SECONDS, HANDLER_CALLS, "callback_page"):
+            kind, start, key = callback_data.split("|", 2)
+            try:
+                if kind == "pr":
+                    page = route_page(*key.split("|"), int(start))
+                else:
+                    page = search_page(key, int(start))
+            except NoSearchResultsError as e:
+                # The transit data was refreshed since the message was sent
+                notice = str(e)
+            else:
+                edit_message_inline_keyboard(
+                    chat_id,
+                    data["message"]["message_id"],
+                    page_text(page),
+                    page.keyboard,
+                )
+    elif callback_data.startswith("nb|"):
+        with timed(HANDLER_SECONDS, HANDLER_CALLS, "callback_nearby"):
+            _, latitude, longitude = callback_data.split("|")
+            send_nearby_arrivals(chat_id, float(latitude), float(longitude))
+    elif callback_data.startswith("fa|"):
+        with timed(HANDLER_SECONDS, HANDLER_CALLS, "callback_favourite"):
+            notice = add_favourite(chat_id, callback_data[3:])
+    elif ":" in callback_data:
+        # If ":" in callback_data, means data is busstopcode:serviceno:mode, where mode is
+        # 1 if the user has clicked on the button from the bus route (so the map is sent),
+        # 0 if the user has clicked on the button from bus stop (as map was already sent
+        # with bus stop), and r, t or s if the user has clicked Refresh, Track live or
+        # Stop tracking on the timings message
+        with timed(HANDLER_SECONDS, HANDLER_CALLS, "callback_timing"):
+            bus_stop_code, service_no, mode = callback_data.split(":")
+            match mode:
+                case "r":
+                    notice = refresh_bus_timings(
+                        chat_id, data["message"], bus_stop_code, service_no
+                    )
+                case "t":
+                    notice = track_bus_timings(
+                        chat_id, data["message"], bus_stop_code, service_no
+                    )
+                case "s":
+                    end_tracking(
+                        chat_id,
+                        data["message"]["message_id"],
+                        bus_stop_code,
+                        service_no,
+                        "Tracking stopped",
+                    )
+                case _:
+                    if mode == "1":
+                        send_bus_stop_location(chat_id, bus_stop_code)
+                    send_bus_timings(chat_id, bus_stop_code, service_no)
     elif is_bus_stop_code(data["data"]):
-        bus_stop_code = data["data"]
-        try:
-            send_bus_services(chat_id, bus_stop_code)
-        except (NoSearchResultsError, NoMoreBusError) as e:
-            handle_error(e, chat_id)
+        with timed(HANDLER_SECONDS, HANDLER_CALLS, "callback_stop"):
+            bus_stop_code = data["data"]
+            try:
+                send_bus_services(chat_id, bus_stop_code)
+            except (NoSearchResultsError, NoMoreBusError) as e:
+                handle_error(e, chat_id)
     elif "|" in data["data"]:
-        typing(chat_id)
-        try:
-            service_no, direction = callback_data.split("|")
-            bus_stop_codes = get_bus_route(service_no, direction)
-            inline_keyboard = []
-            for code in bus_stop_codes:
-                button = {
-                    "text": get_bus_stop_description(code),
-                    "callback_data": f"{code}:{service_no}:1",
-                }
-                inline_keyboard.append([button])
-            send_message_inline_keyboard(chat_id, "Choose bus stop: ", inline_keyboard)
-        except NoSearchResultsError as e:
-            handle_error(e, chat_id)
+        with timed(HANDLER_SECONDS, HANDLER_CALLS, "callback_route"):
+            try:
+                # Buttons sent before the bus stop was added have no bus stop
+                service_no, direction, bus_stop_code = (callback_data + "|").split("|")[
+                    :3
+                ]
+                page = route_page(
+                    service_no,
+                    direction,
+                    route_start(service_no, direction, bus_stop_code),
+                )
+                send_message_inline_keyboard(chat_id, page_text(page), page.keyboard)
+            except NoSearchResultsError as e:
+                handle_error(e, chat_id)
     else:
         raise InvalidCallbackDataError()
-    answerCallbackQuery(data["id"])
+    answerCallbackQuery(data["id"], notice)
 
 
-def send_bus_timings(chat_id: str, bus_stop_code: str, service_no: str):
-    """Sends a message to the chat containing the arrival timings, load, and type of the
-       specified bus service at the specified bus stop.
+def route_keyboard(service_no: str, direction: str) -> list[list[dict]]:
+    """Returns a keyboard of the stops of the bus service in the direction, in order,
+    whose buttons send the service's timings at the stop. Cached until the transit data
+    is refreshed, so it must not be mutated.
+
+    Raises:
+        NoSearchResultsError: If the service number or direction does not exist in the data.
+    """
+
+    def build() -> list[list[dict]]:
+        with span("render"):
+            return [
+                [
+                    {
+                        "text": get_bus_stop_description(code),
+                        "callback_data": f"{code}:{service_no}:1",
+                    }
+                ]
+                for code in get_bus_route(service_no, direction)
+            ]
+
+    return keyboards.get(("route", service_no, direction), build)
+
+
+def route_page(service_no: str, direction: str, start: int) -> Page:
+    """Returns the page of the route keyboard starting at the stop with the index.
+
+    Raises:
+        NoSearchResultsError: If the service number or direction does not exist in the data.
+    """
+    return paginate(
+        route_keyboard(service_no, direction),
+        start,
+        lambda start: f"pr|{start}|{service_no}|{direction}",
+    )
+
+
+# Stops of the route shown before the user's bus stop, for context
+ROUTE_STOPS_BEFORE = 2
+
+
+def route_start(service_no: str, direction: str, bus_stop_code: str) -> int:
+    """Returns the index of the stop a route page starts at so that it shows the bus
+    stop near the top, or 0 if the bus stop is not on the route or not given."""
+    if not bus_stop_code:
+        return 0
+    prefix = f"{bus_stop_code}:"
+    for i, row in enumerate(route_keyboard(service_no, direction)):
+        if row[0]["callback_data"].startswith(prefix):
+            return max(0, i - ROUTE_STOPS_BEFORE)
+    return 0
+
+
+def search_page(query: str, start: int, results: Optional[list[dict]] = None) -> Page:
+    """Returns the page of the bus stops matching the query starting at the result with
+    the index. The search is run again for other pages, rather than its results kept.
+
+    Raises:
+        NoSearchResultsError: If the search query does not match any bus stops.
+    """
+    if results is None:
+        results = search_bus_stop_descriptions(query)
+    rows = [
+        [
+            {
+                "text": f"{bus_stop['Description']} ({bus_stop['BusStopCode']})",
+                "callback_data": bus_stop["BusStopCode"],
+            }
+        ]
+        for bus_stop in results
+    ]
+    return paginate(rows, start, lambda start: f"ps|{start}|{query}")
+
+
+def page_text(page: Page) -> str:
+    if page.is_whole:
+        return "Choose bus stop:"
+    return f"Choose bus stop ({page.describe()}):"
+
+
+def directions_keyboard(service_no: str) -> list[list[dict]]:
+    """Returns a keyboard of the directions of the bus service, by destination, whose
+    buttons send the route. Cached until the transit data is refreshed, so it must not
+    be mutated.
+
+    Raises:
+        NoSearchResultsError: If the service number is not found in the data.
+    """
+
+    def build() -> list[list[dict]]:
+        return [
+            [
+                {
+                    "text": f"To {get_bus_stop_description(direction['DestinationCode'])}",
+                    "callback_data": f"{service_no}|{direction['Direction']}",
+                }
+            ]
+            for direction in get_bus_directions(service_no)
+        ]
+
+    return keyboards.get(("directions", service_no), build)
+
+
+def render_bus_timings(bus_stop_code: str, service_no: str) -> str:
+    """Returns the arrival timings, load, and type of the specified bus service at the
+       specified bus stop, as the text of a timings message without its timestamp.
 
     Args:
-        chat_id (str)
         bus_stop_code (str)
         service_no (str)
+
+    Raises:
+        APIError: If the API response status code is not 200.
+        NoMoreBusError: If there are no upcoming buses for the service at the bus stop.
+
+    Returns:
+        str: The text of the timings message.
     """
-    try:
-        arrivals = get_bus_timing(bus_stop_code, service_no)
+    arrivals = get_bus_timing(bus_stop_code, service_no)
+    with span("render"):
         message = f"<b>{get_bus_stop_description(bus_stop_code)} ({bus_stop_code})\nBus {service_no}</b>\n\n"
         for arrival in arrivals:
             if arrival["EstimatedArrival"] == "":
@@ -273,34 +573,390 @@ def send_bus_timings(chat_id: str, bus_stop_code: str, service_no: str):
             message += (
                 f"<u>{timing} ({format_timedelta(duration)})</u>\n{load}\n{type}\n\n"
             )
-        button = {"text": "Refresh", "callback_data": f"{bus_stop_code}:{service_no}:0"}
-        send_message_inline_keyboard(chat_id, message, [[button]])
+    return message
+
+
+def bus_timings_keyboard(
+    bus_stop_code: str, service_no: str, live: bool = False
+) -> list[list[dict]]:
+    if live:
+        track = {
+            "text": "Stop tracking",
+            "callback_data": f"{bus_stop_code}:{service_no}:s",
+        }
+    else:
+        track = {
+            "text": "Track live",
+            "callback_data": f"{bus_stop_code}:{service_no}:t",
+        }
+    return [
+        [
+            {"text": "Refresh", "callback_data": f"{bus_stop_code}:{service_no}:r"},
+            track,
+        ]
+    ]
+
+
+def timings_digest(message: str) -> str:
+    return hashlib.blake2b(message.encode(), digest_size=8).hexdigest()
+
+
+def format_updated(timestamp: float, live_until: Optional[float] = None) -> str:
+    updated = f"<i>Updated {datetime.fromtimestamp(timestamp, SGT):%H:%M:%S}</i>"
+    if live_until is None:
+        return updated
+    return (
+        f"{updated}\n<i>Live until {datetime.fromtimestamp(live_until, SGT):%H:%M}</i>"
+    )
+
+
+def record_bus_timings(
+    chat_id: str, message_id: int, refreshed: float, rendered: float, digest: str
+):
+    get_refreshed_messages().set(
+        f"{chat_id}:{message_id}", f"{refreshed}:{rendered}:{digest}", REFRESH_STATE_TTL
+    )
+
+
+def send_bus_timings(
+    chat_id: str, bus_stop_code: str, service_no: str, live: bool = False
+):
+    """Sends a message to the chat containing the arrival timings, load, and type of the
+       specified bus service at the specified bus stop.
+
+    Args:
+        chat_id (str)
+        bus_stop_code (str)
+        service_no (str)
+        live (bool): Whether to keep the message up to date until the bus arrives.
+    """
+    try:
+        message = render_bus_timings(bus_stop_code, service_no)
     except (APIError, NoMoreBusError, NoSearchResultsError) as e:
         handle_error(e, chat_id)
+        return
+    now = time.time()
+    live_until = now + get_tracker().timeout if live else None
+    future = send_message_inline_keyboard(
+        chat_id,
+        message + format_updated(now, live_until),
+        bus_timings_keyboard(bus_stop_code, service_no, live),
+    )
+
+    def record(future):
+        # The message ID is only known once Telegram has answered
+        if future.exception() is None and (future.result() or {}).get("ok"):
+            message_id = future.result()["result"]["message_id"]
+            record_bus_timings(chat_id, message_id, now, now, timings_digest(message))
+            if not live:
+                return
+            notice = start_tracking(chat_id, message_id, bus_stop_code, service_no)
+            if notice is not None:
+                end_tracking(
+                    chat_id, message_id, bus_stop_code, service_no, notice, message
+                )
 
+    future.add_done_callback(record)
 
-class BusStopDistance:
-    """Object that contains 2 fields: bus stop and distance, where distance refers to the distance
-    from the bus stop to a particular location.
 
-    >, < and == are overloaded to order based on distance. This object is used to order bus stops within
-    a min heap based on distance.
+def refresh_bus_timings(
+    chat_id: str, message: dict, bus_stop_code: str, service_no: str
+) -> Optional[str]:
+    """Edits a timings message to show the latest arrival timings.
+
+    Taps within the arrival cache TTL of the last refresh are ignored, since the timings
+    could not have changed, and the message is only edited if the timings did change.
+
+    Args:
+        chat_id (str)
+        message (dict): The timings message, from the callback query.
+        bus_stop_code (str)
+        service_no (str)
+
+    Returns:
+        Optional[str]: Notice to show the user instead of an edit, if any.
     """
+    now = time.time()
+    message_id = message["message_id"]
+    last = get_refreshed_messages().get(f"{chat_id}:{message_id}")
+    refreshed, rendered, digest = last.split(":") if last else ("0", "0", None)
+    # The message may not be recorded yet if it was only just sent, but Telegram says
+    # when it was sent or last edited
+    refreshed = max(float(refreshed), message.get("edit_date", message.get("date", 0)))
+    if now - refreshed < arrival_cache.ttl:
+        return "Already up to date"
+    try:
+        text = render_bus_timings(bus_stop_code, service_no)
+    except (APIError, NoMoreBusError, NoSearchResultsError) as e:
+        return str(e)
+    if timings_digest(text) == digest:
+        record_bus_timings(chat_id, message_id, now, float(rendered), digest)
+        return (
+            f"No change since {datetime.fromtimestamp(float(rendered), SGT):%H:%M:%S}"
+        )
+    edit_bus_timings(
+        chat_id,
+        message_id,
+        bus_stop_code,
+        service_no,
+        text,
+        get_live_until(chat_id, message_id),
+    )
+    return None
+
+
+def edit_bus_timings(
+    chat_id: str,
+    message_id: int,
+    bus_stop_code: str,
+    service_no: str,
+    text: str,
+    live_until: Optional[float] = None,
+    priority: Priority = Priority.REPLY,
+) -> Future:
+    """Edits a timings message to show the rendered timings, and records them."""
+    now = time.time()
+    future = edit_message_inline_keyboard(
+        chat_id,
+        message_id,
+        text + format_updated(now, live_until),
+        bus_timings_keyboard(bus_stop_code, service_no, live_until is not None),
+        priority,
+    )
+    record_bus_timings(chat_id, message_id, now, now, timings_digest(text))
+    return future
 
-    def __init__(self, distance: float, bus_stop: dict):
-        self.distance = distance
-        self.bus_stop = bus_stop
 
-    def __lt__(self, other):
-        return self.distance < other.distance
+def get_live_until(chat_id: str, message_id: int) -> Optional[float]:
+    """Returns when the message stops being tracked, or None if it is not tracked."""
+    live_until = get_tracked_messages().get(f"{chat_id}:{message_id}")
+    return float(live_until) if live_until else None
+
+
+def start_tracking(
+    chat_id: str, message_id: int, bus_stop_code: str, service_no: str
+) -> Optional[str]:
+    """Starts keeping a timings message up to date.
+
+    Returns:
+        Optional[str]: Notice to show the user if the message is not tracked, if any.
+    """
+    tracker = get_tracker()
+    live_until = time.time() + tracker.timeout
+    # Kept a little longer than the subscription, so that it can still tell whether
+    # tracking was stopped when the subscription expires
+    if not get_tracked_messages().add(
+        f"{chat_id}:{message_id}", str(live_until), tracker.timeout + tracker.interval
+    ):
+        return "Already tracking"
+    if tracker.subscribe(chat_id, message_id, bus_stop_code, service_no) is None:
+        get_tracked_messages().delete(f"{chat_id}:{message_id}")
+        return "Too many buses are being tracked, please try again later"
+    return None
+
+
+def stop_tracking(chat_id: str, message_id: int):
+    get_tracked_messages().delete(f"{chat_id}:{message_id}")
+    # Another worker may be tracking the message, and stops once it sees it was stopped
+    if _tracker is not None:
+        _tracker.unsubscribe(chat_id, message_id)
+
+
+def track_bus_timings(
+    chat_id: str, message: dict, bus_stop_code: str, service_no: str
+) -> Optional[str]:
+    """Starts keeping a timings message up to date, and updates it straight away.
+
+    Args:
+        chat_id (str)
+        message (dict): The timings message, from the callback query.
+        bus_stop_code (str)
+        service_no (str)
+
+    Returns:
+        Optional[str]: Notice to show the user.
+    """
+    message_id = message["message_id"]
+    try:
+        text = render_bus_timings(bus_stop_code, service_no)
+    except (APIError, NoMoreBusError, NoSearchResultsError) as e:
+        return str(e)
+    notice = start_tracking(chat_id, message_id, bus_stop_code, service_no)
+    if notice is not None:
+        return notice
+    edit_bus_timings(
+        chat_id,
+        message_id,
+        bus_stop_code,
+        service_no,
+        text,
+        get_live_until(chat_id, message_id),
+    )
+    return f"Updating every {get_tracker().interval:.0f}s until the bus arrives"
+
+
+def end_tracking(
+    chat_id: str,
+    message_id: int,
+    bus_stop_code: str,
+    service_no: str,
+    reason: str,
+    text: Optional[str] = None,
+    priority: Priority = Priority.REPLY,
+) -> Future:
+    """Stops keeping a timings message up to date, and edits it a last time to say why.
+
+    Args:
+        chat_id (str)
+        message_id (int)
+        bus_stop_code (str)
+        service_no (str)
+        reason (str): Why tracking ended.
+        text (Optional[str]): The rendered timings, if they were just rendered.
+        priority (Priority): Priority of the edit.
+    """
+    stop_tracking(chat_id, message_id)
+    if text is None:
+        try:
+            text = render_bus_timings(bus_stop_code, service_no)
+        except (APIError, NoMoreBusError, NoSearchResultsError) as e:
+            text = f"{e}\n\n"
+    return edit_bus_timings(
+        chat_id,
+        message_id,
+        bus_stop_code,
+        service_no,
+        f"{text}<b>{reason}</b>\n",
+        priority=priority,
+    )
+
+
+def interrupt_tracking(subscriptions: list[Subscription]):
+    """Edits the messages still tracked when the worker shuts down a last time, so that
+    they do not go on saying they are live. Tracking is not resumed after a restart, so
+    they say how to start it again.
+
+    Args:
+        subscriptions (list[Subscription])
+    """
+    codes = [subscription.bus_stop_code for subscription in subscriptions]
+    # Fetched together, so that shutting down is not held up by one request per stop
+    arrivals = get_bus_arrivals(codes, ARRIVALS_BATCH_TIMEOUT)
+    for subscription in subscriptions:
+        chat_id, message_id = subscription.key
+        if get_live_until(chat_id, message_id) is None:
+            # Stopped through another worker, which already edited the message
+            continue
+        end_tracking(
+            chat_id,
+            message_id,
+            subscription.bus_stop_code,
+            subscription.service_no,
+            "Tracking stopped by a restart, tap Track live to start again",
+            (
+                None
+                if subscription.bus_stop_code in arrivals
+                else "Arrivals unavailable\n\n"
+            ),
+        )
+
+
+def is_arriving(arrivals: list[dict]) -> bool:
+    for arrival in arrivals:
+        if arrival["EstimatedArrival"]:
+            return (
+                format_timedelta(get_time_difference(arrival["EstimatedArrival"]))
+                == "Arr"
+            )
+    return False
+
+
+def update_tracked_timings(subscription: Subscription) -> bool:
+    """Edits a tracked timings message if its timings changed, or a last time once the
+    bus is arriving or the subscription expired. Called by the tracker once the bus stop
+    was polled, so the timings are read from the arrival cache.
+
+    Edits are sent after any reply, and a message is skipped while its last edit is still
+    queued, so that tracking falls behind rather than delaying replies when the Bot API
+    rate limits are reached.
+
+    Args:
+        subscription (Subscription)
+
+    Returns:
+        bool: Whether to keep tracking the message.
+    """
+    chat_id, message_id = subscription.key
+    bus_stop_code, service_no = subscription.bus_stop_code, subscription.service_no
+    live_until = get_live_until(chat_id, message_id)
+    if live_until is None:
+        # Stopped through another worker, which already edited the message
+        return False
+    if subscription.expired():
+        end_tracking(
+            chat_id,
+            message_id,
+            bus_stop_code,
+            service_no,
+            "Tracking ended",
+            priority=Priority.BACKGROUND,
+        )
+        return False
+    if subscription.pending is not None and not subscription.pending.done():
+        return True
+    try:
+        arrivals = get_bus_timing(bus_stop_code, service_no)
+        text = render_bus_timings(bus_stop_code, service_no)
+    except APIError:
+        return True
+    except (NoMoreBusError, NoSearchResultsError) as e:
+        end_tracking(
+            chat_id,
+            message_id,
+            bus_stop_code,
+            service_no,
+            "Tracking ended",
+            f"{e}\n\n",
+            Priority.BACKGROUND,
+        )
+        return False
+    if is_arriving(arrivals):
+        end_tracking(
+            chat_id,
+            message_id,
+            bus_stop_code,
+            service_no,
+            "Bus is arriving",
+            text,
+            Priority.BACKGROUND,
+        )
+        return False
+    last = get_refreshed_messages().get(f"{chat_id}:{message_id}")
+    if last and last.rsplit(":", 1)[1] == timings_digest(text):
+        return True
+    subscription.pending = edit_bus_timings(
+        chat_id,
+        message_id,
+        bus_stop_code,
+        service_no,
+        text,
+        live_until,
+        Priority.BACKGROUND,
+    )
 
-    def __gt__(self, other):
-        return self.distance > other.distance
+    def stop_if_gone(future):
+        # The message was deleted, or is too old to edit
+        if (
+            future.exception() is None
+            and (future.result() or {}).get("error_code") == 400
+        ):
+            stop_tracking(chat_id, message_id)
 
-    def __eq__(self, other):
-        return self.distance == other.distance
+    subscription.pending.add_done_callback(stop_if_gone)
+    return True
 
 
+@timed(HANDLER_SECONDS, HANDLER_CALLS, "location")
 def handle_location(chat_id: str, latitude: str, longitude: str):
     """Sends a message with buttons for each of the 10 closest bus stops to the specified location.
 
@@ -320,34 +976,202 @@ def handle_location(chat_id: str, latitude: str, longitude: str):
             "callback_data": stop["BusStopCode"],
         }
         inline_keyboard.append([button])
+    inline_keyboard.append(
+        [
+            {
+                "text": "🕒 Show arrivals",
+                "callback_data": f"nb|{float(latitude):.5f}|{float(longitude):.5f}",
+            }
+        ]
+    )
     send_message_inline_keyboard(chat_id, "Nearest bus stops:", inline_keyboard)
 
 
-def get_closest_k_stops(user_location: tuple[float, float], k: int) -> list[dict]:
+def get_closest_k_stops(
+    user_location: tuple[float, float], k: int, max_radius: Optional[float] = None
+) -> list[dict]:
     """Returns a list of k closest bus stops to the specified location.
 
     Args:
         user_location (tuple[float, float]): tuple containing latitude and longitude of the location.
         k (int)
+        max_radius (Optional[float]): If given, only bus stops within this many metres are returned.
+
+    Returns:
+        list[dict]: List of k closest bus stops, closest first.
+    """
+    return [stop for stop, _ in get_nearby_stops(user_location, k, max_radius)]
+
+
+@traced("lookup.nearest")
+def get_nearby_stops(
+    user_location: tuple[float, float], k: int, max_radius: Optional[float] = None
+) -> list[tuple[dict, float]]:
+    """Returns the k closest bus stops to the specified location and their distances.
+
+    Args:
+        user_location (tuple[float, float]): tuple containing latitude and longitude of the location.
+        k (int)
+        max_radius (Optional[float]): If given, only bus stops within this many metres are returned.
 
     Returns:
-        list[dict]: List of k closest bus stops.
+        list[tuple[dict, float]]: Bus stops and their distance in metres, closest first.
     """
-    stops_dist: list[BusStopDistance] = []
-    with open("storage/bus_stops.json", "r") as f:
-        bus_stops = json.load(f)
-        for stop in bus_stops:
-            bus_stop_location = (float(stop["Latitude"]), float(stop["Longitude"]))
-            dist = geopy.distance.distance(user_location, bus_stop_location)
-            stops_dist.append(BusStopDistance(dist, stop))
-    heapq.heapify(stops_dist)
-    top_k_closest = []
-    for i in range(k):
-        top_k_closest.append(stops_dist[0].bus_stop)
-        heapq.heappop(stops_dist)
-    return top_k_closest
+    store = get_transit_store()
+    latitude, longitude = user_location
+    nearest = store.spatial_index.nearest(latitude, longitude, k, max_radius)
+    return [(store.stops.record(i), distance) for i, distance in nearest]
+
 
+def send_nearby_arrivals(chat_id: str, latitude: float, longitude: float):
+    """Sends one message with the next arrivals of every service at each of the bus
+    stops nearest to the location, whose arrivals are fetched concurrently. Bus stops
+    whose arrivals could not be fetched in time are listed without them.
 
+    Args:
+        chat_id (str): ID of the chat.
+        latitude (float): Latitude of the location.
+        longitude (float): Longitude of the location.
+    """
+    typing(chat_id)
+    stops = get_nearby_stops((latitude, longitude), NEARBY_ARRIVALS_STOPS)
+    arrivals = get_bus_arrivals(
+        [stop["BusStopCode"] for stop, _ in stops], ARRIVALS_BATCH_TIMEOUT
+    )
+    with span("render"):
+        sections = [
+            f"<b>{stop['Description']} ({stop['BusStopCode']})</b> · {distance:.0f} m\n"
+            + render_arrivals_summary(arrivals.get(stop["BusStopCode"]))
+            for stop, distance in stops
+        ]
+        inline_keyboard = stops_keyboard([stop for stop, _ in stops])
+    send_message_inline_keyboard(chat_id, "\n\n".join(sections), inline_keyboard)
+
+
+def stops_keyboard(stops: list[dict]) -> list[list[dict]]:
+    return [
+        [
+            {
+                "text": f"{stop['Description']} ({stop['BusStopCode']})",
+                "callback_data": stop["BusStopCode"],
+            }
+        ]
+        for stop in stops
+    ]
+
+
+def render_arrivals_summary(services: Optional[list[dict]]) -> str:
+    """Returns a line for each service of a BusArrival response with its next two
+    arrivals, or a note if the arrivals are missing or there are no more buses."""
+    if services is None:
+        return "<i>Arrivals unavailable, tap the stop to try again</i>"
+    lines = []
+    for service in sorted(services, key=lambda service: service["ServiceNo"].zfill(3)):
+        timings = [
+            format_timedelta(get_time_difference(service[bus]["EstimatedArrival"]))
+            for bus in ("NextBus", "NextBus2")
+            if service.get(bus, {}).get("EstimatedArrival")
+        ]
+        if timings:
+            lines.append(f"<b>{service['ServiceNo']}</b>  {', '.join(timings)}")
+    return "\n".join(lines) or f"<i>{NoMoreBusError()}</i>"
+
+
+@timed(HANDLER_SECONDS, HANDLER_CALLS, "fav")
+def fav(chat_id: str, args: list[str]):
+    """Handles the /fav command: with no arguments, sends the arrivals at the chat's
+    favourite bus stops, and with add or remove and a bus stop code, changes them.
+
+    Args:
+        chat_id (str)
+        args (list[str])
+    """
+    if not args:
+        send_favourite_arrivals(chat_id)
+        return
+    if len(args) != 2 or args[0] not in ("add", "remove"):
+        send_message(
+            chat_id,
+            "Please send <code>/fav</code>, or <code>/fav add</code> or "
+            "<code>/fav remove</code> followed by a bus stop code",
+        )
+        return
+    action, bus_stop_code = args
+    if action == "add":
+        send_message(chat_id, add_favourite(chat_id, bus_stop_code))
+    elif get_favourites().remove(chat_id, bus_stop_code):
+        send_message(chat_id, f"Removed {bus_stop_code} from your favourites")
+    else:
+        send_message(chat_id, f"{bus_stop_code} is not one of your favourites")
+
+
+def add_favourite(chat_id: str, bus_stop_code: str) -> str:
+    """Adds the bus stop to the chat's favourites. Returns the outcome to tell the user."""
+    try:
+        if not is_bus_stop_code(bus_stop_code):
+            raise NoSearchResultsError("No bus stops with this code")
+        description = get_bus_stop_description(bus_stop_code)
+        added = get_favourites().add(chat_id, bus_stop_code)
+    except (NoSearchResultsError, TooManyFavouritesError) as e:
+        return str(e)
+    if not added:
+        return f"{description} is already one of your favourites"
+    return f"Added {description} to your favourites, see them with /fav"
+
+
+def send_favourite_arrivals(chat_id: str):
+    """Sends one message with the next arrivals of every service at each of the chat's
+    favourite bus stops, whose arrivals are fetched concurrently. Bus stops whose
+    arrivals could not be fetched in time are listed without them.
+
+    Args:
+        chat_id (str)
+    """
+    codes = get_favourites().list(chat_id)
+    if not codes:
+        send_message(
+            chat_id,
+            "You have no favourite stops yet. Add one with <code>/fav add 12345</code>, "
+            "or tap Add to favourites under a bus stop's services",
+        )
+        return
+    typing(chat_id)
+    arrivals = get_bus_arrivals(codes, ARRIVALS_BATCH_TIMEOUT)
+    store = get_transit_store()
+    with span("render"):
+        # A favourite may have been removed from the transit data since it was added
+        stops = [
+            store.get_stop(code)
+            or {"BusStopCode": code, "Description": "Unknown bus stop"}
+            for code in codes
+        ]
+        sections = [
+            f"<b>{stop['Description']} ({stop['BusStopCode']})</b>\n"
+            + render_arrivals_summary(arrivals.get(stop["BusStopCode"]))
+            for stop in stops
+        ]
+    send_message_inline_keyboard(chat_id, "\n\n".join(sections), stops_keyboard(stops))
+
+
+@timed(HANDLER_SECONDS, HANDLER_CALLS, "track")
+def track(chat_id: str, args: list[str]):
+    """Handles the /track command, which sends live timings of a bus service at a stop.
+
+    Args:
+        chat_id (str)
+        args (list[str]): Bus stop code and bus service number.
+    """
+    if len(args) != 2 or not is_bus_stop_code(args[0]):
+        send_message(
+            chat_id,
+            "Please send a bus stop code and bus service number, "
+            "like <code>/track 12345 123</code>",
+        )
+        return
+    send_bus_timings(chat_id, args[0], args[1], live=True)
+
+
+@timed(HANDLER_SECONDS, HANDLER_CALLS, "bus")
 def bus(chat_id: str, args: list[str]):
     """Handles the /bus command.
 
@@ -361,16 +1185,8 @@ def bus(chat_id: str, args: list[str]):
         return
     bus_number = args[0]
     try:
-        directions = get_bus_directions(bus_number)
-        inline_keyboard = []
-        for direction in directions:
-            button = {
-                "text": f"To {get_bus_stop_description(direction['DestinationCode'])}",
-                "callback_data": f"{bus_number}|{direction['Direction']}",
-            }
-            inline_keyboard.append([button])
         send_message_inline_keyboard(
-            chat_id, "Please select direction:", inline_keyboard
+            chat_id, "Please select direction:", directions_keyboard(bus_number)
         )
     except NoSearchResultsError as e:
         handle_error(e, chat_id)
@@ -0,0 +1,104 @@
+import logging
+import threading
+from collections import deque
+from queue import SimpleQueue
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class UpdateDispatcher:
+    """Processes updates on a bounded pool of worker threads.
+
+    Updates are queued per chat, and a chat is only ever handed to one worker at a time,
+    so updates from the same chat are handled in the order they were received while
+    different chats are handled concurrently. At most max_pending updates may be waiting
+    or in progress; submit() rejects updates beyond that so the caller can shed load.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], None],
+        workers: int = 8,
+        max_pending: int = 500,
+    ):
+        self.handler = handler
+        self.max_pending = max_pending
+        self.pending = 0
+        self.shed = 0
+        self._mailboxes: dict[Hashable, deque] = {}
+        self._ready: SimpleQueue = SimpleQueue()
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"update-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, chat_id: Hashable, update: Any) -> bool:
+        """Queues an update for processing.
+
+        Args:
+            chat_id (Hashable): Chat the update belongs to; updates of a chat are ordered.
+            update (Any): The update passed to the handler.
+
+        Returns:
+            bool: False if the update was rejected because the queue is full or the
+                  dispatcher is shutting down.
+        """
+        with self._lock:
+            if self._closed or self.pending >= self.max_pending:
+                self.shed += 1
+                return False
+            self.pending += 1
+            mailbox = self._mailboxes.get(chat_id)
+            if mailbox is None:
+                self._mailboxes[chat_id] = deque([update])
+                self._ready.put(chat_id)
+            else:
+                mailbox.append(update)
+        return True
+
+    def _work(self):
+        while True:
+            chat_id = self._ready.get()
+            if chat_id is _STOP:
+                return
+            # The update stays at the head of its mailbox while it is processed, so later
+            # updates of the same chat queue behind it instead of being picked up
+            with self._lock:
+                update = self._mailboxes[chat_id][0]
+            try:
+                self.handler(update)
+            except Exception:
+                logger.exception("Unhandled error while processing update")
+            with self._lock:
+                mailbox = self._mailboxes[chat_id]
+                mailbox.popleft()
+                if mailbox:
+                    self._ready.put(chat_id)
+                else:
+                    del self._mailboxes[chat_id]
+                self.pending -= 1
+                if self.pending == 0:
+                    self._drained.notify_all()
+
+    def shutdown(self, timeout: float | None = None):
+        """Stops accepting updates and waits for queued updates to be processed.
+
+        Args:
+            timeout (float | None): Maximum number of seconds to wait for the queue to drain.
+        """
+        with self._lock:
+            self._closed = True
+            if not self._drained.wait_for(lambda: self.pending == 0, timeout):
+                logger.warning(
+                    "Shutting down with %d updates unprocessed", self.pending
+                )
+        for _ in self._threads:
+            self._ready.put(_STOP)
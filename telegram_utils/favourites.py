@@ -0,0 +1,211 @@
+"""Bus stops each chat saved as favourites, shown together by /fav.
+
+Unlike the state backends, whose entries expire, favourites are kept until removed. With
+STATE_BACKEND set to redis they are kept in Redis, shared by every machine. Otherwise
+they are kept in a SQLite database at FAVOURITES_PATH, which is shared by the workers of
+one machine only, so the app must then run on a single machine.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import config  # noqa: F401 - loads .env before the settings below are read
+from exceptions.exceptions import TooManyFavouritesError
+
+from .state_backends import STATE_BACKEND, STATE_REDIS_URL
+
+FAVOURITES_PATH = os.getenv("FAVOURITES_PATH", "favourites.db")
+MAX_FAVOURITES = int(os.getenv("MAX_FAVOURITES", "5"))
+
+
+class FavouriteStore:
+    """Bus stop codes saved by each chat, in the order they were added, at most limit of
+    them per chat."""
+
+    limit: int
+
+    def list(self, chat_id: str) -> list[str]:
+        """Returns the codes of the chat's favourite bus stops, in the order they were
+        added."""
+        raise NotImplementedError
+
+    def add(self, chat_id: str, bus_stop_code: str) -> bool:
+        """Adds a bus stop to the chat's favourites.
+
+        Raises:
+            TooManyFavouritesError: If the chat already has the most favourites allowed.
+
+        Returns:
+            bool: Whether the bus stop was added, rather than already a favourite.
+        """
+        raise NotImplementedError
+
+    def remove(self, chat_id: str, bus_stop_code: str) -> bool:
+        """Removes a bus stop from the chat's favourites. Returns whether it was one."""
+        raise NotImplementedError
+
+    def too_many(self) -> TooManyFavouritesError:
+        return TooManyFavouritesError(
+            f"You can save up to {self.limit} favourite stops. Remove one first with "
+            "/fav remove followed by its code."
+        )
+
+
+class SQLiteFavouriteStore(FavouriteStore):
+    """Favourites in a SQLite database in WAL mode, shared by every process that opens
+    the same file."""
+
+    def __init__(self, path: str = FAVOURITES_PATH, limit: int = MAX_FAVOURITES):
+        """
+        Args:
+            path (str): Path of the database file.
+            limit (int): Most bus stops a chat can save.
+        """
+        self.path = path
+        self.limit = limit
+        self._local = threading.local()
+        with self._connection() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS favourites (chat_id TEXT NOT NULL, "
+                "bus_stop_code TEXT NOT NULL, added REAL NOT NULL, "
+                "PRIMARY KEY (chat_id, bus_stop_code)) WITHOUT ROWID"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections cannot be shared between threads, so each thread opens its own
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def list(self, chat_id: str) -> list[str]:
+        rows = (
+            self._connection()
+            .execute(
+                "SELECT bus_stop_code FROM favourites WHERE chat_id = ? ORDER BY added",
+                (str(chat_id),),
+            )
+            .fetchall()
+        )
+        return [code for code, in rows]
+
+    def add(self, chat_id: str, bus_stop_code: str) -> bool:
+        db = self._connection()
+        # Taking the write lock first makes the count and the insert one step, so that
+        # two workers adding at once cannot both go past the limit
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            count, present = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bus_stop_code = ?), 0) FROM favourites "
+                "WHERE chat_id = ?",
+                (bus_stop_code, str(chat_id)),
+            ).fetchone()
+            if present:
+                return False
+            if count >= self.limit:
+                raise self.too_many()
+            db.execute(
+                "INSERT INTO favourites VALUES (?, ?, ?)",
+                (str(chat_id), bus_stop_code, time.time()),
+            )
+        return True
+
+    def remove(self, chat_id: str, bus_stop_code: str) -> bool:
+        db = self._connection()
+        with db:
+            removed = db.execute(
+                "DELETE FROM favourites WHERE chat_id = ? AND bus_stop_code = ?",
+                (str(chat_id), bus_stop_code),
+            ).rowcount
+        return removed == 1
+
+
+# Checks the limit and adds the bus stop in one step, so that workers adding at once
+# cannot go past it. Returns 1 if added, 0 if already a favourite and -1 if full.
+REDIS_ADD_SCRIPT = """
+if redis.call("ZSCORE", KEYS[1], ARGV[1]) then
+    return 0
+end
+if redis.call("ZCARD", KEYS[1]) >= tonumber(ARGV[3]) then
+    return -1
+end
+redis.call("ZADD", KEYS[1], ARGV[2], ARGV[1])
+return 1
+"""
+
+
+class RedisFavouriteStore(FavouriteStore):
+    """Favourites in Redis, shared by every machine, as a sorted set per chat scored by
+    when each bus stop was added.
+
+    The keys have no TTL, so a server evicting with the volatile-lru policy recommended
+    for the state backends keeps them. The server must persist its data for favourites
+    to survive its restarts.
+    """
+
+    def __init__(
+        self,
+        url: str = STATE_REDIS_URL,
+        limit: int = MAX_FAVOURITES,
+        prefix: str = "favourites",
+    ):
+        """
+        Args:
+            url (str): Redis URL, e.g. "redis://localhost:6379/0".
+            limit (int): Most bus stops a chat can save.
+            prefix (str): Prefix of the keys.
+
+        Raises:
+            ImportError: If the redis package is not installed.
+        """
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("Favourites in Redis require the redis package") from e
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.limit = limit
+        self.prefix = prefix
+        self._add = self.client.register_script(REDIS_ADD_SCRIPT)
+
+    def _key(self, chat_id: str) -> str:
+        return f"{self.prefix}:{chat_id}"
+
+    def list(self, chat_id: str) -> list[str]:
+        return self.client.zrange(self._key(chat_id), 0, -1)
+
+    def add(self, chat_id: str, bus_stop_code: str) -> bool:
+        added = self._add(
+            keys=[self._key(chat_id)], args=[bus_stop_code, time.time(), self.limit]
+        )
+        if added < 0:
+            raise self.too_many()
+        return added == 1
+
+    def remove(self, chat_id: str, bus_stop_code: str) -> bool:
+        return self.client.zrem(self._key(chat_id), bus_stop_code) == 1
+
+
+def create_favourite_store() -> FavouriteStore:
+    """Creates the store shared as widely as the state: in Redis if STATE_BACKEND is
+    redis, and otherwise in SQLite at FAVOURITES_PATH."""
+    if STATE_BACKEND == "redis":
+        return RedisFavouriteStore(STATE_REDIS_URL, MAX_FAVOURITES)
+    return SQLiteFavouriteStore(FAVOURITES_PATH, MAX_FAVOURITES)
+
+
+_favourites: Optional[FavouriteStore] = None
+_favourites_lock = threading.Lock()
+
+
+def get_favourites() -> FavouriteStore:
+    global _favourites
+    if _favourites is None:
+        with _favourites_lock:
+            if _favourites is None:
+                _favourites = create_favourite_store()
+    return _favourites
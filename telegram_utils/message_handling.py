@@ -1,6 +1,10 @@
 import logging
+import threading
+from typing import Optional
 
 from exceptions.error_handling import handle_error
+from helpers.metrics import Counter, Gauge, Histogram, timed
+from helpers.tracing import span
 
 from .commands import (
     handle_callback_query,
@@ -10,44 +14,111 @@ from .commands import (
 )
 from .messaging import send_message
 from .state import State, clear_state, get_state
+from .state_backends import StateBackend, create_state_backend
 
 logger = logging.getLogger(__name__)
 
+# Update IDs of recently accepted updates, to drop redeliveries from Telegram. They are
+# kept in the state backend so that a redelivery reaching another worker is dropped too.
+RECENT_UPDATES_SIZE = 1000
+RECENT_UPDATES_TTL = 60 * 60
+_recent_update_ids: Optional[StateBackend] = None
+_recent_update_ids_lock = threading.Lock()
 
-def handle_message(data: dict):
+
+UPDATE_SECONDS = Histogram(
+    "bot_update_seconds", "Time taken to handle an update, by kind", ["kind"]
+)
+UPDATES = Counter(
+    "bot_updates_total",
+    "Updates handled, by kind and outcome (ok, or the error sent to the chat)",
+    ["kind", "outcome"],
+)
+UPDATES_IN_PROGRESS = Gauge(
+    "bot_updates_in_progress", "Updates being handled, by kind", ["kind"]
+)
+
+
+def get_recent_update_ids() -> StateBackend:
+    global _recent_update_ids
+    if _recent_update_ids is None:
+        with _recent_update_ids_lock:
+            if _recent_update_ids is None:
+                _recent_update_ids = create_state_backend(
+                    "recent_updates", RECENT_UPDATES_SIZE
+                )
+    return _recent_update_ids
+
+
+def get_update_chat_id(data: dict) -> Optional[int]:
+    """Returns the ID of the chat an update belongs to, or None if the update is not a
+    message or callback query."""
+    if "callback_query" in data:
+        return data["callback_query"].get("message", {}).get("chat", {}).get("id")
+    if "message" in data:
+        return data["message"].get("chat", {}).get("id")
+    return None
+
+
+def try_mark_update_received(update_id: int) -> bool:
+    """Records the update as received. Returns False if it already was, so that
+    concurrent redeliveries of an update are only accepted once."""
+    return get_recent_update_ids().add(str(update_id), "", RECENT_UPDATES_TTL)
+
+
+def unmark_update_received(update_id: int):
+    """Forgets the update, so that a redelivery of an update that could not be queued
+    is accepted."""
+    get_recent_update_ids().delete(str(update_id))
+
+
+def get_update_kind(data: dict) -> str:
     if "callback_query" in data:
-        chat_id = data["callback_query"]["message"]["chat"]["id"]
+        return "callback_query"
+    message = data.get("message", {})
+    if "location" in message:
+        return "location"
+    if message.get("text", "").lstrip().startswith("/"):
+        return "command"
+    if "text" in message:
+        return "reply"
+    return "other"
+
+
+def handle_message(data: dict):
+    kind = get_update_kind(data)
+    with UPDATES_IN_PROGRESS.track_in_progress(kind):
         try:
-            handle_callback_query(data["callback_query"])
+            with timed(UPDATE_SECONDS, UPDATES, kind), span(kind):
+                handle_update_kind(data, kind)
         except Exception as e:
-            handle_error(e, chat_id)
+            handle_error(e, get_update_chat_id(data))
 
-    if "message" in data:
-        message = data["message"]
-        chat_id = message["chat"]["id"]
-        try:
-            if "location" in message:
-                location = message["location"]
-                latitude = location["latitude"]
-                longitude = location["longitude"]
+
+def handle_update_kind(data: dict, kind: str):
+    match kind:
+        case "callback_query":
+            handle_callback_query(data["callback_query"])
+        case "location":
+            message = data["message"]
+            chat_id = message["chat"]["id"]
+            location = message["location"]
+            clear_state(chat_id)
+            handle_location(chat_id, location["latitude"], location["longitude"])
+        case "command":
+            chat_id = data["message"]["chat"]["id"]
+            # Clear state before handling command
+            clear_state(chat_id)
+            # Split command with whitespace as separator
+            message_text_list = data["message"]["text"].strip().lower().split()
+            command_word = message_text_list[0][1::]
+            args = message_text_list[1::]
+            handle_command(chat_id, command_word, args)
+        case "reply":
+            # If the bot is waiting for a reply (state not none), handle message as a reply
+            message = data["message"]
+            chat_id = message["chat"]["id"]
+            state = get_state(chat_id)
+            if state != State.NONE:
+                handle_state(chat_id, state, message)
                 clear_state(chat_id)
-                handle_location(chat_id, latitude, longitude)
-            elif "text" in message:
-                message_text = message["text"].strip().lower()
-
-                # If the message is a command, clear state before handling command
-                if message_text.startswith("/"):
-                    clear_state(chat_id)
-                    message_text_list = (
-                        message_text.lower().split()
-                    )  # Split command with whitespace as separator
-                    command_word = message_text_list[0][1::]
-                    args = message_text_list[1::]
-                    handle_command(chat_id, command_word, args)
-                # If the message is not a command and the bot is waiting for a reply (state not none), handle message as a reply
-                elif get_state(chat_id) != State.NONE:
-                    state = get_state(chat_id)
-                    handle_state(chat_id, state, message)
-                    clear_state(chat_id)
-        except Exception as e:
-            handle_error(e, chat_id)
@@ -1,30 +1,139 @@
+import atexit
 import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Iterator, Optional
 
-import dotenv
-import requests
+from config import SHUTDOWN_DRAIN_TIMEOUT, TELEGRAM_API_URL
+from helpers.http_client import create_session
+from helpers.metrics import REGISTRY, Counter, Gauge, Histogram, format_metric
+from helpers.tracing import trace_future
 
-dotenv.load_dotenv()
+from .send_scheduler import Priority, SendScheduler
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
+# Bot API calls are not idempotent, so they are only retried when the request never
+# reached Telegram (connection failures). Gateway errors such as 502 and 504 can be
+# returned after Telegram has already delivered the message, so they are not retried.
+# 429s are left to the send scheduler, which pauses the chat for retry_after.
+session = create_session(
+    retry_methods=["POST"],
+    retry_statuses=(),
+    retry_reads=False,
+    respect_retry_after=False,
+)
 
 
-def send_message(chat_id: str, text: str):
-    requests.post(
-        f"{TELEGRAM_API_URL}/sendMessage",
-        json={"chat_id": chat_id, "text": text, "parse_mode": "html"},
+TELEGRAM_SECONDS = Histogram(
+    "telegram_request_seconds", "Time taken by Bot API requests", ["method"]
+)
+TELEGRAM_REQUESTS = Counter(
+    "telegram_requests_total",
+    "Bot API requests by outcome: ok, the error code, or the error if there was none",
+    ["method", "outcome"],
+)
+TELEGRAM_IN_FLIGHT = Gauge(
+    "telegram_requests_in_flight", "Bot API requests in progress", ["method"]
+)
+
+
+def post(method: str, payload: dict) -> dict:
+    started = time.perf_counter()
+    try:
+        with TELEGRAM_IN_FLIGHT.track_in_progress(method):
+            result = session.post(f"{TELEGRAM_API_URL}/{method}", json=payload).json()
+    except Exception as e:
+        TELEGRAM_REQUESTS.inc(method, type(e).__name__)
+        raise
+    finally:
+        TELEGRAM_SECONDS.observe(time.perf_counter() - started, method)
+    TELEGRAM_REQUESTS.inc(
+        method, "ok" if result.get("ok") else str(result.get("error_code"))
+    )
+    return result
+
+
+_scheduler: Optional[SendScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> SendScheduler:
+    """Returns the scheduler all Bot API calls go through, which keeps them within
+    Telegram's rate limits. Its threads are started on first use rather than at import.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = SendScheduler(
+                    post,
+                    global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "30")),
+                    chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+                    chat_burst=float(os.getenv("TELEGRAM_CHAT_BURST", "3")),
+                    workers=int(os.getenv("TELEGRAM_SEND_WORKERS", "8")),
+                )
+                atexit.register(_scheduler.shutdown, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    return _scheduler
+
+
+def collect_scheduler_metrics() -> Iterator[str]:
+    # Reported once the scheduler exists, rather than starting it to report zeros
+    if _scheduler is None:
+        return
+    stats = _scheduler.stats()
+    for name, type, help in (
+        ("queue_depth", "gauge", "Bot API requests waiting to be sent"),
+        ("in_flight", "gauge", "Bot API requests being sent"),
+        ("sent", "counter", "Bot API requests that succeeded"),
+        ("failed", "counter", "Bot API requests that failed"),
+        ("dropped", "counter", "Bot API requests dropped as stale or at shutdown"),
+        ("rate_limited", "counter", "Bot API requests answered with 429 and requeued"),
+        ("latency_p50", "gauge", "Median seconds from queueing to response"),
+        ("latency_p95", "gauge", "95th percentile seconds from queueing to response"),
+    ):
+        if stats[name] is None:
+            continue
+        suffix = "_total" if type == "counter" else ""
+        yield from format_metric(
+            f"telegram_send_{name}{suffix}", type, help, [((), stats[name])]
+        )
+
+
+REGISTRY.register_collector("send_scheduler", collect_scheduler_metrics)
+
+
+def submit(
+    method: str,
+    payload: dict,
+    chat_id: Optional[str] = None,
+    priority: Priority = Priority.REPLY,
+) -> Future:
+    future = get_scheduler().submit(method, payload, chat_id=chat_id, priority=priority)
+    # A traced update stays open until its replies are answered
+    trace_future(f"telegram.{method}", future)
+    return future
+
+
+def send_message(chat_id: str, text: str) -> Future:
+    return submit(
+        "sendMessage",
+        {"chat_id": chat_id, "text": text, "parse_mode": "html"},
+        chat_id=chat_id,
     )
 
 
-def send_message_inline_keyboard(chat_id: str, text: str, buttons: list[list[dict]]):
-    requests.post(
-        f"{TELEGRAM_API_URL}/sendMessage",
-        json={
+def send_message_inline_keyboard(
+    chat_id: str, text: str, buttons: list[list[dict]]
+) -> Future:
+    return submit(
+        "sendMessage",
+        {
             "chat_id": chat_id,
             "text": text,
             "reply_markup": {"inline_keyboard": buttons},
             "parse_mode": "html",
         },
+        chat_id=chat_id,
     )
 
 
@@ -36,22 +145,47 @@ def send_message_inline_keyboard_from_list(chat_id: str, text: str, list: list[a
     send_message_inline_keyboard(chat_id, text, inline_keyboard)
 
 
-def answerCallbackQuery(callback_query_id: str):
-    requests.post(
-        f"{TELEGRAM_API_URL}/answerCallbackQuery",
-        json={"callback_query_id": callback_query_id},
+def edit_message_inline_keyboard(
+    chat_id: str,
+    message_id: int,
+    text: str,
+    buttons: list[list[dict]],
+    priority: Priority = Priority.REPLY,
+) -> Future:
+    return submit(
+        "editMessageText",
+        {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "text": text,
+            "reply_markup": {"inline_keyboard": buttons},
+            "parse_mode": "html",
+        },
+        chat_id=chat_id,
+        priority=priority,
     )
 
 
-def send_location(chat_id: str, latitude: str, longitude: str):
-    requests.post(
-        f"{TELEGRAM_API_URL}/sendLocation",
-        json={"chat_id": chat_id, "longitude": longitude, "latitude": latitude},
+def answerCallbackQuery(callback_query_id: str, text: Optional[str] = None) -> Future:
+    payload = {"callback_query_id": callback_query_id}
+    if text:
+        # Shown to the user as a brief notification
+        payload["text"] = text
+    return submit("answerCallbackQuery", payload, priority=Priority.CALLBACK_ANSWER)
+
+
+def send_location(chat_id: str, latitude: str, longitude: str) -> Future:
+    return submit(
+        "sendLocation",
+        {"chat_id": chat_id, "longitude": longitude, "latitude": latitude},
+        chat_id=chat_id,
     )
 
 
-def typing(chat_id: str):
-    requests.post(
-        f"{TELEGRAM_API_URL}/sendChatAction",
-        json={"chat_id": chat_id, "action": "typing"},
+def typing(chat_id: str) -> Future:
+    return submit(
+        "sendChatAction",
+        {"chat_id": chat_id, "action": "typing"},
+        chat_id=chat_id,
+        priority=Priority.CHAT_ACTION,
     )
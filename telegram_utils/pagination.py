@@ -0,0 +1,79 @@
+"""Long inline keyboards shown a page at a time, such as the stops of a trunk route.
+
+A page is a window of rows starting at any row, followed by Prev and Next buttons. The
+callback data of those buttons is built by the caller from the row the page starts at,
+so that it can also name the list being paged through, such as a route or a search
+query. Pressing one edits the message in place rather than sending another.
+"""
+
+import os
+from typing import Callable
+
+import config  # noqa: F401 - loads .env before the settings below are read
+
+KEYBOARD_PAGE_SIZE = int(os.getenv("KEYBOARD_PAGE_SIZE", "10"))
+# Telegram rejects buttons with longer callback data, in bytes
+MAX_CALLBACK_DATA = 64
+
+
+class Page:
+    __slots__ = ("keyboard", "start", "end", "total")
+
+    def __init__(self, keyboard: list[list[dict]], start: int, end: int, total: int):
+        self.keyboard = keyboard
+        self.start = start
+        self.end = end
+        self.total = total
+
+    @property
+    def is_whole(self) -> bool:
+        return self.start == 0 and self.end == self.total
+
+    def describe(self) -> str:
+        """Returns which rows the page shows, like "11-20 of 84"."""
+        return f"{self.start + 1}-{self.end} of {self.total}"
+
+
+def fits_callback_data(data: str) -> bool:
+    return len(data.encode()) <= MAX_CALLBACK_DATA
+
+
+def paginate(
+    rows: list[list[dict]],
+    start: int,
+    page_callback: Callable[[int], str],
+    page_size: int = KEYBOARD_PAGE_SIZE,
+) -> Page:
+    """Returns the page of the keyboard starting at the row.
+
+    Args:
+        rows (list[list[dict]]): Rows of the whole keyboard, which are not copied.
+        start (int): Index of the first row of the page; out of range values are moved
+                     to the nearest page.
+        page_callback (Callable[[int], str]): Returns the callback data of a button
+                                              showing the page starting at a row.
+        page_size (int): Most rows on a page, besides the row of Prev and Next.
+
+    Returns:
+        Page: The page. If the callback data of its Prev or Next button would be too
+              long for Telegram, it has neither, so only the first page can be shown.
+    """
+    total = len(rows)
+    start = max(0, min(start, total - page_size))
+    end = min(start + page_size, total)
+    navigation = []
+    if start > 0:
+        navigation.append(
+            {
+                "text": "‹ Prev",
+                "callback_data": page_callback(max(0, start - page_size)),
+            }
+        )
+    if end < total:
+        navigation.append({"text": "Next ›", "callback_data": page_callback(end)})
+    if not all(fits_callback_data(button["callback_data"]) for button in navigation):
+        start, end, navigation = 0, min(page_size, total), []
+    keyboard = rows[start:end]
+    if navigation:
+        keyboard.append(navigation)
+    return Page(keyboard, start, end, total)
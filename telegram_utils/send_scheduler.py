@@ -0,0 +1,369 @@
+import heapq
+import itertools
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import IntEnum
+from typing import Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Chat state (token buckets, last sent sequence) is dropped after this long without activity
+CHAT_IDLE_SECONDS = 60
+
+
+class Priority(IntEnum):
+    """Lower values are sent first."""
+
+    CALLBACK_ANSWER = 0
+    REPLY = 1
+    CHAT_ACTION = 2
+    # Messages not answering the user, such as live tracking edits, which wait for
+    # every reply but count against the chat's limit like one
+    BACKGROUND = 3
+
+    @property
+    def is_message(self) -> bool:
+        """Whether requests of this priority count against the per-chat limit."""
+        return self in (Priority.REPLY, Priority.BACKGROUND)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Returns the number of seconds until a token is available."""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = (
+        "method",
+        "payload",
+        "chat_id",
+        "priority",
+        "sequence",
+        "future",
+        "enqueued_at",
+    )
+
+    def __init__(self, method, payload, chat_id, priority, sequence):
+        self.method = method
+        self.payload = payload
+        self.chat_id = chat_id
+        self.priority = priority
+        self.sequence = sequence
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class SendScheduler:
+    """Sends Bot API requests from a priority queue while staying within Telegram's limits.
+
+    A global token bucket caps requests per second across all chats, and a token bucket
+    per chat caps messages to any one chat. Requests for the same chat are sent one at a
+    time in the order they were queued (within a priority). A 429 response pauses the chat
+    (or every chat, for requests without one) for the retry_after it specifies and the
+    request is retried. Chat actions are dropped if a later message to the chat has
+    already been sent, since Telegram would keep showing them after the reply.
+
+    Each chat has its own queue. Only chats whose next request may be sent now are kept
+    in the ready heap, and throttled or paused chats wait in a heap ordered by the time
+    they become sendable, so picking the next request stays O(log n) however many chats
+    are throttled.
+    """
+
+    def __init__(
+        self,
+        post: Callable[[str, dict], Any],
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        workers: int = 8,
+    ):
+        self.post = post
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.rate_limited = 0
+        self.latencies: deque[float] = deque(maxlen=1000)
+
+        self._sequence = itertools.count()
+        self._queued = 0
+        # Requests that do not message a chat, e.g. answerCallbackQuery
+        self._unchatted: list[tuple[int, int, _Job]] = []
+        self._chat_queues: dict[Hashable, list[tuple[int, int, _Job]]] = {}
+        # (priority, sequence, chat_id) of the next request of each chat that may be
+        # sent now. Entries go stale when the chat's next request changes and are
+        # skipped when popped.
+        self._ready: list[tuple[int, int, Hashable]] = []
+        # (time, tie-breaker, chat_id) of chats waiting for their pause or token bucket
+        self._waiting: list[tuple[float, int, Hashable]] = []
+        self._chat_buckets: dict[Hashable, TokenBucket] = {}
+        self._chat_last_sent: dict[Hashable, int] = {}
+        self._chat_last_active: dict[Hashable, float] = {}
+        self._in_flight_chats: set[Hashable] = set()
+        self._in_flight = 0
+        self._paused_until: dict[Optional[Hashable], float] = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="telegram-send")
+        self._thread = threading.Thread(
+            target=self._run, name="telegram-send-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def submit(
+        self,
+        method: str,
+        payload: dict,
+        chat_id: Optional[Hashable] = None,
+        priority: Priority = Priority.REPLY,
+    ) -> Future:
+        """Queues a Bot API request.
+
+        Args:
+            method (str): Bot API method, e.g. "sendMessage".
+            payload (dict): JSON body of the request.
+            chat_id (Optional[Hashable]): Chat the request sends to, for per-chat limits
+                                          and ordering. None for requests such as
+                                          answerCallbackQuery that do not message a chat.
+            priority (Priority): Priority of the request.
+
+        Returns:
+            Future: Resolves to the decoded Bot API response, or None if it was dropped.
+        """
+        with self._condition:
+            job = _Job(method, payload, chat_id, priority, next(self._sequence))
+            if self._closed:
+                job.future.set_result(None)
+                self.dropped += 1
+                return job.future
+            self._push(job)
+            if job.chat_id is not None and self._chat_queues[job.chat_id][0][2] is job:
+                self._schedule_chat(job.chat_id, time.monotonic())
+            self._condition.notify()
+        return job.future
+
+    def stats(self) -> dict:
+        with self._condition:
+            latencies = sorted(self.latencies)
+            return {
+                "queue_depth": self._queued,
+                "in_flight": self._in_flight,
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "rate_limited": self.rate_limited,
+                "latency_p50": statistics.median(latencies) if latencies else None,
+                "latency_p95": (
+                    latencies[int(len(latencies) * 0.95)] if latencies else None
+                ),
+            }
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """Stops accepting requests and waits for queued requests to be sent."""
+        with self._condition:
+            self._closed = True
+            self._condition.wait_for(
+                lambda: self._queued == 0 and self._in_flight == 0, timeout
+            )
+            self._condition.notify_all()
+        self._executor.shutdown(wait=False)
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                self.chat_rate, self.chat_burst
+            )
+        return bucket
+
+    def _push(self, job: _Job):
+        entry = (job.priority, job.sequence, job)
+        self._queued += 1
+        if job.chat_id is None:
+            heapq.heappush(self._unchatted, entry)
+            return
+        heapq.heappush(self._chat_queues.setdefault(job.chat_id, []), entry)
+
+    def _chat_delay(self, chat_id: Hashable, job: _Job, now: float) -> float:
+        delay = self._paused_until.get(chat_id, 0) - now
+        if job.priority.is_message:
+            delay = max(delay, self._chat_bucket(chat_id).wait_time(now))
+        return delay
+
+    def _schedule_chat(self, chat_id: Hashable, now: float):
+        """Puts the chat in the ready or waiting heap according to its next request."""
+        queue = self._chat_queues.get(chat_id)
+        if not queue or chat_id in self._in_flight_chats:
+            return
+        _, sequence, job = queue[0]
+        delay = self._chat_delay(chat_id, job, now)
+        if delay > 0:
+            heapq.heappush(self._waiting, (now + delay, sequence, chat_id))
+        else:
+            heapq.heappush(self._ready, (job.priority, sequence, chat_id))
+
+    def _next_chat_job(self, now: float) -> Optional[_Job]:
+        """Returns the most urgent chat request that may be sent now, without popping it."""
+        while self._waiting and self._waiting[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._waiting)
+            self._schedule_chat(chat_id, now)
+        while self._ready:
+            _, sequence, chat_id = self._ready[0]
+            queue = self._chat_queues.get(chat_id)
+            if not queue or queue[0][1] != sequence or chat_id in self._in_flight_chats:
+                heapq.heappop(self._ready)
+                continue
+            job = queue[0][2]
+            if (
+                job.priority == Priority.CHAT_ACTION
+                and self._chat_last_sent.get(chat_id, -1) > sequence
+            ):
+                heapq.heappop(self._ready)
+                self._pop_chat_job(chat_id)
+                self._queued -= 1
+                self.dropped += 1
+                job.future.set_result(None)
+                self._schedule_chat(chat_id, now)
+                continue
+            if self._chat_delay(chat_id, job, now) > 0:
+                heapq.heappop(self._ready)
+                self._schedule_chat(chat_id, now)
+                continue
+            return job
+        return None
+
+    def _pop_chat_job(self, chat_id: Hashable) -> _Job:
+        queue = self._chat_queues[chat_id]
+        _, _, job = heapq.heappop(queue)
+        if not queue:
+            del self._chat_queues[chat_id]
+        return job
+
+    def _next_job(self, now: float) -> tuple[Optional[_Job], Optional[float]]:
+        """Pops the most urgent job that may be sent now. If there is none, returns how
+        long to wait before checking again (None to wait for a new job)."""
+        if self._queued == 0:
+            return None, None
+        global_wait = max(
+            self.global_bucket.wait_time(now), self._paused_until.get(None, 0) - now
+        )
+        if global_wait > 0:
+            return None, global_wait
+        job = self._next_chat_job(now)
+        if self._unchatted and (
+            job is None or self._unchatted[0][:2] < (job.priority, job.sequence)
+        ):
+            job = heapq.heappop(self._unchatted)[2]
+        elif job is not None:
+            heapq.heappop(self._ready)
+            self._pop_chat_job(job.chat_id)
+        else:
+            return None, (self._waiting[0][0] - now if self._waiting else None)
+        self._queued -= 1
+        return job, None
+
+    def _run(self):
+        last_prune = time.monotonic()
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed and self._queued == 0 and self._in_flight == 0:
+                        return
+                    now = time.monotonic()
+                    job, wait = self._next_job(now)
+                    if job is not None:
+                        break
+                    self._condition.wait(wait)
+                self.global_bucket.take(now)
+                if job.chat_id is not None:
+                    if job.priority.is_message:
+                        self._chat_bucket(job.chat_id).take(now)
+                    self._in_flight_chats.add(job.chat_id)
+                    self._chat_last_active[job.chat_id] = now
+                self._in_flight += 1
+                if now - last_prune > CHAT_IDLE_SECONDS:
+                    self._prune(now)
+                    last_prune = now
+            self._executor.submit(self._send, job)
+
+    def _prune(self, now: float):
+        for chat_id, last_active in list(self._chat_last_active.items()):
+            if (
+                now - last_active > CHAT_IDLE_SECONDS
+                and chat_id not in self._chat_queues
+                and chat_id not in self._in_flight_chats
+            ):
+                del self._chat_last_active[chat_id]
+                self._chat_buckets.pop(chat_id, None)
+                self._chat_last_sent.pop(chat_id, None)
+                self._paused_until.pop(chat_id, None)
+
+    def _send(self, job: _Job):
+        retry_after = None
+        result = None
+        error = None
+        try:
+            result = self.post(job.method, job.payload)
+            if isinstance(result, dict) and result.get("error_code") == 429:
+                retry_after = result.get("parameters", {}).get("retry_after", 1)
+        except Exception as e:
+            error = e
+
+        with self._condition:
+            self._in_flight -= 1
+            self._in_flight_chats.discard(job.chat_id)
+            if retry_after is not None:
+                # Requeue in its original position so later requests of the chat do not
+                # overtake it once the pause is over
+                self.rate_limited += 1
+                self._paused_until[job.chat_id] = time.monotonic() + retry_after
+                self._push(job)
+            else:
+                if job.chat_id is not None and job.priority != Priority.CHAT_ACTION:
+                    self._chat_last_sent[job.chat_id] = job.sequence
+                self.latencies.append(time.monotonic() - job.enqueued_at)
+                if error is None and (not isinstance(result, dict) or result.get("ok")):
+                    self.sent += 1
+                else:
+                    self.failed += 1
+            if job.chat_id is not None:
+                self._schedule_chat(job.chat_id, time.monotonic())
+            self._condition.notify_all()
+
+        if retry_after is not None:
+            logger.warning(
+                "Rate limited by Telegram on %s, retrying in %ss",
+                job.method,
+                retry_after,
+            )
+        elif error is not None:
+            logger.error("Telegram %s failed: %s", job.method, error)
+            job.future.set_exception(error)
+        else:
+            if isinstance(result, dict) and not result.get("ok"):
+                logger.warning(
+                    "Telegram %s failed: %s", job.method, result.get("description")
+                )
+            job.future.set_result(result)
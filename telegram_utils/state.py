@@ -1,6 +1,14 @@
+import os
+import threading
 from enum import Enum
+from typing import Optional
 
-chat_states = {}
+import config  # noqa: F401 - loads .env before the settings below are read
+
+from .state_backends import StateBackend, create_state_backend
+
+# A bare /busstop or /bus waits this long for the reply naming the stop or service
+STATE_TTL = float(os.getenv("STATE_TTL", "600"))
 
 
 class State(Enum):
@@ -9,16 +17,30 @@ class State(Enum):
     BUS = "bus"
 
 
+_chat_states: Optional[StateBackend] = None
+_chat_states_lock = threading.Lock()
+
+
+def get_chat_states() -> StateBackend:
+    """Returns the backend holding the state of each chat, creating it on first use."""
+    global _chat_states
+    if _chat_states is None:
+        with _chat_states_lock:
+            if _chat_states is None:
+                _chat_states = create_state_backend("chat_states")
+    return _chat_states
+
+
 def set_state(chat_id: str, state: State):
-    chat_states[chat_id] = state
+    get_chat_states().set(str(chat_id), state.value, STATE_TTL)
 
 
 def get_state(chat_id: str) -> State:
-    if chat_id in chat_states:
-        return chat_states[chat_id]
-    else:
+    value = get_chat_states().get(str(chat_id))
+    if value is None:
         return State.NONE
+    return State(value)
 
 
 def clear_state(chat_id: str):
-    chat_states.pop(chat_id, None)
+    get_chat_states().delete(str(chat_id))
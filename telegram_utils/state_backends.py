@@ -0,0 +1,248 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import config  # noqa: F401 - loads .env before the settings below are read
+
+# memory keeps state in the worker process, so it only works with a single worker.
+# sqlite shares it between the workers of a machine, and redis between machines.
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_SQLITE_PATH = os.getenv("STATE_SQLITE_PATH", "state.db")
+STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "10000"))
+
+# SQLite backends remove expired entries and trim to maxsize once every this many writes
+SQLITE_PRUNE_EVERY = 100
+
+
+class StateBackend:
+    """Key-value store for short-lived state, such as what reply a chat is expected to
+    send next. Every entry expires ttl seconds after it was written, and the least
+    recently written entries are evicted once there are more than maxsize of them.
+    """
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the value of the key, or None if it is absent or expired."""
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: float):
+        raise NotImplementedError
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        """Sets the key only if it is absent or expired, atomically across every worker
+        sharing the backend. Returns whether it was set."""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class MemoryStateBackend(StateBackend):
+    """State held in this process."""
+
+    def __init__(self, maxsize: int = STATE_MAX_ENTRIES):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def _set(self, key: str, value: str, expires: float):
+        self._entries[key] = (expires, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._get(key, time.monotonic())
+
+    def set(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._set(key, value, time.monotonic() + ttl)
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self._get(key, now) is not None:
+                return False
+            self._set(key, value, now + ttl)
+            return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteStateBackend(StateBackend):
+    """State in a table of a SQLite database in WAL mode, shared by every process that
+    opens the same file. Expired entries are removed, and the table trimmed to maxsize,
+    every SQLITE_PRUNE_EVERY writes of a process, so it can briefly exceed maxsize.
+    """
+
+    def __init__(
+        self, path: str, table: str = "state", maxsize: int = STATE_MAX_ENTRIES
+    ):
+        """
+        Args:
+            path (str): Path of the database file.
+            table (str): Table holding the entries, so that several backends can share
+                         a database.
+            maxsize (int): Maximum number of entries.
+        """
+        if not re.fullmatch(r"[a-z_]+", table):
+            raise ValueError(f"Invalid table name {table!r}")
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        with self._connection() as db:
+            db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            db.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections cannot be shared between threads, so each thread opens its own
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _wrote(self, db: sqlite3.Connection, now: float):
+        with self._writes_lock:
+            self._writes += 1
+            if self._writes % SQLITE_PRUNE_EVERY:
+                return
+        with db:
+            db.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (now,))
+            db.execute(
+                f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+                "ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        row = (
+            self._connection()
+            .execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires > ?",
+                (key, time.time()),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: float):
+        db = self._connection()
+        now = time.time()
+        with db:
+            db.execute(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)",
+                (key, value, now + ttl),
+            )
+        self._wrote(db, now)
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        db = self._connection()
+        now = time.time()
+        with db:
+            added = db.execute(
+                f"INSERT INTO {self.table} VALUES (?, ?, ?) ON CONFLICT (key) "
+                "DO UPDATE SET value = excluded.value, expires = excluded.expires "
+                f"WHERE {self.table}.expires <= ?",
+                (key, value, now + ttl, now),
+            ).rowcount
+        self._wrote(db, now)
+        return added == 1
+
+    def delete(self, key: str):
+        db = self._connection()
+        with db:
+            db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+
+class RedisStateBackend(StateBackend):
+    """State in Redis, or any server speaking its protocol, shared by every machine.
+
+    Entries expire through Redis TTLs. Redis has no per-prefix size limit, so maxsize is
+    not enforced here; configure the server with maxmemory and the volatile-lru policy.
+    """
+
+    def __init__(self, url: str, prefix: str = "state"):
+        """
+        Args:
+            url (str): Redis URL, e.g. "redis://localhost:6379/0".
+            prefix (str): Prefix of the keys, so that several backends can share a server.
+
+        Raises:
+            ImportError: If the redis package is not installed.
+        """
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError(
+                "The redis state backend requires the redis package"
+            ) from e
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def get(self, key: str) -> Optional[str]:
+        return self.client.get(self._key(key))
+
+    def set(self, key: str, value: str, ttl: float):
+        self.client.set(self._key(key), value, px=max(1, int(ttl * 1000)))
+
+    def add(self, key: str, value: str, ttl: float) -> bool:
+        return bool(
+            self.client.set(self._key(key), value, px=max(1, int(ttl * 1000)), nx=True)
+        )
+
+    def delete(self, key: str):
+        self.client.delete(self._key(key))
+
+
+def create_state_backend(name: str, maxsize: int = STATE_MAX_ENTRIES) -> StateBackend:
+    """Creates the backend selected by STATE_BACKEND.
+
+    Args:
+        name (str): Name of the kind of state, which keeps it apart from other kinds in a
+                    shared database or server.
+        maxsize (int): Maximum number of entries.
+
+    Raises:
+        ValueError: If STATE_BACKEND is not memory, sqlite or redis.
+
+    Returns:
+        StateBackend: The backend.
+    """
+    match STATE_BACKEND:
+        case "memory":
+            return MemoryStateBackend(maxsize)
+        case "sqlite":
+            return SQLiteStateBackend(STATE_SQLITE_PATH, name, maxsize)
+        case "redis":
+            return RedisStateBackend(STATE_REDIS_URL, name)
+        case _:
+            raise ValueError(f"Unknown STATE_BACKEND {STATE_BACKEND!r}")
@@ -0,0 +1,279 @@
+"""Live arrival tracking: timings messages kept up to date until the bus arrives.
+
+Subscriptions are grouped by bus stop, so every TRACK_INTERVAL seconds each tracked stop
+is polled once, however many chats track services at it, and each of its subscriptions
+is then updated from that response. Subscriptions expire TRACK_TIMEOUT seconds after
+they started, and at most TRACK_MAX_SUBSCRIPTIONS are kept. They are held in memory by
+the worker that started them, so they end when it shuts down, such as when its machine
+is stopped or redeployed, and are not resumed after. The subscriptions left at shutdown
+are handed to the tracker's interrupt callback, so that their messages can say they are
+no longer live.
+"""
+
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import config  # noqa: F401 - loads .env before the settings below are read
+
+logger = logging.getLogger(__name__)
+
+TRACK_INTERVAL = float(os.getenv("TRACK_INTERVAL", "30"))
+TRACK_TIMEOUT = float(os.getenv("TRACK_TIMEOUT", str(30 * 60)))
+TRACK_MAX_SUBSCRIPTIONS = int(os.getenv("TRACK_MAX_SUBSCRIPTIONS", "10000"))
+# Threads polling stops and updating their subscriptions; polls of different stops
+# overlap, so a slow DataMall response does not hold up every other stop
+TRACK_WORKERS = int(os.getenv("TRACK_WORKERS", "4"))
+
+# A subscription is identified by the chat and the message it keeps up to date
+SubscriptionKey = tuple[str, int]
+
+
+class Subscription:
+    __slots__ = (
+        "chat_id",
+        "message_id",
+        "bus_stop_code",
+        "service_no",
+        "expires",
+        "pending",
+    )
+
+    def __init__(
+        self,
+        chat_id: str,
+        message_id: int,
+        bus_stop_code: str,
+        service_no: str,
+        expires: float,
+    ):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.bus_stop_code = bus_stop_code
+        self.service_no = service_no
+        # Deadline as a time.monotonic() value
+        self.expires = expires
+        # The latest edit of the message, so that another is not queued behind it
+        self.pending: Optional[Future] = None
+
+    @property
+    def key(self) -> SubscriptionKey:
+        return (self.chat_id, self.message_id)
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return (time.monotonic() if now is None else now) >= self.expires
+
+
+class ArrivalTracker:
+    """Polls each tracked bus stop every interval on a background thread and passes
+    every subscription of the stop to update once the poll succeeds.
+
+    update returns whether to keep tracking, and is called once more for a subscription
+    that expired, so that it can mark the message as no longer live. A failed poll is
+    logged and tried again after the next interval. interrupt is called at shutdown with
+    the subscriptions still tracked, which are not updated again.
+    """
+
+    def __init__(
+        self,
+        poll: Callable[[str], Any],
+        update: Callable[[Subscription], bool],
+        interval: float = TRACK_INTERVAL,
+        timeout: float = TRACK_TIMEOUT,
+        maxsize: int = TRACK_MAX_SUBSCRIPTIONS,
+        workers: int = TRACK_WORKERS,
+        interrupt: Optional[Callable[[list[Subscription]], Any]] = None,
+    ):
+        """
+        Args:
+            poll (Callable[[str], Any]): Fetches the arrivals of a bus stop by its code.
+            update (Callable[[Subscription], bool]): Updates a subscription's message.
+            interval (float): Seconds between polls of a bus stop.
+            timeout (float): Seconds after which a subscription expires.
+            maxsize (int): Most subscriptions kept at once.
+            workers (int): Threads polling stops and updating subscriptions.
+            interrupt (Optional[Callable[[list[Subscription]], Any]]): Ends the
+                subscriptions still tracked at shutdown.
+        """
+        self.poll = poll
+        self.update = update
+        self.interrupt = interrupt
+        self.interval = interval
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self.polls = 0
+        self.poll_errors = 0
+        self.expired = 0
+        # In the order they expire, since every subscription lasts for timeout
+        self._subscriptions: OrderedDict[SubscriptionKey, Subscription] = OrderedDict()
+        self._stops: dict[str, dict[SubscriptionKey, Subscription]] = {}
+        # When each stop is next polled; a stop is in _scheduled while it is in the heap
+        # or being polled, so that it is never polled twice at once
+        self._schedule: list[tuple[float, str]] = []
+        self._scheduled: set[str] = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="tracker")
+        self._thread = threading.Thread(target=self._run, name="tracker", daemon=True)
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def start(self):
+        self._thread.start()
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """Stops polling, and passes the subscriptions still tracked to interrupt."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._condition:
+            subscriptions = list(self._subscriptions.values())
+            self._subscriptions.clear()
+            self._stops.clear()
+        if subscriptions and self.interrupt is not None:
+            try:
+                self.interrupt(subscriptions)
+            except Exception:
+                logger.exception(
+                    "Failed to end %d tracked messages at shutdown", len(subscriptions)
+                )
+
+    def subscribe(
+        self, chat_id: str, message_id: int, bus_stop_code: str, service_no: str
+    ) -> Optional[Subscription]:
+        """Starts keeping the message up to date, or restarts its timeout if it already
+        was. Returns the subscription, or None if the tracker is full."""
+        key = (chat_id, message_id)
+        with self._condition:
+            if key not in self._subscriptions and len(self) >= self.maxsize:
+                return None
+            self._remove(key)
+            subscription = Subscription(
+                chat_id,
+                message_id,
+                bus_stop_code,
+                service_no,
+                time.monotonic() + self.timeout,
+            )
+            self._subscriptions[key] = subscription
+            self._stops.setdefault(bus_stop_code, {})[key] = subscription
+            if bus_stop_code not in self._scheduled:
+                # The message was just rendered, so the stop is first polled an
+                # interval from now
+                self._scheduled.add(bus_stop_code)
+                heapq.heappush(
+                    self._schedule, (time.monotonic() + self.interval, bus_stop_code)
+                )
+            self._condition.notify_all()
+        return subscription
+
+    def unsubscribe(self, chat_id: str, message_id: int) -> bool:
+        """Stops keeping the message up to date. Returns whether it was tracked."""
+        with self._condition:
+            return self._remove((chat_id, message_id)) is not None
+
+    def get(self, chat_id: str, message_id: int) -> Optional[Subscription]:
+        return self._subscriptions.get((chat_id, message_id))
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "subscriptions": len(self._subscriptions),
+                "stops": len(self._stops),
+                "polls": self.polls,
+                "poll_errors": self.poll_errors,
+                "expired": self.expired,
+            }
+
+    def _remove(self, key: SubscriptionKey) -> Optional[Subscription]:
+        subscription = self._subscriptions.pop(key, None)
+        if subscription is None:
+            return None
+        stop = self._stops[subscription.bus_stop_code]
+        del stop[key]
+        if not stop:
+            # Left in the schedule, and dropped from it when next due
+            del self._stops[subscription.bus_stop_code]
+        return subscription
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                now = time.monotonic()
+                self._expire(now)
+                if self._schedule and self._schedule[0][0] <= now:
+                    _, code = heapq.heappop(self._schedule)
+                    if code in self._stops:
+                        self._executor.submit(self._poll, code)
+                    else:
+                        self._scheduled.discard(code)
+                    continue
+                deadlines = [self._schedule[0][0]] if self._schedule else []
+                if self._subscriptions:
+                    deadlines.append(next(iter(self._subscriptions.values())).expires)
+                self._condition.wait(min(deadlines) - now if deadlines else None)
+
+    def _expire(self, now: float):
+        while self._subscriptions:
+            subscription = next(iter(self._subscriptions.values()))
+            if not subscription.expired(now):
+                return
+            self._remove(subscription.key)
+            self.expired += 1
+            self._executor.submit(self._update, subscription)
+
+    def _poll(self, code: str):
+        try:
+            self.poll(code)
+            polled = True
+        except Exception:
+            logger.warning(
+                "Failed to poll bus stop %s for tracking", code, exc_info=True
+            )
+            polled = False
+        with self._condition:
+            self.polls += 1
+            self.poll_errors += not polled
+            subscriptions = list(self._stops.get(code, {}).values()) if polled else []
+        try:
+            for subscription in subscriptions:
+                # Expired subscriptions get their last update from _expire instead
+                with self._condition:
+                    current = self._subscriptions.get(subscription.key) is subscription
+                if (
+                    current
+                    and not subscription.expired()
+                    and not self._update(subscription)
+                ):
+                    with self._condition:
+                        if self._subscriptions.get(subscription.key) is subscription:
+                            self._remove(subscription.key)
+        finally:
+            with self._condition:
+                if code in self._stops and not self._stopped:
+                    heapq.heappush(
+                        self._schedule, (time.monotonic() + self.interval, code)
+                    )
+                    self._condition.notify_all()
+                else:
+                    self._scheduled.discard(code)
+
+    def _update(self, subscription: Subscription) -> bool:
+        try:
+            return self.update(subscription)
+        except Exception:
+            logger.exception(
+                "Failed to update tracked message %s in chat %s",
+                subscription.message_id,
+                subscription.chat_id,
+            )
+            return True
@@ -0,0 +1,132 @@
+import pytest
+
+from exceptions.exceptions import NoMoreBusError
+from lta_utils import lta_api
+from lta_utils.arrival_cache import ArrivalCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ArrivalCache(ttl=20, maxsize=10, clock=clock)
+    cache.set("12345", [{"ServiceNo": "10"}])
+    clock.now += 20
+    assert cache.get("12345") == [{"ServiceNo": "10"}]
+    clock.now += 0.1
+    assert cache.get("12345") is None
+    # Setting it again serves it for another ttl
+    cache.set("12345", [])
+    clock.now += 19
+    assert cache.get("12345") == []
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = ArrivalCache(ttl=20, maxsize=2, clock=clock)
+    cache.set("11111", [])
+    cache.set("22222", [])
+    # Looking up the older entry makes the other one the least recently used
+    assert cache.get("11111") == []
+    cache.set("33333", [])
+    assert len(cache) == 2
+    assert cache.get("22222") is None
+    assert cache.get("11111") == []
+    assert cache.get("33333") == []
+
+
+def test_hits_and_misses_are_counted(clock):
+    cache = ArrivalCache(ttl=20, maxsize=10, clock=clock)
+    cache.get("12345")
+    cache.set("12345", [])
+    cache.get("12345")
+    cache.get("12345")
+    clock.now += 21
+    cache.get("12345")
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+class Response:
+    def __init__(self, services: list[dict], status_code: int = 200):
+        self.services = services
+        self.status_code = status_code
+
+    def json(self) -> dict:
+        return {"Services": self.services}
+
+
+class StubSession:
+    def __init__(self, services: list[dict]):
+        self.services = services
+        self.calls: list[dict] = []
+
+    def get(self, url, params=None):
+        self.calls.append(params)
+        return Response(self.services)
+
+
+def service(service_no: str) -> dict:
+    return {
+        "ServiceNo": service_no,
+        "NextBus": {"EstimatedArrival": f"{service_no}-1"},
+        "NextBus2": {"EstimatedArrival": f"{service_no}-2"},
+        "NextBus3": {"EstimatedArrival": f"{service_no}-3"},
+    }
+
+
+@pytest.fixture
+def session(monkeypatch, clock) -> StubSession:
+    session = StubSession([service("10"), service("10e"), service("2")])
+    monkeypatch.setattr(lta_api, "session", session)
+    monkeypatch.setattr(
+        lta_api, "arrival_cache", ArrivalCache(ttl=20, maxsize=10, clock=clock)
+    )
+    return session
+
+
+def test_bus_timings_are_served_from_the_cached_bus_stop(session, clock):
+    services = lta_api.get_bus_services_by_code("12345")
+    assert [s["service"] for s in services] == ["10", "10e", "2"]
+    # Timings of any service at the bus stop come from the same response
+    assert lta_api.get_bus_timing("12345", "10E")[0]["EstimatedArrival"] == "10e-1"
+    assert lta_api.get_bus_timing("12345", "2")[2]["EstimatedArrival"] == "2-3"
+    with pytest.raises(NoMoreBusError):
+        lta_api.get_bus_timing("12345", "99")
+    assert session.calls == [{"BusStopCode": "12345"}]
+
+    clock.now += 21
+    lta_api.get_bus_timing("12345", "10")
+    assert len(session.calls) == 2
+
+
+def test_bus_stops_are_cached_separately(session):
+    lta_api.get_bus_timing("12345", "10")
+    lta_api.get_bus_timing("67890", "10")
+    lta_api.get_bus_timing("12345", "2")
+    assert session.calls == [{"BusStopCode": "12345"}, {"BusStopCode": "67890"}]
+
+
+class LateFlight:
+    """Single flight that a flight for the same bus stop finished just before."""
+
+    def do(self, key, fn):
+        lta_api.arrival_cache.set(key, [service("10")])
+        return fn()
+
+
+def test_leader_checks_the_cache_again(session, monkeypatch):
+    monkeypatch.setattr(lta_api, "bus_arrival_flight", LateFlight())
+    assert lta_api.get_bus_timing("12345", "10")[0]["EstimatedArrival"] == "10-1"
+    assert lta_api.get_bus_arrivals(["67890"], timeout=5) == {"67890": [service("10")]}
+    assert session.calls == []
+    # The check again is not counted, as the miss before it already was
+    assert (lta_api.arrival_cache.hits, lta_api.arrival_cache.misses) == (0, 2)
@@ -0,0 +1,35 @@
+import ast
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+PACKAGES = ("helpers", "lta_utils", "storage", "telegram_utils")
+
+
+def reads_environment(node: ast.AST) -> bool:
+    return any(
+        isinstance(child, ast.Attribute) and child.attr in ("getenv", "environ")
+        for child in ast.walk(node)
+    )
+
+
+def imports_config(node: ast.AST) -> bool:
+    if isinstance(node, ast.Import):
+        return any(alias.name == "config" for alias in node.names)
+    return isinstance(node, ast.ImportFrom) and node.module == "config"
+
+
+def test_settings_are_read_after_dotenv_is_loaded():
+    checked = []
+    for package in PACKAGES:
+        for path in sorted((ROOT / package).glob("*.py")):
+            config_imported = False
+            for node in ast.parse(path.read_text()).body:
+                if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                    # Read when called, by which time config has been imported
+                    continue
+                config_imported = config_imported or imports_config(node)
+                if reads_environment(node):
+                    assert config_imported, f"{path} reads settings before config"
+                    checked.append(path.stem)
+                    break
+    assert "tracking" in checked and "lta_api" in checked
@@ -0,0 +1,186 @@
+import io
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from storage import datamall_ingest
+from storage.datamall_ingest import (
+    JsonArrayWriter,
+    create_datamall_session,
+    fetch_dataset,
+    write_json_atomic,
+)
+
+PAGE_SIZE = 3
+
+
+class DataMallStandIn(ThreadingHTTPServer):
+    """Serves a paginated dataset like DataMall, with configurable delays and failures."""
+
+    daemon_threads = True
+
+    def __init__(self, records: list[dict]):
+        super().__init__(("127.0.0.1", 0), DataMallHandler)
+        self.records = records
+        self.delays: dict[int, float] = {}
+        # page -> number of 503s returned before the page is served
+        self.failures: dict[int, int] = {}
+        self.requests: list[int] = []
+        self.lock = threading.Lock()
+
+
+class DataMallHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server: DataMallStandIn = self.server
+        skip = int(parse_qs(urlparse(self.path).query)["$skip"][0])
+        page = skip // PAGE_SIZE
+        with server.lock:
+            server.requests.append(page)
+            failures = server.failures.get(page, 0)
+            if failures:
+                server.failures[page] = failures - 1
+        time.sleep(server.delays.get(page, 0))
+        if failures:
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = json.dumps({"value": server.records[skip : skip + PAGE_SIZE]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def datamall(monkeypatch):
+    server = DataMallStandIn([{"BusStopCode": f"{i:05}"} for i in range(20)])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        datamall_ingest, "DATAMALL_URL", f"http://127.0.0.1:{server.server_port}"
+    )
+    monkeypatch.setattr(datamall_ingest, "PAGE_SIZE", PAGE_SIZE)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_all(**kwargs) -> tuple[list[list[dict]], int]:
+    pages = []
+    total = fetch_dataset("BusStops", pages.append, **kwargs)
+    return pages, total
+
+
+def test_pages_are_emitted_in_order(datamall):
+    # Later pages arrive first
+    datamall.delays = {0: 0.2, 1: 0.1}
+    pages, total = fetch_all(max_in_flight=4)
+    assert [record for page in pages for record in page] == datamall.records
+    assert [len(page) for page in pages] == [3, 3, 3, 3, 3, 3, 2]
+    assert total == 20
+
+
+def test_requests_stop_at_first_empty_page(datamall):
+    max_in_flight = 4
+    fetch_all(max_in_flight=max_in_flight)
+    # Page 7 is the first empty page; at most max_in_flight - 1 pages were requested ahead
+    assert 7 in datamall.requests
+    assert max(datamall.requests) <= 7 + max_in_flight - 1
+    assert len(datamall.requests) == len(set(datamall.requests))
+
+
+def test_waiting_for_a_slow_page_does_not_spin(datamall):
+    datamall.delays = {0: 1}
+    wall, cpu = time.monotonic(), time.process_time()
+    fetch_all(max_in_flight=4)
+    wall, cpu = time.monotonic() - wall, time.process_time() - cpu
+    assert wall >= 1
+    assert cpu < wall / 2
+
+
+def test_unavailable_pages_are_retried(datamall):
+    datamall.failures = {0: 1, 2: 2}
+    pages, total = fetch_all(session=create_datamall_session())
+    assert [record for page in pages for record in page] == datamall.records
+    assert datamall.requests.count(2) == 3
+
+
+def test_failed_page_raises_after_earlier_pages_are_emitted(datamall):
+    datamall.failures = {2: 10}
+    pages = []
+    with pytest.raises(requests.HTTPError):
+        fetch_dataset("BusStops", pages.append, max_in_flight=2)
+    assert [record for page in pages for record in page] == datamall.records[:6]
+
+
+@pytest.mark.parametrize(
+    "items",
+    [
+        [],
+        [{"BusStopCode": "01012"}],
+        [
+            {"ServiceNo": "10", "Directions": [{"Direction": 1, "Loop": ""}]},
+            {"Description": "Blk 1 ‘Café’", "Nested": {"a": [1, 2.5, None, True]}},
+            [],
+            {},
+        ],
+    ],
+)
+def test_json_array_writer_matches_json_dump(items):
+    expected = io.StringIO()
+    json.dump(items, expected, indent=4)
+    actual = io.StringIO()
+    with JsonArrayWriter(actual) as writer:
+        for item in items:
+            writer.write(item)
+    assert actual.getvalue() == expected.getvalue()
+
+
+def test_write_json_atomic_replaces_file(tmp_path):
+    path = os.path.join(tmp_path, "bus_stops.json")
+    with open(path, "w") as f:
+        f.write("old")
+
+    def write(f):
+        assert open(path).read() == "old"
+        json.dump([1], f)
+
+    write_json_atomic(path, write)
+    assert json.load(open(path)) == [1]
+    assert os.listdir(tmp_path) == ["bus_stops.json"]
+
+
+def test_failed_write_keeps_the_old_file(tmp_path):
+    path = os.path.join(tmp_path, "bus_stops.json")
+    with open(path, "w") as f:
+        f.write("old")
+
+    def write(f):
+        with JsonArrayWriter(f) as writer:
+            writer.write({"BusStopCode": "01012"})
+            raise requests.ConnectionError("DataMall is down")
+
+    with pytest.raises(requests.ConnectionError):
+        write_json_atomic(path, write)
+    assert open(path).read() == "old"
+    assert os.listdir(tmp_path) == ["bus_stops.json"]
+
+
+def test_json_array_writer_leaves_a_failed_array_unclosed():
+    f = io.StringIO()
+    with pytest.raises(RuntimeError):
+        with JsonArrayWriter(f) as writer:
+            writer.write(1)
+            raise RuntimeError
+    with pytest.raises(json.JSONDecodeError):
+        json.loads(f.getvalue())
@@ -0,0 +1,96 @@
+import threading
+import time
+
+from telegram_utils.dispatcher import UpdateDispatcher
+
+
+def wait_until(predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_updates_of_a_chat_are_handled_in_order_one_at_a_time():
+    handled: dict[int, list[int]] = {}
+    running: dict[int, int] = {}
+    overlaps = []
+    lock = threading.Lock()
+
+    def handler(update):
+        chat_id, n = update
+        with lock:
+            running[chat_id] = running.get(chat_id, 0) + 1
+            if running[chat_id] > 1:
+                overlaps.append(update)
+        time.sleep(0.001)
+        with lock:
+            running[chat_id] -= 1
+            handled.setdefault(chat_id, []).append(n)
+
+    dispatcher = UpdateDispatcher(handler, workers=4)
+    for n in range(25):
+        for chat_id in range(4):
+            assert dispatcher.submit(chat_id, (chat_id, n))
+    dispatcher.shutdown(timeout=10)
+    assert handled == {chat_id: list(range(25)) for chat_id in range(4)}
+    assert overlaps == []
+
+
+def test_chats_are_handled_concurrently():
+    release = threading.Event()
+    started = []
+
+    def handler(update):
+        started.append(update)
+        release.wait(5)
+
+    dispatcher = UpdateDispatcher(handler, workers=2)
+    dispatcher.submit("a", "a")
+    dispatcher.submit("b", "b")
+    wait_until(lambda: len(started) == 2)
+    release.set()
+    dispatcher.shutdown(timeout=5)
+
+
+def test_updates_beyond_max_pending_are_shed():
+    release = threading.Event()
+    dispatcher = UpdateDispatcher(lambda update: release.wait(5), max_pending=3)
+    assert all(dispatcher.submit(i, i) for i in range(3))
+    assert not dispatcher.submit(3, 3)
+    assert dispatcher.shed == 1
+    release.set()
+    wait_until(lambda: dispatcher.pending == 0)
+    assert dispatcher.submit(4, 4)
+    dispatcher.shutdown(timeout=5)
+
+
+def test_shutdown_drains_queued_updates_and_rejects_new_ones():
+    handled = []
+
+    def handler(update):
+        time.sleep(0.005)
+        handled.append(update)
+
+    dispatcher = UpdateDispatcher(handler, workers=2)
+    for n in range(40):
+        dispatcher.submit(n % 3, n)
+    dispatcher.shutdown(timeout=10)
+    assert sorted(handled) == list(range(40))
+    assert dispatcher.pending == 0
+    assert not dispatcher.submit(0, "late")
+
+
+def test_handler_errors_do_not_stop_the_chat():
+    handled = []
+
+    def handler(update):
+        if update == "bad":
+            raise ValueError(update)
+        handled.append(update)
+
+    dispatcher = UpdateDispatcher(handler, workers=1)
+    for update in ["first", "bad", "last"]:
+        dispatcher.submit(1, update)
+    dispatcher.shutdown(timeout=5)
+    assert handled == ["first", "last"]
@@ -0,0 +1,174 @@
+import sys
+import types
+
+import pytest
+from test_refresh import RecordingScheduler
+
+from exceptions.exceptions import TooManyFavouritesError
+from helpers import transit_store
+from helpers.transit_store import TransitStore
+from telegram_utils import commands, favourites, messaging
+from telegram_utils.favourites import SQLiteFavouriteStore
+
+
+@pytest.fixture
+def store(tmp_path) -> SQLiteFavouriteStore:
+    return SQLiteFavouriteStore(str(tmp_path / "favourites.db"), limit=3)
+
+
+def test_favourites_are_listed_in_the_order_added(store):
+    assert store.add(1, "22222")
+    assert store.add(1, "11111")
+    assert not store.add(1, "22222")
+    assert store.add(2, "33333")
+    assert store.list(1) == ["22222", "11111"]
+    assert store.list(3) == []
+
+
+def test_favourites_are_limited_per_chat(store):
+    for code in ("11111", "22222", "33333"):
+        store.add(1, code)
+    with pytest.raises(TooManyFavouritesError):
+        store.add(1, "44444")
+    assert store.remove(1, "11111")
+    assert not store.remove(1, "11111")
+    assert store.add(1, "44444")
+
+
+def test_favourites_persist_across_stores(store):
+    store.add(1, "11111")
+    assert SQLiteFavouriteStore(store.path).list(1) == ["11111"]
+
+
+class FakeRedis:
+    """The sorted set commands the Redis store uses, with its add script run in Python."""
+
+    def __init__(self):
+        self.sets: dict[str, dict[str, float]] = {}
+
+    def zrange(self, key, start, end):
+        members = self.sets.get(key, {})
+        return sorted(members, key=lambda member: (members[member], member))
+
+    def zrem(self, key, member):
+        return int(self.sets.get(key, {}).pop(member, None) is not None)
+
+    def register_script(self, script):
+        def add(keys, args):
+            members = self.sets.setdefault(keys[0], {})
+            member, score, limit = args
+            if member in members:
+                return 0
+            if len(members) >= int(limit):
+                return -1
+            members[member] = float(score)
+            return 1
+
+        return add
+
+
+@pytest.fixture
+def redis_store(monkeypatch):
+    client = FakeRedis()
+    redis = types.ModuleType("redis")
+    redis.Redis = types.SimpleNamespace(from_url=lambda url, decode_responses: client)
+    monkeypatch.setitem(sys.modules, "redis", redis)
+    monkeypatch.setattr(favourites, "STATE_BACKEND", "redis")
+    monkeypatch.setattr(favourites, "MAX_FAVOURITES", 3)
+    return favourites.create_favourite_store()
+
+
+def test_favourites_are_shared_through_redis_when_state_is(redis_store):
+    assert isinstance(redis_store, favourites.RedisFavouriteStore)
+    assert redis_store.add(1, "22222")
+    assert redis_store.add(1, "11111")
+    assert not redis_store.add(1, "22222")
+    assert redis_store.list(1) == ["22222", "11111"]
+    assert redis_store.client.sets.keys() == {"favourites:1"}
+    redis_store.add(1, "33333")
+    with pytest.raises(TooManyFavouritesError):
+        redis_store.add(1, "44444")
+    assert redis_store.remove(1, "11111")
+    assert not redis_store.remove(1, "11111")
+    assert redis_store.list(1) == ["22222", "33333"]
+
+
+def test_favourites_are_kept_in_sqlite_otherwise(tmp_path, monkeypatch):
+    monkeypatch.setattr(favourites, "STATE_BACKEND", "sqlite")
+    monkeypatch.setattr(favourites, "FAVOURITES_PATH", str(tmp_path / "f.db"))
+    store = favourites.create_favourite_store()
+    assert isinstance(store, SQLiteFavouriteStore)
+    assert store.path == str(tmp_path / "f.db")
+
+
+@pytest.fixture
+def scheduler(store, monkeypatch):
+    stops = [
+        {
+            "BusStopCode": code,
+            "RoadName": "Test Rd",
+            "Description": f"Stop {code}",
+            "Latitude": 1.3,
+            "Longitude": 103.8,
+        }
+        for code in ("11111", "22222", "33333")
+    ]
+    monkeypatch.setattr(
+        transit_store, "_store", TransitStore.from_datasets(stops, {}, {})
+    )
+    monkeypatch.setattr(favourites, "_favourites", store)
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(messaging, "_scheduler", scheduler)
+    return scheduler
+
+
+def test_fav_sends_every_favourite_in_one_message(scheduler, monkeypatch):
+    batches = []
+
+    def get_bus_arrivals(codes, timeout):
+        batches.append(list(codes))
+        return {"11111": [], "33333": []}
+
+    monkeypatch.setattr(commands, "get_bus_arrivals", get_bus_arrivals)
+    commands.fav(42, ["add", "11111"])
+    commands.fav(42, ["add", "22222"])
+    commands.fav(42, ["add", "33333"])
+    del scheduler.requests[:]
+
+    commands.handle_command(42, "fav", [])
+    # One batch lookup for every stop, and one message
+    assert batches == [["11111", "22222", "33333"]]
+    assert scheduler.methods() == ["sendChatAction", "sendMessage"]
+    sections = scheduler.requests[1][1]["text"].split("\n\n")
+    assert [section.split("\n")[0] for section in sections] == [
+        "<b>Stop 11111 (11111)</b>",
+        "<b>Stop 22222 (22222)</b>",
+        "<b>Stop 33333 (33333)</b>",
+    ]
+    assert "Arrivals unavailable" in sections[1]
+
+
+def test_fav_without_favourites_explains_how_to_add_them(scheduler):
+    commands.fav(42, [])
+    [(method, payload)] = scheduler.requests
+    assert "/fav add" in payload["text"]
+
+
+def test_add_to_favourites_button(scheduler, store):
+    commands.handle_callback_query(
+        {
+            "id": "1",
+            "data": "fa|22222",
+            "message": {"message_id": 7, "chat": {"id": 42}},
+        }
+    )
+    assert store.list(42) == ["22222"]
+    [(method, payload)] = scheduler.requests
+    assert method == "answerCallbackQuery"
+    assert payload["text"].startswith("Added Stop 22222")
+
+
+def test_unknown_bus_stop_is_not_added(scheduler, store):
+    commands.fav(42, ["add", "99999"])
+    assert store.list(42) == []
+    assert scheduler.requests[0][1]["text"] == "No bus stops with this code"
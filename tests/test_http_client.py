@@ -0,0 +1,112 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from helpers import http_client
+from helpers.http_client import create_session
+from lta_utils import lta_api
+from telegram_utils import messaging
+
+
+class StubServer(ThreadingHTTPServer):
+    """Answers each request with the next of the given statuses, then with 200."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.statuses: list[int] = []
+        self.delay = 0.0
+        self.requests: list[str] = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/"
+
+    def next_status(self, method: str) -> int:
+        with self.lock:
+            self.requests.append(method)
+            return self.statuses.pop(0) if self.statuses else 200
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def respond(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        status = self.server.next_status(self.command)
+        time.sleep(self.server.delay)
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status in (429, 503):
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = StubServer()
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("status", [500, 502, 503, 504])
+def test_datamall_get_is_retried_on_server_errors(server, status):
+    server.statuses = [status, status]
+    response = lta_api.session.get(server.url)
+    assert response.status_code == 200
+    assert server.requests == ["GET"] * 3
+
+
+def test_datamall_get_gives_up_after_max_retries(server):
+    server.statuses = [502] * (http_client.MAX_RETRIES + 1)
+    assert lta_api.session.get(server.url).status_code == 502
+    assert len(server.requests) == http_client.MAX_RETRIES + 1
+
+
+@pytest.mark.parametrize("status", [429, 500, 502, 503, 504])
+def test_telegram_post_is_sent_once(server, status):
+    server.statuses = [status]
+    started = time.monotonic()
+    response = messaging.session.post(server.url, json={"chat_id": 1})
+    assert response.status_code == status
+    assert server.requests == ["POST"]
+    # Retry-After is left to the send scheduler
+    assert time.monotonic() - started < 1
+
+
+def test_default_timeout_is_applied(server, monkeypatch):
+    monkeypatch.setattr(http_client, "READ_TIMEOUT", 0.2)
+    session = create_session(retry_methods=["POST"], retry_reads=False)
+    adapter = session.get_adapter(server.url)
+    assert adapter.timeout == (http_client.CONNECT_TIMEOUT, 0.2)
+
+    server.delay = 1
+    started = time.monotonic()
+    with pytest.raises(requests.ConnectionError):
+        session.post(server.url)
+    assert time.monotonic() - started < 0.9
+    # A timeout passed by the caller is used instead
+    assert session.post(server.url, timeout=5).status_code == 200
+
+
+def test_real_sessions_have_default_timeouts(server):
+    timeout = (http_client.CONNECT_TIMEOUT, http_client.READ_TIMEOUT)
+    assert lta_api.session.get_adapter(server.url).timeout == timeout
+    assert messaging.session.get_adapter(server.url).timeout == timeout
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from helpers import metrics
+from helpers.metrics import Counter, Gauge, Histogram, Registry, timed
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    registry = Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    return registry
+
+
+def test_counter_sums_every_thread():
+    counter = Counter("test_total", "Test", ["kind"])
+
+    def work():
+        for _ in range(1000):
+            counter.inc("a")
+        counter.inc("b", amount=2)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.values() == {("a",): 8000, ("b",): 16}
+
+
+def test_histogram_is_rendered_cumulatively(registry):
+    histogram = Histogram("test_seconds", "Test", ["handler"], buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, "bus")
+    assert registry.render().splitlines() == [
+        "# HELP test_seconds Test",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{handler="bus",le="0.1"} 2',
+        'test_seconds_bucket{handler="bus",le="1"} 3',
+        'test_seconds_bucket{handler="bus",le="+Inf"} 4',
+        'test_seconds_sum{handler="bus"} 5.65',
+        'test_seconds_count{handler="bus"} 4',
+    ]
+
+
+def test_timed_counts_outcomes():
+    histogram = Histogram("test_seconds", "Test", ["handler"])
+    counter = Counter("test_total", "Test", ["handler", "outcome"])
+
+    @timed(histogram, counter, "bus")
+    def handler(fail: bool):
+        if fail:
+            raise KeyError()
+
+    handler(False)
+    with pytest.raises(KeyError):
+        handler(True)
+    assert counter.values() == {("bus", "ok"): 1, ("bus", "KeyError"): 1}
+    assert histogram.values()[("bus",)][-2:] != [0, 0]
+
+
+def test_gauge_tracks_in_progress():
+    gauge = Gauge("test_in_progress", "Test")
+    with gauge.track_in_progress():
+        assert gauge.values() == {(): 1}
+    assert gauge.values() == {(): 0}
+
+
+def test_label_values_are_escaped(registry):
+    Counter("test_total", "Test", ["query"]).inc('a "b"\n')
+    assert 'test_total{query="a \\"b\\"\\n"} 1' in registry.render()
+
+
+def test_collectors_are_replaced_by_name(registry):
+    registry.register_collector("test", lambda: ["test 1"])
+    registry.register_collector("test", lambda: ["test 2"])
+    assert registry.render() == "test 2\n"
@@ -0,0 +1,131 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from test_refresh import RecordingScheduler
+
+from helpers import transit_store
+from helpers.transit_store import TransitStore
+from lta_utils import lta_api
+from telegram_utils import commands, messaging
+
+
+def service(service_no: str, *minutes: int) -> dict:
+    now = datetime.now(timezone(timedelta(hours=8)))
+    buses = {
+        name: {"EstimatedArrival": (now + timedelta(minutes=m, seconds=30)).isoformat()}
+        for name, m in zip(("NextBus", "NextBus2", "NextBus3"), minutes)
+    }
+    return {"ServiceNo": service_no, **buses}
+
+
+class StubFetch:
+    """Stands in for BusArrival requests, holding the bus stops in slow until released."""
+
+    def __init__(self):
+        self.fetched = []
+        self.slow = set()
+        self.failing = set()
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+
+    def __call__(self, code):
+        with self.lock:
+            self.fetched.append(code)
+        if code in self.slow:
+            self.release.wait(5)
+        if code in self.failing:
+            raise lta_api.APIError(503)
+        services = [service("10", 3, 12)]
+        lta_api.arrival_cache.set(code, services)
+        return services
+
+
+@pytest.fixture
+def fetch(monkeypatch):
+    fetch = StubFetch()
+    monkeypatch.setattr(lta_api, "fetch_bus_arrival", fetch)
+    lta_api.arrival_cache.clear()
+    yield fetch
+    fetch.release.set()
+    lta_api.arrival_cache.clear()
+
+
+def test_cached_stops_are_not_fetched(fetch):
+    lta_api.arrival_cache.set("11111", [service("99", 1)])
+    arrivals = lta_api.get_bus_arrivals(["11111", "22222", "22222"], timeout=5)
+    assert fetch.fetched == ["22222"]
+    assert arrivals["11111"][0]["ServiceNo"] == "99"
+    assert set(arrivals) == {"11111", "22222"}
+
+
+def test_stops_are_fetched_concurrently(fetch, monkeypatch):
+    # Each request waits until every one has started, so they cannot run one by one
+    codes = [f"{10000 + i}" for i in range(4)]
+    started = threading.Barrier(len(codes), timeout=5)
+    original = fetch.__call__
+
+    def fetch_together(code):
+        started.wait()
+        return original(code)
+
+    monkeypatch.setattr(lta_api, "fetch_bus_arrival", fetch_together)
+    assert set(lta_api.get_bus_arrivals(codes, timeout=5)) == set(codes)
+
+
+def test_slow_and_failed_stops_are_left_out(fetch):
+    fetch.slow.add("22222")
+    fetch.failing.add("33333")
+    arrivals = lta_api.get_bus_arrivals(["11111", "22222", "33333"], timeout=0.2)
+    assert set(arrivals) == {"11111"}
+    # The slow request carries on, and the next lookup waits for it or reads the
+    # response it cached rather than fetching again
+    fetch.release.set()
+    assert lta_api.get_bus_arrival("22222")
+    assert fetch.fetched.count("22222") == 1
+
+
+def test_summary_lists_services_in_order():
+    summary = commands.render_arrivals_summary(
+        [service("185", 7), service("10", 3, 12), {"ServiceNo": "2", "NextBus": {}}]
+    )
+    assert summary == "<b>10</b>  3 min, 12 min\n<b>185</b>  7 min"
+    assert "Arrivals unavailable" in commands.render_arrivals_summary(None)
+    assert "No more bus" in commands.render_arrivals_summary([])
+
+
+def test_nearby_arrivals_are_one_message(fetch, monkeypatch):
+    stops = [
+        {
+            "BusStopCode": code,
+            "RoadName": "Test Rd",
+            "Description": f"Stop {code}",
+            "Latitude": 1.3 + i * 0.001,
+            "Longitude": 103.8,
+        }
+        for i, code in enumerate(["11111", "22222", "33333"])
+    ]
+    store = TransitStore.from_datasets(stops, {}, {})
+    monkeypatch.setattr(transit_store, "_store", store)
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(messaging, "_scheduler", scheduler)
+    monkeypatch.setattr(lta_api, "fetch_bus_arrival", fetch)
+    fetch.failing.add("33333")
+
+    commands.handle_callback_query(
+        {
+            "id": "1",
+            "data": "nb|1.30000|103.80000",
+            "message": {"message_id": 7, "chat": {"id": 42}},
+        }
+    )
+    assert scheduler.methods() == [
+        "sendChatAction",
+        "sendMessage",
+        "answerCallbackQuery",
+    ]
+    text = scheduler.requests[1][1]["text"]
+    sections = text.split("\n\n")
+    assert sections[0].startswith("<b>Stop 11111 (11111)</b> · 0 m")
+    assert "<b>10</b>  3 min, 12 min" in sections[1]
+    assert "Arrivals unavailable" in sections[2]
@@ -0,0 +1,123 @@
+import pytest
+from test_refresh import RecordingScheduler
+
+from helpers import transit_store
+from helpers.transit_store import TransitStore
+from telegram_utils import commands, messaging
+from telegram_utils.pagination import paginate
+
+ROWS = [[{"text": str(i), "callback_data": str(i)}] for i in range(25)]
+
+
+def page_callback(start: int) -> str:
+    return f"p|{start}"
+
+
+def texts(keyboard: list[list[dict]]) -> list[str]:
+    return [button["text"] for row in keyboard for button in row]
+
+
+def test_first_page_has_only_next():
+    page = paginate(ROWS, 0, page_callback, page_size=10)
+    assert texts(page.keyboard) == [*map(str, range(10)), "Next ›"]
+    assert page.keyboard[-1][0]["callback_data"] == "p|10"
+    assert page.describe() == "1-10 of 25"
+    # The rows are shared with the whole keyboard, which is left as it was
+    assert page.keyboard[0] is ROWS[0]
+    assert len(ROWS) == 25
+
+
+def test_middle_page_has_prev_and_next():
+    page = paginate(ROWS, 7, page_callback, page_size=10)
+    assert [button["callback_data"] for button in page.keyboard[-1]] == [
+        "p|0",
+        "p|17",
+    ]
+
+
+def test_start_past_the_end_shows_a_full_last_page():
+    page = paginate(ROWS, 24, page_callback, page_size=10)
+    assert (page.start, page.end) == (15, 25)
+    assert texts(page.keyboard[-1:]) == ["‹ Prev"]
+
+
+def test_short_keyboard_is_one_page():
+    page = paginate(ROWS[:3], 0, page_callback, page_size=10)
+    assert page.keyboard == ROWS[:3]
+    assert page.is_whole
+
+
+def test_navigation_is_dropped_if_its_callback_data_is_too_long():
+    page = paginate(ROWS, 10, lambda start: "x" * 64 + str(start), page_size=10)
+    assert page.keyboard == ROWS[:10]
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    stops = [
+        {
+            "BusStopCode": f"{10000 + i}",
+            "RoadName": "Test Rd",
+            "Description": f"Stop {i}",
+            "Latitude": 1.3,
+            "Longitude": 103.8,
+        }
+        for i in range(30)
+    ]
+    route = [{"StopSequence": i + 1, "BusStopCode": f"{10000 + i}"} for i in range(30)]
+    store = TransitStore.from_datasets(
+        stops,
+        {"10": {"ServiceNo": "10", "Operator": "SBST", "Directions": []}},
+        {"10": {"ServiceNo": "10", "1": route}},
+    )
+    monkeypatch.setattr(transit_store, "_store", store)
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(messaging, "_scheduler", scheduler)
+    return scheduler
+
+
+def callback(data: str) -> dict:
+    return {
+        "id": "1",
+        "data": data,
+        "message": {"message_id": 7, "chat": {"id": 42}},
+    }
+
+
+def test_route_starts_around_the_bus_stop(scheduler):
+    commands.handle_callback_query(callback("10|1|10015"))
+    method, payload = scheduler.requests[0]
+    assert method == "sendMessage"
+    assert payload["text"] == "Choose bus stop (14-23 of 30):"
+    assert texts(payload["reply_markup"]["inline_keyboard"])[:3] == [
+        "Stop 13",
+        "Stop 14",
+        "Stop 15",
+    ]
+
+
+def test_route_without_bus_stop_starts_at_the_first_stop(scheduler):
+    commands.handle_callback_query(callback("10|1"))
+    payload = scheduler.requests[0][1]
+    assert payload["text"] == "Choose bus stop (1-10 of 30):"
+
+
+def test_page_buttons_edit_the_message(scheduler):
+    commands.handle_callback_query(callback("pr|20|10|1"))
+    method, payload = scheduler.requests[0]
+    assert method == "editMessageText"
+    assert payload["message_id"] == 7
+    assert payload["text"] == "Choose bus stop (21-30 of 30):"
+    [prev] = payload["reply_markup"]["inline_keyboard"][-1]
+    assert prev["callback_data"] == "pr|10|10|1"
+
+
+def test_search_results_are_paged(scheduler):
+    commands.busstop(42, ["stop"])
+    payload = scheduler.requests[0][1]
+    keyboard = payload["reply_markup"]["inline_keyboard"]
+    assert len(keyboard) == 11
+    next_page = keyboard[-1][0]["callback_data"]
+    assert next_page == "ps|10|stop"
+    commands.handle_callback_query(callback(next_page))
+    assert scheduler.requests[1][0] == "editMessageText"
@@ -0,0 +1,105 @@
+import itertools
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from telegram_utils import commands, messaging
+from telegram_utils.state_backends import MemoryStateBackend
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.requests = []
+        self.priorities = []
+        self.message_ids = itertools.count(100)
+
+    def submit(self, method, payload, chat_id=None, priority=None) -> Future:
+        self.requests.append((method, payload))
+        self.priorities.append(priority)
+        future = Future()
+        future.set_result(
+            {"ok": True, "result": {"message_id": next(self.message_ids)}}
+        )
+        return future
+
+    def methods(self) -> list[str]:
+        return [method for method, _ in self.requests]
+
+
+def arrivals(minutes: int) -> list[dict]:
+    now = datetime.now(timezone(timedelta(hours=8)))
+    return [
+        {
+            "EstimatedArrival": (now + timedelta(minutes=minutes + 10 * n)).isoformat(),
+            "Load": "SEA",
+            "Type": "DD",
+        }
+        for n in range(3)
+    ]
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(messaging, "_scheduler", scheduler)
+    monkeypatch.setattr(commands, "_refreshed_messages", MemoryStateBackend())
+    monkeypatch.setattr(commands, "get_bus_stop_description", lambda code: "Opp Blk 1")
+    monkeypatch.setattr(commands, "get_bus_timing", lambda code, service: arrivals(5))
+    return scheduler
+
+
+def refresh_callback(message_id: int) -> dict:
+    return {
+        "id": "1",
+        "data": "12345:10:r",
+        "message": {"message_id": message_id, "chat": {"id": 42}},
+    }
+
+
+def test_timings_offer_refresh_in_place(scheduler):
+    commands.send_bus_timings(42, "12345", "10")
+    [(method, payload)] = scheduler.requests
+    assert method == "sendMessage"
+    assert "Updated" in payload["text"]
+    button = payload["reply_markup"]["inline_keyboard"][0][0]
+    assert button["callback_data"] == "12345:10:r"
+
+
+def test_refresh_within_cache_ttl_is_debounced(scheduler):
+    commands.send_bus_timings(42, "12345", "10")
+    commands.handle_callback_query(refresh_callback(100))
+    assert scheduler.methods() == ["sendMessage", "answerCallbackQuery"]
+    assert scheduler.requests[-1][1]["text"] == "Already up to date"
+
+
+def test_unchanged_timings_are_not_edited(scheduler, monkeypatch):
+    monkeypatch.setattr(commands.arrival_cache, "ttl", 0)
+    commands.send_bus_timings(42, "12345", "10")
+    commands.handle_callback_query(refresh_callback(100))
+    assert scheduler.methods() == ["sendMessage", "answerCallbackQuery"]
+    assert scheduler.requests[-1][1]["text"].startswith("No change since")
+
+
+def test_changed_timings_edit_the_message(scheduler, monkeypatch):
+    monkeypatch.setattr(commands.arrival_cache, "ttl", 0)
+    commands.send_bus_timings(42, "12345", "10")
+    monkeypatch.setattr(commands, "get_bus_timing", lambda code, service: arrivals(3))
+    commands.handle_callback_query(refresh_callback(100))
+    # No new message, and no bus stop location as when opened from the route
+    assert scheduler.methods() == [
+        "sendMessage",
+        "editMessageText",
+        "answerCallbackQuery",
+    ]
+    assert scheduler.requests[1][1]["message_id"] == 100
+    assert "text" not in scheduler.requests[2][1]
+
+
+def test_refresh_of_just_sent_message_is_debounced_by_its_date(scheduler):
+    # Tapped before the sent message was recorded
+    callback = refresh_callback(7)
+    callback["message"]["date"] = int(time.time())
+    commands.handle_callback_query(callback)
+    assert scheduler.methods() == ["answerCallbackQuery"]
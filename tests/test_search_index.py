@@ -0,0 +1,129 @@
+import pytest
+
+from exceptions.exceptions import NoSearchResultsError
+from helpers import transit_store
+from helpers.helpers import search_bus_stop_descriptions
+from helpers.search_index import MAX_RESULTS, SearchIndex
+from helpers.transit_store import TransitStore
+
+
+def stop(code: str, description: str, road_name: str = "Test Rd") -> dict:
+    return {
+        "BusStopCode": code,
+        "RoadName": road_name,
+        "Description": description,
+        "Latitude": 1.3,
+        "Longitude": 103.8,
+    }
+
+
+STOPS = [
+    stop("75009", "Tampines Int", "Tampines Ctrl 1"),
+    stop("75019", "Tampines Stn/Int", "Tampines Ctrl 1"),
+    stop("75351", "Opp Tampines Int", "Tampines Ave 5"),
+    stop("75221", "Blk 123", "Tampines St 11"),
+    stop("75011", "Tampines Int Bus Pk", "Tampines Ave 5"),
+    stop("75501", "Opp Blk 500", "Tampines Int Rd"),
+    stop("84009", "Bedok Interchange", "Bedok Nth Dr"),
+    stop("84011", "Aft Bedok Int", "Bedok Nth Dr"),
+]
+
+
+@pytest.fixture(scope="module")
+def index() -> SearchIndex:
+    return SearchIndex(STOPS)
+
+
+def codes(results: list[dict]) -> list[str]:
+    return [stop["BusStopCode"] for stop in results]
+
+
+def test_exact_code_comes_first(index):
+    assert codes(index.search("75351")) == ["75351"]
+    assert codes(index.search(" 84009 ")) == ["84009"]
+
+
+def test_results_are_ranked_in_tiers(index):
+    assert codes(index.search("tampines int")) == [
+        # Exact description
+        "75009",
+        # Description starting with the query
+        "75011",
+        # Description containing every token, shorter and then alphabetical first
+        "75351",
+        "75019",
+        # Only the road name contains a token
+        "75501",
+    ]
+
+
+def test_last_token_is_a_prefix(index):
+    assert codes(index.search("tampines i")) == [
+        "75009",
+        "75011",
+        "75351",
+        "75019",
+        "75501",
+    ]
+    assert codes(index.search("bed")) == ["84009", "84011"]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("tampines interchange", ["75009", "75011", "75351", "75019", "75501"]),
+        ("bedok int", ["84009", "84011"]),
+        ("bedok interchange", ["84009", "84011"]),
+        ("opposite tampines", ["75351", "75501"]),
+        ("opp tampines int", ["75351", "75501"]),
+        ("block 123", ["75221"]),
+        ("blk 123", ["75221"]),
+        ("after bedok", ["84011"]),
+    ],
+)
+def test_abbreviations_match_their_full_form(index, query, expected):
+    assert codes(index.search(query)) == expected
+
+
+def test_typos_are_tolerated(index):
+    assert codes(index.search("tampinse int")) == [
+        "75009",
+        "75351",
+        "75019",
+        "75011",
+        "75501",
+    ]
+    assert codes(index.search("bedk interchange"))[0] == "84009"
+
+
+def test_exact_matches_are_ranked_above_typos():
+    index = SearchIndex([stop("1", "Tampines Int"), stop("2", "Tampinse Int")])
+    assert codes(index.search("tampines int")) == ["1", "2"]
+    assert codes(index.search("tampinse int")) == ["2", "1"]
+
+
+def test_no_matches(index):
+    assert index.search("jurong") == []
+    assert index.search("  ") == []
+    # Short tokens are not matched fuzzily
+    assert index.search("xyz") == []
+
+
+def test_results_are_capped():
+    index = SearchIndex(
+        [stop(f"{n:05}", f"Blk {n}", "Woodlands Ave 1") for n in range(100, 220)]
+    )
+    results = index.search("woodlands")
+    assert len(results) == MAX_RESULTS
+    assert codes(results) == [f"{n:05}" for n in range(100, 100 + MAX_RESULTS)]
+    assert len(index.search("woodlnds ave", limit=5)) == 5
+    assert index.search("woodlands", limit=0) == []
+
+
+def test_search_bus_stop_descriptions(monkeypatch):
+    monkeypatch.setattr(
+        transit_store, "_store", TransitStore.from_datasets(STOPS, {}, {})
+    )
+    assert codes(search_bus_stop_descriptions("bedok int")) == ["84009", "84011"]
+    with pytest.raises(NoSearchResultsError):
+        search_bus_stop_descriptions("jurong")
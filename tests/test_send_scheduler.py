@@ -0,0 +1,181 @@
+import threading
+import time
+
+import pytest
+
+from telegram_utils.send_scheduler import Priority, SendScheduler
+
+
+class FakeTelegram:
+    """Records Bot API calls and answers them with canned responses."""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.calls: list[tuple[str, dict, float]] = []
+        self.responses: dict[str, list[dict]] = {}
+        self.concurrent: dict = {}
+        self.max_concurrent_per_chat = 0
+        self.lock = threading.Lock()
+
+    def post(self, method: str, payload: dict) -> dict:
+        chat_id = payload.get("chat_id")
+        with self.lock:
+            self.calls.append((method, payload, time.monotonic()))
+            self.concurrent[chat_id] = self.concurrent.get(chat_id, 0) + 1
+            if chat_id is not None:
+                self.max_concurrent_per_chat = max(
+                    self.max_concurrent_per_chat, self.concurrent[chat_id]
+                )
+            responses = self.responses.get(payload.get("text"))
+            response = responses.pop(0) if responses else {"ok": True}
+        time.sleep(self.delay)
+        with self.lock:
+            self.concurrent[chat_id] -= 1
+        return response
+
+    def texts(self) -> list:
+        return [payload.get("text") for _, payload, _ in self.calls]
+
+
+@pytest.fixture
+def telegram():
+    return FakeTelegram()
+
+
+@pytest.fixture
+def make_scheduler(telegram):
+    schedulers = []
+
+    def make(**kwargs):
+        kwargs.setdefault("chat_burst", 100)
+        scheduler = SendScheduler(telegram.post, **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.shutdown(timeout=5)
+
+
+def send(scheduler, text, chat_id=1, priority=Priority.REPLY, method="sendMessage"):
+    return scheduler.submit(
+        method, {"chat_id": chat_id, "text": text}, chat_id=chat_id, priority=priority
+    )
+
+
+def test_requests_are_sent_in_priority_order(telegram, make_scheduler):
+    scheduler = make_scheduler(workers=1)
+    # Holding the scheduler's lock queues every request before any is picked
+    with scheduler._condition:
+        futures = [
+            send(scheduler, "action", chat_id=1, priority=Priority.CHAT_ACTION),
+            send(scheduler, "reply", chat_id=2),
+            scheduler.submit(
+                "answerCallbackQuery",
+                {"text": "answer"},
+                priority=Priority.CALLBACK_ANSWER,
+            ),
+        ]
+    for future in futures:
+        future.result(timeout=5)
+    assert telegram.texts() == ["answer", "reply", "action"]
+
+
+def test_requests_for_a_chat_are_sent_one_at_a_time_in_order(telegram, make_scheduler):
+    telegram.delay = 0.005
+    scheduler = make_scheduler(workers=4)
+    futures = [send(scheduler, i, chat_id=i % 3) for i in range(30)]
+    for future in futures:
+        assert future.result(timeout=5) == {"ok": True}
+    for chat_id in range(3):
+        texts = [p["text"] for _, p, _ in telegram.calls if p["chat_id"] == chat_id]
+        assert texts == list(range(chat_id, 30, 3))
+    assert telegram.max_concurrent_per_chat == 1
+    assert scheduler.stats()["sent"] == 30
+
+
+def test_per_chat_rate_limit_does_not_hold_up_other_chats(telegram, make_scheduler):
+    scheduler = make_scheduler(chat_rate=1, chat_burst=1)
+    with scheduler._condition:
+        throttled = [send(scheduler, f"a{i}", chat_id="a") for i in range(3)]
+        other = send(scheduler, "b", chat_id="b")
+    other.result(timeout=5)
+    throttled[0].result(timeout=5)
+    assert telegram.texts() == ["a0", "b"]
+    assert not throttled[1].done()
+    assert scheduler.stats()["queue_depth"] == 2
+
+
+def test_rate_limited_request_is_retried_after_retry_after(telegram, make_scheduler):
+    telegram.responses["first"] = [
+        {"ok": False, "error_code": 429, "parameters": {"retry_after": 0.3}}
+    ]
+    scheduler = make_scheduler()
+    with scheduler._condition:
+        first = send(scheduler, "first", chat_id=1)
+        second = send(scheduler, "second", chat_id=1)
+    other = send(scheduler, "other", chat_id=2)
+    assert first.result(timeout=5) == {"ok": True}
+    assert second.result(timeout=5) == {"ok": True}
+    other.result(timeout=5)
+
+    texts = telegram.texts()
+    # The chat is paused and keeps its order; other chats are not affected
+    assert [t for t in texts if t != "other"] == ["first", "first", "second"]
+    assert texts.index("other") < texts.index("second")
+    times = [t for _, p, t in telegram.calls if p["text"] == "first"]
+    assert times[1] - times[0] >= 0.3
+    assert scheduler.stats()["rate_limited"] == 1
+
+
+def test_chat_action_is_dropped_once_a_later_reply_was_sent(telegram, make_scheduler):
+    scheduler = make_scheduler()
+    with scheduler._condition:
+        typing = send(
+            scheduler,
+            None,
+            priority=Priority.CHAT_ACTION,
+            method="sendChatAction",
+        )
+        reply = send(scheduler, "reply")
+    assert reply.result(timeout=5) == {"ok": True}
+    assert typing.result(timeout=5) is None
+    assert [method for method, _, _ in telegram.calls] == ["sendMessage"]
+    assert scheduler.stats()["dropped"] == 1
+
+
+def test_chat_action_before_a_reply_is_sent(telegram, make_scheduler):
+    scheduler = make_scheduler()
+    send(scheduler, None, priority=Priority.CHAT_ACTION, method="sendChatAction")
+    time.sleep(0.1)
+    send(scheduler, "reply").result(timeout=5)
+    assert [method for method, _, _ in telegram.calls] == [
+        "sendChatAction",
+        "sendMessage",
+    ]
+
+
+def test_shutdown_drains_queued_requests(telegram, make_scheduler):
+    telegram.delay = 0.01
+    scheduler = make_scheduler(workers=2)
+    futures = [send(scheduler, i, chat_id=i % 2) for i in range(20)]
+    scheduler.shutdown(timeout=5)
+    assert all(future.done() for future in futures)
+    assert len(telegram.calls) == 20
+    assert scheduler.stats()["queue_depth"] == 0
+
+    late = send(scheduler, "late")
+    assert late.result(timeout=1) is None
+    assert len(telegram.calls) == 20
+
+
+def test_failed_request_sets_exception(make_scheduler):
+    def post(method, payload):
+        raise ConnectionError("unreachable")
+
+    scheduler = SendScheduler(post)
+    future = send(scheduler, "hello")
+    with pytest.raises(ConnectionError):
+        future.result(timeout=5)
+    scheduler.shutdown(timeout=5)
+    assert scheduler.stats()["failed"] == 1
@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from lta_utils.single_flight import AsyncSingleFlight, SingleFlight
+
+CALLERS = 8
+
+
+def wait_until(predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def run_concurrently(flight: SingleFlight, fn, key="54009") -> list:
+    """Calls flight.do from CALLERS threads while fn is blocked, and returns each
+    caller's result or exception."""
+    release = threading.Event()
+    invocations = []
+
+    def blocking():
+        invocations.append(None)
+        release.wait()
+        return fn()
+
+    def call():
+        try:
+            return flight.do(key, blocking)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(CALLERS) as executor:
+        futures = [executor.submit(call) for _ in range(CALLERS)]
+        wait_until(lambda: flight.coalesced == CALLERS - 1)
+        release.set()
+        results = [future.result() for future in futures]
+    assert len(invocations) == 1
+    return results
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    result = object()
+    assert run_concurrently(flight, lambda: result) == [result] * CALLERS
+    assert flight.calls == 1
+    assert flight.coalesced == CALLERS - 1
+
+
+def test_concurrent_callers_receive_the_leaders_exception():
+    flight = SingleFlight()
+    error = ValueError("upstream failed")
+
+    def fail():
+        raise error
+
+    assert run_concurrently(flight, fail) == [error] * CALLERS
+    assert flight.calls == 1
+
+
+def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("a", lambda: 2) == 2
+    with pytest.raises(KeyError):
+        flight.do("a", lambda: {}["missing"])
+    assert flight.do("a", lambda: 3) == 3
+    assert (flight.calls, flight.coalesced) == (4, 0)
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def blocking(value):
+        release.wait()
+        return value
+
+    with ThreadPoolExecutor(2) as executor:
+        a = executor.submit(flight.do, "a", lambda: blocking("a"))
+        b = executor.submit(flight.do, "b", lambda: blocking("b"))
+        wait_until(lambda: flight.calls == 2)
+        release.set()
+        assert (a.result(), b.result()) == ("a", "b")
+    assert flight.coalesced == 0
+
+
+def test_async_concurrent_callers_share_one_call():
+    flight = AsyncSingleFlight()
+    invocations = []
+
+    async def fetch():
+        invocations.append(None)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(
+            *(flight.do("54009", fetch) for _ in range(CALLERS))
+        )
+
+    assert asyncio.run(main()) == ["result"] * CALLERS
+    assert len(invocations) == 1
+    assert (flight.calls, flight.coalesced) == (1, CALLERS - 1)
+
+
+def test_async_concurrent_callers_receive_the_leaders_exception():
+    flight = AsyncSingleFlight()
+    error = ValueError("upstream failed")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise error
+
+    async def main():
+        return await asyncio.gather(
+            *(flight.do("54009", fail) for _ in range(CALLERS)),
+            return_exceptions=True,
+        )
+
+    assert asyncio.run(main()) == [error] * CALLERS
+    assert flight.calls == 1
+
+
+def test_async_cancelled_leader_cancels_waiters():
+    flight = AsyncSingleFlight()
+
+    async def main():
+        leader = asyncio.create_task(flight.do("54009", lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(flight.do("54009", lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(leader, waiter, return_exceptions=True)
+        # A later call starts a new flight instead of reusing the cancelled one
+        assert await flight.do("54009", lambda: asyncio.sleep(0, "fresh")) == "fresh"
+        return results
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+    assert (flight.calls, flight.coalesced) == (2, 1)
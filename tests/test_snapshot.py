@@ -0,0 +1,141 @@
+import json
+import os
+import struct
+
+import pytest
+
+from exceptions.exceptions import SnapshotError
+from helpers import snapshot
+from helpers.snapshot import SNAPSHOT_FILE
+from helpers.transit_store import TransitStore, normalize_datasets
+
+BUS_STOPS = [
+    {
+        "BusStopCode": "01012",
+        "RoadName": "Victoria St",
+        "Description": "Hotel Grand Pacific",
+        "Latitude": 1.29684825487647,
+        "Longitude": 103.85253591654006,
+    },
+    {
+        "BusStopCode": "01013",
+        "RoadName": "Victoria St",
+        "Description": "St. Joseph’s Ch",
+        "Latitude": 1.29770970610083,
+        "Longitude": 103.8532247463225,
+    },
+]
+BUS_SERVICES = {
+    "12e": {
+        "ServiceNo": "12e",
+        "Operator": "SBST",
+        "Directions": [
+            {
+                "Direction": 1,
+                "Category": "EXPRESS",
+                "OriginCode": "01012",
+                "DestinationCode": "01013",
+                "AM_Peak_Freq": "08-10",
+                "AM_Offpeak_Freq": "-",
+                "PM_Peak_Freq": "08-10",
+                "PM_Offpeak_Freq": "-",
+            }
+        ],
+    },
+    "nr1": {"ServiceNo": "NR1", "Operator": "SBST", "Directions": []},
+}
+BUS_ROUTES = {
+    "12e": {
+        "ServiceNo": "12e",
+        "1": [
+            {"StopSequence": 2, "BusStopCode": "01013"},
+            {"StopSequence": 1, "BusStopCode": "01012"},
+        ],
+    }
+}
+
+
+@pytest.fixture
+def storage_dir(tmp_path):
+    for name, data in [
+        ("bus_stops.json", BUS_STOPS),
+        ("bus_services.json", BUS_SERVICES),
+        ("bus_routes.json", BUS_ROUTES),
+    ]:
+        with open(tmp_path / name, "w") as f:
+            json.dump(data, f)
+    TransitStore.from_json(tmp_path).save_snapshot(tmp_path)
+    return tmp_path
+
+
+def assert_same_data(store: TransitStore, expected: TransitStore):
+    assert store.stops == expected.stops
+    assert dict(store.services) == dict(expected.services)
+    assert store.routes == expected.routes
+
+
+def test_snapshot_returns_datasets_as_given(storage_dir):
+    stops, services, routes = normalize_datasets(BUS_STOPS, BUS_SERVICES, BUS_ROUTES)
+    store = TransitStore.from_snapshot(storage_dir)
+    assert dict(store.stops) == stops
+    assert dict(store.services) == services
+    assert dict(store.routes) == routes
+    assert store.get_stop("1012") is None
+    assert store.get_service("12E")["Directions"][0]["Category"] == "EXPRESS"
+
+
+def test_snapshot_round_trips(storage_dir):
+    store = TransitStore.from_snapshot(storage_dir)
+    assert_same_data(store, TransitStore.from_json(storage_dir))
+    assert store.get_route_directions("12E", "01013") == ("1",)
+
+
+def test_load_prefers_snapshot(storage_dir, monkeypatch):
+    def from_json(storage_dir):
+        raise AssertionError("JSON should not be loaded")
+
+    monkeypatch.setattr(TransitStore, "from_json", from_json)
+    assert TransitStore.load(storage_dir).get_stop("01012") is not None
+
+
+def test_load_falls_back_to_json_if_snapshot_is_missing(storage_dir):
+    os.remove(storage_dir / SNAPSHOT_FILE)
+    assert_same_data(
+        TransitStore.load(storage_dir), TransitStore.from_json(storage_dir)
+    )
+
+
+def test_stale_snapshot_is_rejected(storage_dir):
+    with open(storage_dir / "bus_stops.json", "w") as f:
+        json.dump(BUS_STOPS[:1], f)
+    with pytest.raises(SnapshotError, match="stale"):
+        TransitStore.from_snapshot(storage_dir)
+    assert list(TransitStore.load(storage_dir).stops) == ["01012"]
+
+
+def test_corrupt_snapshot_is_rejected(storage_dir):
+    path = storage_dir / SNAPSHOT_FILE
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(data)
+    with pytest.raises(SnapshotError, match="checksum"):
+        TransitStore.from_snapshot(storage_dir)
+    assert_same_data(
+        TransitStore.load(storage_dir), TransitStore.from_json(storage_dir)
+    )
+
+
+@pytest.mark.parametrize(
+    "data, message",
+    [
+        (b"", "truncated"),
+        (b"JSON" + bytes(64), "Not a transit snapshot"),
+        (
+            struct.pack("<4sH", snapshot.MAGIC, snapshot.VERSION + 1) + bytes(64),
+            "version",
+        ),
+    ],
+)
+def test_invalid_snapshot_is_rejected(data, message):
+    with pytest.raises(SnapshotError, match=message):
+        snapshot.read_sections(data)
@@ -0,0 +1,96 @@
+import random
+from array import array
+
+import geopy.distance
+import pytest
+
+from helpers.spatial_index import CELL_SIZE_DEG, SpatialIndex
+
+
+def random_points(count: int, seed: int = 1) -> tuple[array, array]:
+    rng = random.Random(seed)
+    latitudes = array("d", (rng.uniform(1.25, 1.45) for _ in range(count)))
+    longitudes = array("d", (rng.uniform(103.65, 104.0) for _ in range(count)))
+    return latitudes, longitudes
+
+
+def brute_force(latitudes, longitudes, latitude, longitude, k, max_radius=None):
+    """Returns what nearest() replaced: every point sorted by geodesic distance."""
+    distances = sorted(
+        (geopy.distance.geodesic((latitude, longitude), (lat, lon)).meters, i)
+        for i, (lat, lon) in enumerate(zip(latitudes, longitudes))
+    )
+    if max_radius is not None:
+        distances = [d for d in distances if d[0] <= max_radius]
+    return [(i, dist) for dist, i in distances[:k]]
+
+
+def assert_matches(index, latitude, longitude, k, max_radius=None):
+    expected = brute_force(
+        index.latitudes, index.longitudes, latitude, longitude, k, max_radius
+    )
+    result = index.nearest(latitude, longitude, k, max_radius)
+    assert [i for i, _ in result] == [i for i, _ in expected]
+    for (_, dist), (_, exact) in zip(result, expected):
+        assert dist == pytest.approx(exact, rel=1e-4)
+
+
+@pytest.fixture(scope="module")
+def index() -> SpatialIndex:
+    return SpatialIndex(*random_points(500))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_nearest_matches_geodesic_sort(index, seed):
+    rng = random.Random(seed)
+    latitude, longitude = rng.uniform(1.25, 1.45), rng.uniform(103.65, 104.0)
+    assert_matches(index, latitude, longitude, k=10)
+
+
+@pytest.mark.parametrize("max_radius", [150, 500, 1500])
+def test_nearest_is_cut_off_at_max_radius(index, max_radius):
+    assert_matches(index, 1.35, 103.8, k=50, max_radius=max_radius)
+    result = index.nearest(1.35, 103.8, 50, max_radius)
+    assert all(dist <= max_radius for _, dist in result)
+
+
+def test_nothing_within_max_radius(index):
+    assert index.nearest(1.35, 103.8, 10, max_radius=0.5) == []
+
+
+@pytest.mark.parametrize("k", [0, -1])
+def test_no_points_are_asked_for(index, k):
+    assert index.nearest(1.35, 103.8, k) == []
+
+
+def test_more_points_asked_for_than_indexed():
+    index = SpatialIndex(*random_points(5))
+    assert_matches(index, 1.35, 103.8, k=10)
+    assert len(index.nearest(1.35, 103.8, 10)) == 5
+
+
+@pytest.mark.parametrize(
+    "latitude, longitude",
+    [(1.2, 103.8), (1.35, 104.5), (0.0, 0.0), (1.6, 103.5)],
+)
+def test_query_outside_the_grid(index, latitude, longitude):
+    assert_matches(index, latitude, longitude, k=5)
+    assert_matches(index, latitude, longitude, k=5, max_radius=100_000)
+
+
+def test_points_on_cell_edges():
+    # Points exactly on the boundaries between cells, and a query between them
+    steps = [130, 131, 132]
+    latitudes = array("d", (row * CELL_SIZE_DEG for row in steps for _ in steps))
+    longitudes = array(
+        "d", (10380 * CELL_SIZE_DEG + col * 0.001 for _ in steps for col in range(3))
+    )
+    index = SpatialIndex(latitudes, longitudes)
+    for latitude in (1.30, 1.31, 1.305):
+        for longitude in (103.80, 103.801, 103.8015):
+            assert_matches(index, latitude, longitude, k=4)
+
+
+def test_empty_index():
+    index = SpatialIndex(array("d"), array("d"))
+    assert index.nearest(1.35, 103.8, 5) == []
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from telegram_utils import state_backends
+from telegram_utils.state_backends import MemoryStateBackend, SQLiteStateBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_backend(request, tmp_path, monkeypatch):
+    # Trim on every write so that the size bound is exact
+    monkeypatch.setattr(state_backends, "SQLITE_PRUNE_EVERY", 1)
+
+    def make_backend(maxsize=100):
+        if request.param == "memory":
+            return MemoryStateBackend(maxsize)
+        return SQLiteStateBackend(str(tmp_path / "state.db"), "test", maxsize)
+
+    return make_backend
+
+
+def test_set_get_delete(make_backend):
+    backend = make_backend()
+    assert backend.get("1") is None
+    backend.set("1", "bus", 60)
+    assert backend.get("1") == "bus"
+    backend.set("1", "busstop", 60)
+    assert backend.get("1") == "busstop"
+    backend.delete("1")
+    assert backend.get("1") is None
+
+
+def test_entries_expire(make_backend):
+    backend = make_backend()
+    backend.set("1", "bus", -1)
+    assert backend.get("1") is None
+
+
+def test_add_only_sets_absent_or_expired_keys(make_backend):
+    backend = make_backend()
+    assert backend.add("1", "a", 60)
+    assert not backend.add("1", "b", 60)
+    assert backend.get("1") == "a"
+    backend.set("2", "a", -1)
+    assert backend.add("2", "b", 60)
+    assert backend.get("2") == "b"
+
+
+def test_oldest_entries_are_evicted(make_backend):
+    backend = make_backend(maxsize=3)
+    for i in range(5):
+        backend.set(str(i), "bus", 60)
+    assert [backend.get(str(i)) for i in range(5)] == [None, None, "bus", "bus", "bus"]
+
+
+def test_sqlite_state_is_shared_between_backends(tmp_path):
+    path = str(tmp_path / "state.db")
+    writer = SQLiteStateBackend(path, "test")
+    reader = SQLiteStateBackend(path, "test")
+    writer.set("1", "bus", 60)
+    assert reader.get("1") == "bus"
+    # Another kind of state in the same database is kept apart
+    assert SQLiteStateBackend(path, "other").get("1") is None
+
+
+def test_sqlite_add_is_atomic_across_backends(tmp_path):
+    path = str(tmp_path / "state.db")
+    backends = [SQLiteStateBackend(path, "test") for _ in range(4)]
+    with ThreadPoolExecutor(8) as executor:
+        added = list(
+            executor.map(
+                lambda i: backends[i % len(backends)].add("update", str(i), 60),
+                range(32),
+            )
+        )
+    assert added.count(True) == 1
+
+
+def test_unknown_backend_is_rejected(monkeypatch):
+    monkeypatch.setattr(state_backends, "STATE_BACKEND", "memcached")
+    with pytest.raises(ValueError):
+        state_backends.create_state_backend("test")
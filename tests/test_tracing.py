@@ -0,0 +1,88 @@
+import json
+import threading
+from concurrent.futures import Future
+
+from helpers.tracing import NULL_SPAN, Tracer, span, trace_future, traced
+
+
+def handle(tracer: Tracer, key: int, future: Future):
+    @traced("lookup")
+    def lookup():
+        return sum(range(1000))
+
+    with tracer.resume(key):
+        with span("render"):
+            lookup()
+        trace_future("telegram.sendMessage", future)
+
+
+def test_spans_do_nothing_outside_a_trace():
+    assert span("render") is NULL_SPAN
+    assert traced("lookup")(lambda: 1)() == 1
+
+
+def test_unsampled_updates_are_not_traced(tmp_path):
+    tracer = Tracer(sample_rate=0, directory=str(tmp_path))
+    assert tracer.sample() is None
+    assert tracer.resume(1) is NULL_SPAN
+
+
+def test_trace_follows_update_to_its_replies(tmp_path):
+    tracer = Tracer(sample_rate=1, slow_seconds=0, directory=str(tmp_path))
+    trace = tracer.sample()
+    with tracer.activate(trace):
+        with span("parse"):
+            pass
+        tracer.hand_off(trace, 7)
+    future = Future()
+    thread = threading.Thread(target=handle, args=(tracer, 7, future))
+    thread.start()
+    thread.join()
+    # Not written until the reply has been answered
+    assert list(tmp_path.iterdir()) == []
+
+    future.set_result({"ok": True})
+    [path] = tmp_path.glob("trace-*-7.json")
+    with open(path) as f:
+        spans = {span["name"]: span for span in json.load(f)["spans"]}
+    assert set(spans) == {
+        "webhook",
+        "parse",
+        "dispatch",
+        "handle",
+        "render",
+        "lookup",
+        "telegram.sendMessage",
+    }
+    assert spans["lookup"]["depth"] == spans["render"]["depth"] + 1
+
+
+def test_fast_traces_are_not_written(tmp_path):
+    tracer = Tracer(sample_rate=1, slow_seconds=60, directory=str(tmp_path))
+    with tracer.activate(tracer.sample()):
+        pass
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_discarded_trace_is_not_resumed(tmp_path):
+    tracer = Tracer(sample_rate=1, slow_seconds=0, directory=str(tmp_path))
+    trace = tracer.sample()
+    with tracer.activate(trace):
+        tracer.hand_off(trace, 8)
+        tracer.discard(8)
+    assert tracer.resume(8) is NULL_SPAN
+    assert len(list(tmp_path.glob("trace-*-8.json"))) == 1
+
+
+def test_profiles_are_aggregated(tmp_path):
+    tracer = Tracer(sample_rate=1, profile=True, directory=str(tmp_path))
+    for key in range(3):
+        trace = tracer.sample()
+        with tracer.activate(trace):
+            tracer.hand_off(trace, key)
+        future = Future()
+        handle(tracer, key, future)
+        future.set_result(None)
+    assert tracer.profiled == 3
+    assert "lookup" in tracer.profile_report()
+    assert (tmp_path / "profile.pstats").exists()
@@ -0,0 +1,255 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from test_refresh import RecordingScheduler, arrivals
+
+from telegram_utils import commands, messaging
+from telegram_utils.send_scheduler import Priority
+from telegram_utils.state_backends import MemoryStateBackend
+from telegram_utils.tracking import ArrivalTracker
+
+
+class Recorder:
+    def __init__(self, keep=True):
+        self.keep = keep
+        self.polls: Counter[str] = Counter()
+        self.updates: list[tuple[int, bool]] = []
+        self.failing: set[str] = set()
+        self.updated = threading.Condition()
+
+    def poll(self, code):
+        self.polls[code] += 1
+        if code in self.failing:
+            raise RuntimeError("DataMall is down")
+
+    def update(self, subscription):
+        with self.updated:
+            self.updates.append((subscription.message_id, subscription.expired()))
+            self.updated.notify_all()
+        return self.keep
+
+    def wait_for(self, count, timeout=5):
+        with self.updated:
+            assert self.updated.wait_for(lambda: len(self.updates) >= count, timeout)
+
+
+@pytest.fixture
+def make_tracker():
+    trackers = []
+
+    def make(recorder, **kwargs):
+        kwargs = {"interval": 0.05, "timeout": 10, **kwargs}
+        tracker = ArrivalTracker(recorder.poll, recorder.update, **kwargs)
+        tracker.start()
+        trackers.append(tracker)
+        return tracker
+
+    yield make
+    for tracker in trackers:
+        tracker.shutdown(timeout=5)
+
+
+def test_stop_is_polled_once_per_interval_for_all_its_subscriptions(make_tracker):
+    recorder = Recorder()
+    tracker = make_tracker(recorder)
+    for message_id in range(50):
+        tracker.subscribe(message_id, message_id, "12345", "10")
+    tracker.subscribe(99, 99, "67890", "10")
+    recorder.wait_for(51)
+    time.sleep(0.02)
+    assert recorder.polls == {"12345": 1, "67890": 1}
+    assert sorted(message_id for message_id, _ in recorder.updates[:51]) == [
+        *range(50),
+        99,
+    ]
+    assert tracker.stats()["stops"] == 2
+
+
+def test_update_returning_false_ends_the_subscription(make_tracker):
+    recorder = Recorder(keep=False)
+    tracker = make_tracker(recorder)
+    tracker.subscribe(1, 1, "12345", "10")
+    recorder.wait_for(1)
+    time.sleep(0.15)
+    assert len(tracker) == 0
+    assert recorder.updates == [(1, False)]
+    # The stop is no longer polled once nobody tracks it
+    assert recorder.polls["12345"] == 1
+
+
+def test_expired_subscription_gets_a_last_update(make_tracker):
+    recorder = Recorder()
+    tracker = make_tracker(recorder, interval=60, timeout=0.05)
+    tracker.subscribe(1, 1, "12345", "10")
+    recorder.wait_for(1)
+    assert recorder.updates == [(1, True)]
+    assert len(tracker) == 0
+    assert tracker.stats()["expired"] == 1
+
+
+def test_failed_poll_is_retried_without_updating(make_tracker):
+    recorder = Recorder()
+    recorder.failing.add("12345")
+    tracker = make_tracker(recorder)
+    tracker.subscribe(1, 1, "12345", "10")
+    time.sleep(0.2)
+    assert recorder.polls["12345"] >= 2
+    assert recorder.updates == []
+    recorder.failing.clear()
+    recorder.wait_for(1)
+    assert tracker.stats()["poll_errors"] >= 2
+
+
+def test_subscriptions_are_bounded(make_tracker):
+    tracker = make_tracker(Recorder(), interval=60, maxsize=2)
+    assert tracker.subscribe(1, 1, "12345", "10") is not None
+    assert tracker.subscribe(2, 2, "12345", "10") is not None
+    assert tracker.subscribe(3, 3, "12345", "10") is None
+    # Tracking a tracked message again restarts it rather than taking another slot
+    assert tracker.subscribe(2, 2, "12345", "10") is not None
+    assert tracker.unsubscribe(1, 1)
+    assert tracker.subscribe(3, 3, "12345", "10") is not None
+
+
+def test_subscriptions_left_at_shutdown_are_interrupted():
+    recorder = Recorder()
+    interrupted = []
+    tracker = ArrivalTracker(
+        recorder.poll, recorder.update, interval=60, interrupt=interrupted.extend
+    )
+    tracker.start()
+    tracker.subscribe(1, 1, "12345", "10")
+    tracker.subscribe(2, 2, "67890", "10")
+    tracker.unsubscribe(2, 2)
+    tracker.shutdown(timeout=5)
+    assert [subscription.key for subscription in interrupted] == [(1, 1)]
+    assert len(tracker) == 0
+    assert recorder.updates == []
+    # Shutting down again does not interrupt them twice
+    tracker.shutdown()
+    assert len(interrupted) == 1
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = RecordingScheduler()
+    monkeypatch.setattr(messaging, "_scheduler", scheduler)
+    monkeypatch.setattr(commands, "_refreshed_messages", MemoryStateBackend())
+    monkeypatch.setattr(commands, "_tracked_messages", MemoryStateBackend())
+    monkeypatch.setattr(commands, "get_bus_stop_description", lambda code: "Opp Blk 1")
+    monkeypatch.setattr(commands, "get_bus_timing", lambda code, service: arrivals(5))
+    # Polled by hand rather than on the tracker's thread
+    tracker = ArrivalTracker(lambda code: None, commands.update_tracked_timings)
+    monkeypatch.setattr(commands, "_tracker", tracker)
+    yield scheduler
+    tracker.shutdown()
+
+
+def track_callback(message_id: int, mode: str = "t") -> dict:
+    return {
+        "id": "1",
+        "data": f"12345:10:{mode}",
+        "message": {"message_id": message_id, "chat": {"id": 42}},
+    }
+
+
+def buttons(payload: dict) -> list[str]:
+    return [
+        button["callback_data"]
+        for row in payload["reply_markup"]["inline_keyboard"]
+        for button in row
+    ]
+
+
+def test_track_edits_the_message_to_live_timings(scheduler):
+    commands.handle_callback_query(track_callback(100))
+    assert scheduler.methods() == ["editMessageText", "answerCallbackQuery"]
+    edit = scheduler.requests[0][1]
+    assert "Live until" in edit["text"]
+    assert buttons(edit) == ["12345:10:r", "12345:10:s"]
+    assert commands.get_tracker().get(42, 100) is not None
+
+
+def test_tracked_message_is_only_edited_when_timings_change(scheduler, monkeypatch):
+    commands.handle_callback_query(track_callback(100))
+    subscription = commands.get_tracker().get(42, 100)
+    assert commands.update_tracked_timings(subscription)
+    assert scheduler.methods() == ["editMessageText", "answerCallbackQuery"]
+
+    monkeypatch.setattr(commands, "get_bus_timing", lambda code, service: arrivals(3))
+    assert commands.update_tracked_timings(subscription)
+    method, payload = scheduler.requests[-1]
+    assert method == "editMessageText"
+    assert scheduler.priorities[-1] == Priority.BACKGROUND
+    assert buttons(payload) == ["12345:10:r", "12345:10:s"]
+
+
+def test_tracking_ends_when_the_bus_arrives(scheduler, monkeypatch):
+    commands.handle_callback_query(track_callback(100))
+    subscription = commands.get_tracker().get(42, 100)
+    monkeypatch.setattr(commands, "get_bus_timing", lambda code, service: arrivals(0))
+    assert not commands.update_tracked_timings(subscription)
+    payload = scheduler.requests[-1][1]
+    assert "Bus is arriving" in payload["text"]
+    assert buttons(payload) == ["12345:10:r", "12345:10:t"]
+    assert commands.get_live_until(42, 100) is None
+
+
+def test_stop_tracking_through_another_worker(scheduler):
+    commands.handle_callback_query(track_callback(100))
+    subscription = commands.get_tracker().get(42, 100)
+    # Another worker handled Stop tracking, so only the shared state was cleared
+    commands.get_tracked_messages().delete("42:100")
+    sent = len(scheduler.requests)
+    assert not commands.update_tracked_timings(subscription)
+    assert len(scheduler.requests) == sent
+
+
+def test_stop_tracking_restores_the_track_button(scheduler):
+    commands.handle_callback_query(track_callback(100))
+    commands.handle_callback_query(track_callback(100, "s"))
+    payload = scheduler.requests[-2][1]
+    assert "Tracking stopped" in payload["text"]
+    assert buttons(payload) == ["12345:10:r", "12345:10:t"]
+    assert commands.get_tracker().get(42, 100) is None
+
+
+def test_track_command_sends_live_timings(scheduler):
+    commands.handle_command(42, "track", ["12345", "10"])
+    [(method, payload)] = scheduler.requests
+    assert method == "sendMessage"
+    assert buttons(payload) == ["12345:10:r", "12345:10:s"]
+    assert commands.get_tracker().get(42, 100) is not None
+
+
+def test_arriving_is_based_on_the_next_bus():
+    now = datetime.now(timezone(timedelta(hours=8)))
+    soon = {"EstimatedArrival": (now + timedelta(seconds=30)).isoformat()}
+    later = {"EstimatedArrival": (now + timedelta(minutes=5)).isoformat()}
+    assert commands.is_arriving([soon, later])
+    assert not commands.is_arriving([{"EstimatedArrival": ""}, later])
+
+
+def test_tracked_messages_are_edited_a_last_time_at_shutdown(scheduler, monkeypatch):
+    monkeypatch.setattr(
+        commands, "get_bus_arrivals", lambda codes, timeout: {"12345": []}
+    )
+    commands.handle_callback_query(track_callback(100))
+    commands.handle_callback_query(track_callback(101))
+    # Stopped through another worker, which already edited the message
+    commands.get_tracked_messages().delete("42:101")
+    sent = len(scheduler.requests)
+
+    commands.interrupt_tracking(
+        [commands.get_tracker().get(42, 100), commands.get_tracker().get(42, 101)]
+    )
+    [(method, payload)] = scheduler.requests[sent:]
+    assert method == "editMessageText"
+    assert payload["message_id"] == 100
+    assert "Tracking stopped by a restart" in payload["text"]
+    assert "Live until" not in payload["text"]
+    assert buttons(payload) == ["12345:10:r", "12345:10:t"]
+    assert commands.get_live_until(42, 100) is None
@@ -0,0 +1,152 @@
+import copy
+import fcntl
+import json
+import os
+import time
+
+import pytest
+
+from helpers import transit_refresh, transit_store
+from helpers.snapshot import SNAPSHOT_FILE
+from helpers.transit_refresh import (
+    CHECKED_FILE,
+    LOCK_FILE,
+    TransitRefresher,
+    diff_datasets,
+    refresh_transit_data,
+    reload_transit_store,
+)
+from helpers.transit_store import TransitStore, get_transit_store, pin_transit_store
+
+
+def stop(code: str, description: str) -> dict:
+    return {
+        "BusStopCode": code,
+        "RoadName": "Test Rd",
+        "Description": description,
+        "Latitude": 1.3,
+        "Longitude": 103.8,
+    }
+
+
+DATASETS = {
+    "bus_stops.json": [stop("11111", "Alpha"), stop("22222", "Beta")],
+    "bus_services.json": {
+        "10": {"ServiceNo": "10", "Operator": "SBST", "Directions": []}
+    },
+    "bus_routes.json": {
+        "10": {
+            "ServiceNo": "10",
+            "1": [
+                {"StopSequence": 1, "BusStopCode": "11111"},
+                {"StopSequence": 2, "BusStopCode": "22222"},
+            ],
+        }
+    },
+}
+
+
+def fetchers(datasets: dict) -> dict:
+    return {
+        name: (lambda data=data: copy.deepcopy(data)) for name, data in datasets.items()
+    }
+
+
+def write_datasets(storage_dir, datasets: dict):
+    for name, data in datasets.items():
+        with open(storage_dir / name, "w") as f:
+            json.dump(data, f, indent=4)
+
+
+@pytest.fixture
+def storage_dir(tmp_path, monkeypatch):
+    write_datasets(tmp_path, DATASETS)
+    TransitStore.from_json(tmp_path).save_snapshot(tmp_path)
+    monkeypatch.setattr(
+        transit_store, "_store", TransitStore.from_snapshot(str(tmp_path))
+    )
+    return tmp_path
+
+
+def changed_datasets() -> dict:
+    datasets = copy.deepcopy(DATASETS)
+    datasets["bus_stops.json"][1]["Description"] = "Beta Interchange"
+    datasets["bus_stops.json"].append(stop("33333", "Gamma"))
+    return datasets
+
+
+def test_unchanged_datasets_are_not_rebuilt(storage_dir):
+    store = get_transit_store()
+    mtimes = {path: os.stat(path).st_mtime_ns for path in storage_dir.iterdir()}
+
+    assert not refresh_transit_data(str(storage_dir), fetchers(DATASETS))
+
+    assert get_transit_store() is store
+    assert {path: os.stat(path).st_mtime_ns for path in storage_dir.iterdir()} == mtimes
+
+
+def test_changed_datasets_are_swapped_in(storage_dir):
+    assert refresh_transit_data(str(storage_dir), fetchers(changed_datasets()))
+
+    store = get_transit_store()
+    assert store.get_stop("22222")["Description"] == "Beta Interchange"
+    assert store.get_stop("33333") is not None
+    assert TransitStore.load(str(storage_dir)).get_stop("33333") is not None
+
+
+def test_pinned_store_is_kept_until_unpinned(storage_dir):
+    with pin_transit_store():
+        store = get_transit_store()
+        refresh_transit_data(str(storage_dir), fetchers(changed_datasets()))
+        assert get_transit_store() is store
+        assert store.get_stop("33333") is None
+    assert get_transit_store().get_stop("33333") is not None
+
+
+def test_diff_lists_added_removed_and_changed_records():
+    new = changed_datasets()
+    new["bus_services.json"] = {}
+    new["bus_routes.json"] = {}
+
+    diff = diff_datasets(DATASETS, new)
+
+    assert diff["stops"] == {"added": ["33333"], "removed": [], "changed": ["22222"]}
+    assert diff["services"] == {"added": [], "removed": ["10"], "changed": []}
+    assert diff["routes"] == {"added": [], "removed": ["10"], "changed": []}
+
+
+def test_reload_picks_up_snapshot_written_by_another_worker(storage_dir):
+    assert not reload_transit_store(str(storage_dir))
+
+    write_datasets(storage_dir, changed_datasets())
+    TransitStore.from_json(str(storage_dir)).save_snapshot(str(storage_dir))
+
+    assert reload_transit_store(str(storage_dir))
+    assert get_transit_store().get_stop("33333") is not None
+
+
+def test_refresh_is_skipped_until_due(storage_dir, monkeypatch):
+    def fail():
+        raise AssertionError("Datasets should not be fetched")
+
+    monkeypatch.setattr(transit_refresh, "FETCHERS", dict.fromkeys(DATASETS, fail))
+
+    # The snapshot was just built, which counts as having checked the datasets
+    TransitRefresher(str(storage_dir), refresh_interval=60).check()
+
+
+def test_refresh_is_skipped_while_another_worker_refreshes(storage_dir, monkeypatch):
+    monkeypatch.setattr(transit_refresh, "FETCHERS", fetchers(changed_datasets()))
+    refresher = TransitRefresher(str(storage_dir), refresh_interval=60)
+    old = time.time() - 120
+    os.utime(storage_dir / SNAPSHOT_FILE, (old, old))
+
+    with open(storage_dir / LOCK_FILE, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        refresher.refresh()
+        assert get_transit_store().get_stop("33333") is None
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    refresher.refresh()
+    assert get_transit_store().get_stop("33333") is not None
+    assert time.time() - os.stat(storage_dir / CHECKED_FILE).st_mtime < 60
@@ -0,0 +1,105 @@
+import pytest
+
+from exceptions.exceptions import NoSearchResultsError, ServiceNotAtStopError
+from helpers import transit_store
+from helpers.transit_store import TransitCache, TransitStore
+from telegram_utils.commands import get_route_dir, route_keyboard
+
+
+def stop(code: str, description: str) -> dict:
+    return {
+        "BusStopCode": code,
+        "RoadName": "Test Rd",
+        "Description": description,
+        "Latitude": 1.3,
+        "Longitude": 103.8,
+    }
+
+
+def route(*codes: str) -> list[dict]:
+    # Listed out of sequence so that the store has to sort by StopSequence
+    return [
+        {"StopSequence": i + 1, "BusStopCode": code} for i, code in enumerate(codes)
+    ][::-1]
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = TransitStore.from_datasets(
+        [stop("11111", "Alpha"), stop("22222", "Beta"), stop("33333", "Gamma")],
+        {"10": {"ServiceNo": "10", "Operator": "SBST", "Directions": []}},
+        {
+            "10": {
+                "ServiceNo": "10",
+                "1": route("11111", "22222", "33333"),
+                "2": route("33333", "22222", "11111"),
+            },
+            # Direction 1 terminates at 33333, where direction 2 starts
+            "12e": {
+                "ServiceNo": "12e",
+                "1": route("11111", "22222", "33333"),
+                "2": route("33333", "11111"),
+            },
+            # Loop service that starts and ends at the same stop
+            "225G": {"ServiceNo": "225G", "1": route("11111", "22222", "11111")},
+        },
+    )
+    monkeypatch.setattr(transit_store, "_store", store)
+    return store
+
+
+def test_routes_are_ordered_by_stop_sequence(store):
+    assert store.get_route("10") == {
+        "1": ["11111", "22222", "33333"],
+        "2": ["33333", "22222", "11111"],
+    }
+
+
+def test_route_directions_lists_every_direction_serving_the_stop(store):
+    assert store.get_route_directions("10", "22222") == ("1", "2")
+
+
+def test_route_directions_lists_terminating_direction_last(store):
+    assert store.get_route_directions("12e", "33333") == ("2", "1")
+    assert store.get_route_directions("10", "33333") == ("2", "1")
+    assert store.get_route_directions("10", "11111") == ("1", "2")
+
+
+def test_loop_service_lists_direction_once(store):
+    assert store.get_route_directions("225g", "11111") == ("1",)
+    assert store.get_route_directions("225G", "22222") == ("1",)
+
+
+def test_get_route_dir_returns_continuing_direction(store):
+    assert get_route_dir("12E", "33333") == "2"
+    assert get_route_dir("12e", "22222") == "1"
+
+
+@pytest.mark.parametrize("service_no, code", [("12e", "44444"), ("999", "11111")])
+def test_get_route_dir_raises_if_service_does_not_serve_stop(store, service_no, code):
+    with pytest.raises(ServiceNotAtStopError):
+        get_route_dir(service_no, code)
+
+
+def test_transit_cache_is_invalidated_when_the_store_is_replaced(store):
+    cache = TransitCache()
+    builds = []
+
+    def build():
+        builds.append(transit_store.get_transit_store())
+        return len(builds)
+
+    assert cache.get("key", build) == 1
+    assert cache.get("key", build) == 1
+    transit_store.set_transit_store(TransitStore(store.data))
+    assert cache.get("key", build) == 2
+    assert builds[1] is not store
+
+
+def test_route_keyboard_lists_the_stops_in_order(store):
+    keyboard = route_keyboard("10", "2")
+    assert [row[0]["text"] for row in keyboard] == ["Gamma", "Beta", "Alpha"]
+    assert keyboard[0][0]["callback_data"] == "33333:10:1"
+    assert route_keyboard("10", "2") is keyboard
+    with pytest.raises(NoSearchResultsError):
+        route_keyboard("10", "3")
@@ -0,0 +1,158 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import app as app_module
+from app import create_app
+from helpers.tracing import tracer
+from helpers.transit_refresh import TransitRefresher
+
+update_ids = itertools.count(1)
+
+
+class RecordingDispatcher:
+    pending = 0
+    shed = 0
+
+    def __init__(self, accept: bool = True):
+        self.accept = accept
+        self.submitted = []
+        self.lock = threading.Lock()
+
+    def submit(self, chat_id, update) -> bool:
+        with self.lock:
+            self.submitted.append((chat_id, update["update_id"]))
+        return self.accept
+
+
+@pytest.fixture
+def dispatcher():
+    return RecordingDispatcher()
+
+
+@pytest.fixture
+def app(dispatcher):
+    return create_app(dispatcher, warm_up=False)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def message(update_id: int, chat_id: int = 42) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {"chat": {"id": chat_id}, "text": "/help"},
+    }
+
+
+def test_update_is_queued_and_acknowledged(client, dispatcher):
+    update_id = next(update_ids)
+    assert client.post("/webhook", json=message(update_id)).status_code == 200
+    assert dispatcher.submitted == [(42, update_id)]
+
+
+def test_invalid_update_is_rejected(client, dispatcher):
+    assert client.post("/webhook", data="not json").status_code == 400
+    assert client.post("/webhook", json={"message": {}}).status_code == 400
+    assert dispatcher.submitted == []
+
+
+def test_redelivered_update_is_handled_once(client, dispatcher):
+    update_id = next(update_ids)
+    for _ in range(3):
+        assert client.post("/webhook", json=message(update_id)).status_code == 200
+    assert dispatcher.submitted == [(42, update_id)]
+
+
+def test_concurrent_redeliveries_are_handled_once(app, dispatcher):
+    update_id = next(update_ids)
+    barrier = threading.Barrier(8)
+
+    def deliver(_):
+        client = app.test_client()
+        barrier.wait()
+        return client.post("/webhook", json=message(update_id)).status_code
+
+    with ThreadPoolExecutor(8) as executor:
+        assert list(executor.map(deliver, range(8))) == [200] * 8
+    assert dispatcher.submitted == [(42, update_id)]
+
+
+def test_shed_update_returns_503_and_is_accepted_on_redelivery(client, dispatcher):
+    update_id = next(update_ids)
+    dispatcher.accept = False
+    assert client.post("/webhook", json=message(update_id)).status_code == 503
+    dispatcher.accept = True
+    assert client.post("/webhook", json=message(update_id)).status_code == 200
+    assert dispatcher.submitted == [(42, update_id), (42, update_id)]
+
+
+def test_ready_only_once_warmed_up(client, app, monkeypatch):
+    monkeypatch.setattr(TransitRefresher, "start", lambda self: None)
+    assert client.get("/ping").status_code == 200
+    assert client.get("/ready").status_code == 503
+
+    app.extensions["startup"].warm_up()
+
+    response = client.get("/ready")
+    assert response.status_code == 200
+    assert response.json["ready"]
+    assert response.json["timings"]["data_load_seconds"] >= 0
+
+
+def test_metrics_are_exposed(client, monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_PORT", "9091")
+    client.post("/webhook", json=message(next(update_ids)))
+    response = client.get("/metrics", base_url="http://localhost:9091")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    assert 'webhook_requests_total{status="200"}' in response.text
+    assert "arrival_cache_hit_ratio" in response.text
+    assert "dispatcher_pending_updates 0" in response.text
+
+
+def test_metrics_require_the_metrics_port_or_token(client, monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_PORT", "9091")
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", None)
+    assert client.get("/metrics").status_code == 404
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", "secret")
+    assert client.get("/metrics").status_code == 404
+    headers = {"Authorization": "Bearer secret"}
+    assert client.get("/metrics", headers=headers).status_code == 200
+    # Nothing but /metrics is served on the metrics port
+    response = client.post(
+        "/webhook",
+        json=message(next(update_ids)),
+        base_url="http://localhost:9091",
+    )
+    assert response.status_code == 404
+    assert client.get("/ping", base_url="http://localhost:9091").status_code == 404
+
+
+def test_debug_endpoints_require_the_token(client, monkeypatch):
+    monkeypatch.setattr(app_module, "DEBUG_TOKEN", None)
+    assert client.get("/debug/tracing").status_code == 404
+    monkeypatch.setattr(app_module, "DEBUG_TOKEN", "secret")
+    assert client.get("/debug/tracing").status_code == 404
+    assert (
+        client.get(
+            "/debug/tracing", headers={"Authorization": "Bearer wrong"}
+        ).status_code
+        == 404
+    )
+
+
+def test_tracing_can_be_configured(client, monkeypatch):
+    monkeypatch.setattr(app_module, "DEBUG_TOKEN", "secret")
+    monkeypatch.setattr(tracer, "sample_rate", 0)
+    headers = {"Authorization": "Bearer secret"}
+    response = client.post("/debug/tracing", json={"sample_rate": 0.5}, headers=headers)
+    assert response.status_code == 200
+    assert response.json["sample_rate"] == 0.5
+    response = client.post("/debug/tracing", json={"sample_rate": 2}, headers=headers)
+    assert response.status_code == 400
+    assert client.get("/debug/profile", headers=headers).status_code == 200